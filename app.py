@@ -2,12 +2,30 @@ import sqlite3
 from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import os
 #importar blueprints
 from db_utils import get_db_connection, init_app_db
+from cache_productos import init_app_cache
+from hashing import init_app_hashing
+from limites import init_app_limites
+from revocacion import init_app_revocacion
+from metricas import init_app_metricas
+from consultas_lentas import init_app_consultas_lentas
+from json_rapido import init_app_json
+from compresion import init_app_compresion
+from shards import init_app_shards
+from escritura_grupal import init_app_escritura_grupal
+from cambios import init_app_cambios
+from eventos import init_app_eventos
+from resumenes import init_app_resumenes
+from semilla import init_app_semilla
+from respaldos import init_app_respaldos
 from rutas.auth import auth_bp
 from rutas.productos import productos_bp
+from rutas.lotes import lotes_bp
+from rutas.admin import admin_bp
 from rutas.main import main_bp
 
 
@@ -22,18 +40,161 @@ def create_app(test_config=None):
     
     #2 configuracion de la DB
     server.config['DATABASE'] = os.environ.get("DATABASE_PATH", "inventario.db")
+    #pool de conexiones y pragmas aplicados una vez por conexion
+    server.config.update(
+        DB_POOL_MAX=int(os.environ.get("DB_POOL_MAX", 8)),
+        DB_POOL_TIMEOUT=float(os.environ.get("DB_POOL_TIMEOUT", 5.0)),
+        DB_POOL_CHEQUEO_INACTIVIDAD=30.0,
+        DB_JOURNAL_MODE="WAL",
+        DB_SYNCHRONOUS="NORMAL",
+        DB_BUSY_TIMEOUT=5000,
+        DB_CACHE_SIZE=-16000,
+        DB_MMAP_SIZE=256 * 1024 * 1024,
+        DB_FOREIGN_KEYS=True,
+    )
+    #aplicar migraciones pendientes al crear la app (o con `flask db upgrade`)
+    server.config['MIGRAR_AL_INICIAR'] = os.environ.get("MIGRAR_AL_INICIAR", "1") == "1"
+    #tamaño de pagina del listado de productos
+    server.config.update(
+        PRODUCTOS_LIMITE_DEFECTO=100,
+        PRODUCTOS_LIMITE_MAX=1000,
+    )
+    #exportacion en streaming: filas por fetchmany
+    server.config['EXPORT_TAMANO_LOTE'] = 1000
+    #compresion de respuestas segun Accept-Encoding (br/zstd solo si brotli/zstandard estan instalados)
+    server.config.update(
+        COMPRESION_HABILITADA=True,
+        COMPRESION_MIN_BYTES=1024,
+        COMPRESION_NIVEL_GZIP=6,
+        COMPRESION_NIVEL_BR=4,
+        COMPRESION_NIVEL_ZSTD=3,
+    )
+    #lotes de escrituras (POST /productos/bulk)
+    server.config['BULK_MAX_OPERACIONES'] = 1000
+    #cache de lecturas de productos (CACHE_BACKEND: 'memoria' o un cliente tipo redis)
+    server.config.update(
+        CACHE_HABILITADA=True,
+        CACHE_BACKEND='memoria',
+        CACHE_MAX_ENTRADAS=10000,
+        CACHE_MAX_BYTES=64 * 1024 * 1024,
+        CACHE_TTL=60.0,
+    )
+    #hashing de contraseñas en un pool de procesos (0 workers = en el hilo de la peticion)
+    workers_hash = int(os.environ.get("HASH_POOL_WORKERS", os.cpu_count() or 1))
+    server.config.update(
+        HASH_POOL_WORKERS=workers_hash,
+        HASH_POOL_MAX_PENDIENTES=4 * max(workers_hash, 1),
+        HASH_TIMEOUT=10.0,
+    )
+    #token bucket por IP y por nombre de usuario en /auth (rafaga, tokens por segundo)
+    server.config.update(
+        THROTTLE_IP_CAPACIDAD=30,
+        THROTTLE_IP_RECARGA=5.0,
+        THROTTLE_USUARIO_CAPACIDAD=5,
+        THROTTLE_USUARIO_RECARGA=0.2,
+    )
+    #proxies inversos delante de la app (nginx, balanceador): con N > 0 la IP del cliente
+    #(limites por IP de /auth) sale de X-Forwarded-For; con 0 se usa la del socket
+    server.config['PROXIES_CONFIABLES'] = int(os.environ.get("PROXIES_CONFIABLES", 0))
+    #segundos entre lecturas de revocaciones hechas por otros procesos
+    server.config['REVOCACION_INTERVALO_SYNC'] = 5.0
+    #sentencias mas lentas que el umbral (segundos) se registran con su plan
+    server.config.update(
+        CONSULTAS_LENTAS_UMBRAL=float(os.environ.get("CONSULTAS_LENTAS_UMBRAL", 0.1)),
+        CONSULTAS_LENTAS_MAX=50,
+    )
+    #token para GET /metrics (Authorization: Bearer <token>); vacio = abierto, solo para redes internas
+    server.config['METRICAS_TOKEN'] = os.environ.get("METRICAS_TOKEN", "")
+    #ids (como en el JWT) con acceso a /admin
+    server.config['ADMIN_USUARIOS'] = [
+        uid.strip() for uid in os.environ.get("ADMIN_USUARIOS", "").split(",") if uid.strip()
+    ]
+    #proveedor JSON: 'auto' (orjson si esta instalado), 'orjson' o 'stdlib'
+    server.config['JSON_PROVEEDOR'] = os.environ.get("JSON_PROVEEDOR", "auto")
+    #importacion en streaming: filas por transaccion, errores reportados y largo maximo de una linea
+    server.config.update(
+        IMPORT_TAMANO_CHUNK=500,
+        IMPORT_MAX_ERRORES=100,
+        IMPORT_MAX_LINEA=64 * 1024,
+    )
+    #group commit: las escrituras concurrentes de productos se confirman juntas (opcional)
+    server.config.update(
+        GROUP_COMMIT=os.environ.get("GROUP_COMMIT", "0") == "1",
+        GROUP_COMMIT_VENTANA=0.002,
+        GROUP_COMMIT_MAX_OPERACIONES=64,
+    )
+    #feed de cambios: los tombstones se conservan CAMBIOS_RETENCION segundos (30 dias)
+    server.config.update(
+        CAMBIOS_RETENCION=30 * 24 * 3600,
+        CAMBIOS_INTERVALO_COMPACTACION=3600,
+    )
+    #stream SSE: eventos pendientes por suscriptor antes de desalojarlo, segundos entre heartbeats
+    #y entre sondeos del feed para ver escrituras de otros procesos (0 = solo las de este proceso);
+    #un Last-Event-ID con mas de EVENTOS_MAX_REENVIO cambios pendientes recibe 410 (usar /productos/changes)
+    server.config.update(
+        EVENTOS_TAMANO_COLA=100,
+        EVENTOS_MAX_REENVIO=1000,
+        EVENTOS_HEARTBEAT=15,
+        EVENTOS_SONDEO=1.0,
+    )
+    #sharding: rutas de los archivos con los productos (separadas por coma); vacio = todo en DATABASE
+    server.config.update(
+        DB_SHARDS=[ruta.strip() for ruta in os.environ.get("DB_SHARDS", "").split(",") if ruta.strip()],
+        DB_SHARDS_BLOQUE_IDS=1000,
+        DB_SHARDS_ESPERA_MOVIMIENTO=1.0,
+    )
+    #modo ASGI (asgi.py): hilos para las vistas (None = DB_POOL_MAX) y para iterar streams
+    server.config.update(
+        ASGI_HILOS=None,
+        ASGI_HILOS_STREAMS=64,
+    )
+    #snapshots en caliente: cada RESPALDOS_INTERVALO segundos (0 = solo a pedido), se conservan los N mas nuevos
+    server.config.update(
+        RESPALDOS_DIRECTORIO=os.environ.get("RESPALDOS_DIRECTORIO", "respaldos"),
+        RESPALDOS_INTERVALO=int(os.environ.get("RESPALDOS_INTERVALO", 0)),
+        RESPALDOS_CONSERVAR=int(os.environ.get("RESPALDOS_CONSERVAR", 7)),
+        RESPALDOS_COMPRIMIR=True,
+        #paginas copiadas por paso y pausa entre pasos: menos paginas o mas pausa = menos impacto, mas duracion
+        RESPALDOS_PAGINAS_POR_PASO=512,
+        RESPALDOS_PAUSA=0.005,
+    )
 
     #si se proporciona config de prueba, lo actualizamos
     if test_config is not None:
         server.config.from_mapping(test_config)
 
+    #solo se confia en tantos saltos de X-Forwarded-For como proxies haya: el resto lo controla el cliente
+    if server.config['PROXIES_CONFIABLES']:
+        saltos = server.config['PROXIES_CONFIABLES']
+        server.wsgi_app = ProxyFix(server.wsgi_app, x_for=saltos, x_proto=saltos, x_host=saltos)
+
     #3 inicializamos JWT Manager
     jwt = JWTManager(server)
 
+    #4 pool de conexiones, teardown y tablas
+    init_app_json(server)
+    init_app_db(server)
+    init_app_shards(server)
+    init_app_escritura_grupal(server)
+    init_app_cambios(server)
+    init_app_eventos(server)
+    init_app_resumenes(server)
+    init_app_semilla(server)
+    init_app_cache(server)
+    init_app_hashing(server)
+    init_app_limites(server)
+    init_app_revocacion(server, jwt)
+    init_app_metricas(server)
+    init_app_consultas_lentas(server)
+    init_app_compresion(server)
+    init_app_respaldos(server)
+
     #6 registrar blueprints
     server.register_blueprint(main_bp)
     server.register_blueprint(auth_bp, url_prefix='/auth')
     server.register_blueprint(productos_bp, url_prefix='/productos')
+    server.register_blueprint(lotes_bp, url_prefix='/productos')
+    server.register_blueprint(admin_bp, url_prefix='/admin')
 
 
     #manejor de errores
@@ -44,5 +205,6 @@ def create_app(test_config=None):
     return server
 
 if __name__ == '__main__':
+    #solo para desarrollo; en produccion: gunicorn -c gunicorn.conf.py wsgi:app
     app = create_app()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
\ No newline at end of file
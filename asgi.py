@@ -0,0 +1,6 @@
+#asgi.py
+#punto de entrada ASGI: uvicorn asgi:app  (o hypercorn asgi:app)
+from app import create_app
+from puente_asgi import AppAsgi
+
+app = AppAsgi(create_app())
@@ -0,0 +1,138 @@
+#benchmarks/bench_asgi.py
+#peticiones/s y p99 de GET /productos/ con la app WSGI (pool fijo de hilos, como gunicorn gthread) y la ASGI
+#uso: python benchmarks/bench_asgi.py [concurrencias ...]   (por defecto 16 64 256)
+#es un benchmark en proceso (sin red): mide el costo de despachar las vistas, no el del servidor HTTP
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from flask_jwt_extended import create_access_token
+from app import create_app
+from db_utils import get_db_connection
+from puente_asgi import AppAsgi
+
+PETICIONES_POR_CLIENTE = 50
+RUTA = '/productos/'
+
+
+def preparar():
+    logging.disable(logging.CRITICAL)
+    _, ruta_db = tempfile.mkstemp(suffix='.db')
+    app = create_app({'DATABASE': ruta_db, 'JWT_SECRET_KEY': 'bench-' * 8, 'CAMBIOS_INTERVALO_COMPACTACION': 0})
+    with app.app_context():
+        db = get_db_connection()
+        db.execute("INSERT INTO usuarios (id, username, password_hash) VALUES (1, 'bench', 'x')")
+        db.executemany(
+            "INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, 1)",
+            ((f"Producto {i}", i % 50, i * 1.5) for i in range(100))
+        )
+        db.commit()
+        token = create_access_token(identity='1')
+    #sin cache ni ETag: cada peticion lee SQLite y serializa
+    app.config['CACHE_HABILITADA'] = False
+    return app, ruta_db, {'Authorization': f'Bearer {token}'}
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def bench_wsgi(app, headers, concurrencia):
+    #como gunicorn gthread: las conexiones esperan en cola y un pool fijo de hilos atiende las vistas;
+    #se usan DB_POOL_MAX hilos (el maximo recomendado en gunicorn.conf.py), los mismos que el puente ASGI
+    pool = ThreadPoolExecutor(app.config['DB_POOL_MAX'], thread_name_prefix='gthread')
+    latencias = []
+    errores = []
+
+    def peticion():
+        return app.test_client().get(RUTA, headers=headers).status_code
+
+    async def cliente():
+        loop = asyncio.get_running_loop()
+        for _ in range(PETICIONES_POR_CLIENTE):
+            inicio = time.perf_counter()
+            status = await loop.run_in_executor(pool, peticion)
+            latencias.append(time.perf_counter() - inicio)
+            if status != 200:
+                errores.append(status)
+
+    async def todos():
+        await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+
+    inicio = time.perf_counter()
+    asyncio.run(todos())
+    duracion = time.perf_counter() - inicio
+    pool.shutdown()
+    return duracion, latencias, len(errores)
+
+
+def bench_asgi(app, headers, concurrencia):
+    app_asgi = AppAsgi(app)
+    cabeceras = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    scope = {'type': 'http', 'method': 'GET', 'path': RUTA, 'query_string': b'', 'headers': cabeceras,
+             'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('127.0.0.1', 1)}
+    latencias = []
+    errores = []
+
+    async def peticion():
+        entregado = False
+        cerrado = asyncio.Event()
+        status = []
+
+        async def receive():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await cerrado.wait()
+
+        async def send(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                status.append(mensaje['status'])
+
+        await app_asgi(dict(scope), receive, send)
+        if status != [200]:
+            errores.append(status)
+
+    async def cliente():
+        for _ in range(PETICIONES_POR_CLIENTE):
+            inicio = time.perf_counter()
+            await peticion()
+            latencias.append(time.perf_counter() - inicio)
+
+    async def todos():
+        await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+
+    inicio = time.perf_counter()
+    asyncio.run(todos())
+    duracion = time.perf_counter() - inicio
+    app_asgi.cerrar()
+    return duracion, latencias, len(errores)
+
+
+def main(concurrencias):
+    app, ruta_db, headers = preparar()
+    try:
+        print(f"GET {RUTA} (100 productos), {PETICIONES_POR_CLIENTE} peticiones por cliente")
+        for concurrencia in concurrencias:
+            print(f"\nconcurrencia {concurrencia}")
+            for nombre, bench in (("WSGI (gthread)", bench_wsgi), ("ASGI (puente)", bench_asgi)):
+                duracion, latencias, errores = bench(app, headers, concurrencia)
+                print(f"  {nombre:<26} {len(latencias) / duracion:8.0f} req/s"
+                      f"   p50 {statistics.median(latencias) * 1000:7.1f} ms"
+                      f"   p99 {percentil(latencias, 0.99) * 1000:7.1f} ms"
+                      f"   hilos {app.config['DB_POOL_MAX']:4d}"
+                      f"   errores {errores}")
+    finally:
+        os.unlink(ruta_db)
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [16, 64, 256])
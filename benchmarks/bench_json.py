@@ -0,0 +1,66 @@
+#benchmarks/bench_json.py
+#microbenchmark de la serializacion del listado de productos
+#uso: python benchmarks/bench_json.py [filas ...]   (por defecto 10000 y 100000)
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from json_rapido import SerializadorFilas, orjson
+
+COLUMNAS = ('id', 'nombre', 'cantidad', 'precio')
+SQL = "SELECT id, nombre, cantidad, precio FROM productos WHERE usuario_id = 1"
+
+
+def preparar(filas):
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE productos (id INTEGER PRIMARY KEY, nombre TEXT, cantidad INTEGER, precio REAL, usuario_id INTEGER)")
+    db.executemany(
+        "INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, 1)",
+        ((f"Producto número {i}", i % 250, round(i * 1.37, 2)) for i in range(filas))
+    )
+    return db
+
+
+def mejor_tiempo(fn, repeticiones=5):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main(tamanos):
+    for filas in tamanos:
+        db = preparar(filas)
+
+        def anterior():
+            #camino previo: sqlite3.Row -> dict -> json de Flask (sort_keys, compacto)
+            db.row_factory = sqlite3.Row
+            productos = db.execute(SQL).fetchall()
+            db.row_factory = None
+            return json.dumps([dict(p) for p in productos], separators=(',', ':'), sort_keys=True)
+
+        def tuplas(serializador):
+            def ejecutar():
+                return serializador.lista(db.execute(SQL).fetchall())
+            return ejecutar
+
+        casos = [("Row + dict + json (anterior)", anterior),
+                 ("tuplas + plantilla stdlib", tuplas(SerializadorFilas(COLUMNAS, usar_orjson=False)))]
+        if orjson is not None:
+            casos.append(("tuplas + orjson", tuplas(SerializadorFilas(COLUMNAS, usar_orjson=True))))
+
+        base = None
+        print(f"\n{filas} filas (incluye lectura de SQLite)")
+        for nombre, fn in casos:
+            segundos = mejor_tiempo(fn)
+            base = base or segundos
+            print(f"  {nombre:<30} {segundos * 1000:8.1f} ms   x{base / segundos:.2f}")
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000])
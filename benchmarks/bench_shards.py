@@ -0,0 +1,94 @@
+#benchmarks/bench_shards.py
+#escrituras/s de POST /productos/ con usuarios concurrentes: una sola base contra N shards
+#uso: python benchmarks/bench_shards.py [shards ...]   (por defecto 0 2 4; 0 = sin sharding)
+#cada cliente es un usuario distinto, asi las escrituras se reparten entre los shards
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from flask_jwt_extended import create_access_token
+from app import create_app
+from db_utils import get_db_connection
+
+CLIENTES = 16
+ESCRITURAS_POR_CLIENTE = 100
+
+
+def preparar(shards):
+    logging.disable(logging.CRITICAL)
+    directorio = tempfile.mkdtemp()
+    app = create_app({
+        'DATABASE': os.path.join(directorio, 'principal.db'),
+        'DB_SHARDS': [os.path.join(directorio, f'shard{i}.db') for i in range(shards)],
+        'JWT_SECRET_KEY': 'bench-' * 8,
+        'CAMBIOS_INTERVALO_COMPACTACION': 0,
+        #un hilo por cliente: el pool no debe ser el cuello de botella
+        'DB_POOL_MAX': CLIENTES,
+        #synchronous=FULL: cada commit espera el fsync, como una base con durabilidad estricta
+        'DB_SYNCHRONOUS': 'FULL',
+    })
+    with app.app_context():
+        db = get_db_connection()
+        db.executemany(
+            "INSERT INTO usuarios (id, username, password_hash) VALUES (?, ?, 'x')",
+            ((uid, f'bench{uid}') for uid in range(1, CLIENTES + 1))
+        )
+        db.commit()
+        headers = [{'Authorization': f'Bearer {create_access_token(identity=str(uid))}'}
+                   for uid in range(1, CLIENTES + 1)]
+    return app, directorio, headers
+
+
+def bench(shards):
+    app, directorio, headers = preparar(shards)
+    latencias = []
+    errores = []
+    lock = threading.Lock()
+
+    def cliente(cabeceras):
+        http = app.test_client()
+        propias = []
+        fallidas = 0
+        for i in range(ESCRITURAS_POR_CLIENTE):
+            inicio = time.perf_counter()
+            fallidas += http.post('/productos/', headers=cabeceras,
+                                  json={'nombre': f'Producto {i}', 'cantidad': i, 'precio': 1.5}).status_code != 201
+            propias.append(time.perf_counter() - inicio)
+        with lock:
+            latencias.extend(propias)
+            errores.append(fallidas)
+
+    hilos = [threading.Thread(target=cliente, args=(h,)) for h in headers]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    router = app.extensions.get('shards')
+    if router is not None:
+        router.cerrar()
+    shutil.rmtree(directorio, ignore_errors=True)
+    return duracion, latencias, sum(errores)
+
+
+def main(configuraciones):
+    print(f"POST /productos/, {CLIENTES} usuarios concurrentes, {ESCRITURAS_POR_CLIENTE} escrituras cada uno")
+    for shards in configuraciones:
+        duracion, latencias, errores = bench(shards)
+        latencias.sort()
+        print(f"  {'sin sharding' if not shards else f'{shards} shards':<14}"
+              f" {len(latencias) / duracion:8.0f} escrituras/s"
+              f"   p50 {statistics.median(latencias) * 1000:7.1f} ms"
+              f"   p99 {latencias[int(len(latencias) * 0.99)] * 1000:7.1f} ms"
+              f"   errores {errores}")
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [0, 2, 4])
@@ -0,0 +1,328 @@
+#benchmarks/carga.py
+#prueba de carga: reproduce una mezcla ponderada de peticiones y guarda un reporte JSON por endpoint
+#uso:
+#  python benchmarks/carga.py --usuarios 100 --clientes 16 --duracion 30                 (en proceso, DATABASE_PATH)
+#  python benchmarks/carga.py --url http://127.0.0.1:8000 --usuarios 100 --clientes 64    (contra un servidor)
+#  python benchmarks/carga.py ... --salida reportes/hoy.json --comparar reportes/ayer.json
+#los usuarios deben existir: `flask seed --usuarios N` crea <prefijo>000001..N con la misma contraseña
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from semilla import nombre_usuario
+
+#operacion -> peso relativo en la mezcla
+MEZCLA_DEFECTO = {'login': 1, 'listar': 10, 'obtener': 10, 'crear': 3, 'actualizar': 3, 'eliminar': 1}
+
+PERCENTILES = (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+
+
+class TransporteProceso:
+    """Peticiones a una app Flask en el mismo proceso (sin red): mide vistas, SQLite y serializacion."""
+
+    def __init__(self, app, cliente):
+        #una IP por cliente simulado: el limite de /auth es por IP
+        self.http = app.test_client()
+        self.entorno = {'REMOTE_ADDR': f"10.0.{cliente // 250}.{cliente % 250 + 1}"}
+
+    def peticion(self, metodo, ruta, headers=None, cuerpo=None):
+        response = self.http.open(ruta, method=metodo, headers=headers, json=cuerpo, environ_base=self.entorno)
+        return response.status_code, response.get_json(silent=True)
+
+    def cerrar(self):
+        pass
+
+
+class TransporteHttp:
+    """Peticiones HTTP/1.1 con una conexion keep-alive por cliente simulado."""
+
+    def __init__(self, url, timeout=30.0):
+        partes = urlsplit(url)
+        clase = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.conexion = clase(partes.hostname, partes.port, timeout=timeout)
+        self.base = partes.path.rstrip('/')
+
+    def peticion(self, metodo, ruta, headers=None, cuerpo=None):
+        headers = dict(headers or {})
+        datos = None
+        if cuerpo is not None:
+            datos = json.dumps(cuerpo).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conexion.request(metodo, self.base + ruta, body=datos, headers=headers)
+            response = self.conexion.getresponse()
+            contenido = response.read()
+        except (OSError, http.client.HTTPException):
+            #la proxima peticion abre una conexion nueva
+            self.conexion.close()
+            raise
+        try:
+            return response.status, json.loads(contenido) if contenido else None
+        except ValueError:
+            return response.status, None
+
+    def cerrar(self):
+        self.conexion.close()
+
+
+class ClienteCarga:
+    """Un usuario simulado: inicia sesion y elige operaciones segun la mezcla, recordando sus productos."""
+
+    def __init__(self, transporte, rng, usuarios, prefijo, password):
+        self.transporte = transporte
+        self.rng = rng
+        self.usuarios = usuarios
+        self.prefijo = prefijo
+        self.password = password
+        self.headers = None
+        self.productos = []
+
+    def login(self):
+        usuario = nombre_usuario(self.prefijo, self.rng.randint(1, self.usuarios))
+        status, datos = self.transporte.peticion('POST', '/auth/login',
+                                                 cuerpo={'username': usuario, 'password': self.password})
+        if status == 201:
+            self.headers = {'Authorization': f"Bearer {datos['access_token']}"}
+            self.productos = []
+        return status
+
+    def listar(self):
+        status, datos = self.transporte.peticion('GET', '/productos/?limit=50', self.headers)
+        if status == 200:
+            self.productos = [producto['id'] for producto in datos]
+        return status
+
+    def obtener(self):
+        return self.transporte.peticion('GET', f'/productos/{self.rng.choice(self.productos)}', self.headers)[0]
+
+    def crear(self):
+        status, datos = self.transporte.peticion('POST', '/productos/', self.headers, {
+            'nombre': f"Producto carga {self.rng.randint(1, 10 ** 6)}",
+            'cantidad': self.rng.randint(0, 100),
+            'precio': round(self.rng.uniform(1, 500), 2),
+        })
+        if status == 201:
+            self.productos.append(datos['id'])
+        return status
+
+    def actualizar(self):
+        return self.transporte.peticion('PUT', f'/productos/{self.rng.choice(self.productos)}', self.headers,
+                                        {'cantidad': self.rng.randint(0, 100)})[0]
+
+    def eliminar(self):
+        producto_id = self.productos.pop(self.rng.randrange(len(self.productos)))
+        return self.transporte.peticion('DELETE', f'/productos/{producto_id}', self.headers)[0]
+
+    def operacion(self, nombre):
+        #sin sesion no hay nada que hacer; sin productos conocidos se lista primero
+        if self.headers is None:
+            nombre = 'login'
+        elif nombre in ('obtener', 'actualizar', 'eliminar') and not self.productos:
+            nombre = 'listar'
+        return nombre, getattr(self, nombre)()
+
+
+def ejecutar_carga(crear_transporte, usuarios, clientes=8, duracion=10.0, mezcla=None,
+                   prefijo='carga', password='carga123', semilla=0):
+    """Corre ``clientes`` hilos durante ``duracion`` segundos. Devuelve (segundos, muestras).
+
+    Cada muestra es (operacion, segundos, status); status 0 es un error de conexion.
+    """
+    mezcla = mezcla or MEZCLA_DEFECTO
+    operaciones = list(mezcla)
+    pesos = [mezcla[op] for op in operaciones]
+    muestras = []
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def hilo(indice):
+        rng = random.Random(semilla * 1000 + indice)
+        transporte = crear_transporte(indice)
+        cliente = ClienteCarga(transporte, rng, usuarios, prefijo, password)
+        propias = []
+        try:
+            while time.monotonic() < fin:
+                elegida = rng.choices(operaciones, pesos)[0]
+                inicio = time.perf_counter()
+                try:
+                    nombre, status = cliente.operacion(elegida)
+                except (OSError, http.client.HTTPException):
+                    nombre, status = elegida, 0
+                propias.append((nombre, time.perf_counter() - inicio, status))
+                if cliente.headers is None:
+                    #login rechazado (429/503) sin sesion previa: se reintenta despues de una pausa
+                    time.sleep(0.2)
+        finally:
+            transporte.cerrar()
+            with lock:
+                muestras.extend(propias)
+
+    hilos = [threading.Thread(target=hilo, args=(i,)) for i in range(clientes)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return time.perf_counter() - inicio, muestras
+
+
+def percentil(valores_ordenados, p):
+    return valores_ordenados[min(len(valores_ordenados) - 1, int(len(valores_ordenados) * p))]
+
+
+def _estadisticas(latencias, statuses, segundos):
+    #los percentiles y el throughput cuentan solo respuestas 2xx: un 429 o un 503 vuelve en
+    #microsegundos y, mezclado, haria ver mas rapido un servidor que esta rechazando trabajo
+    exitosas = sorted(latencia for latencia, status in zip(latencias, statuses) if 200 <= status < 300)
+    conteo = {}
+    for status in statuses:
+        conteo[str(status)] = conteo.get(str(status), 0) + 1
+    resultado = {
+        "peticiones": len(latencias),
+        "exitosas": len(exitosas),
+        "por_segundo": round(len(exitosas) / segundos, 1),
+        #no_2xx: todo lo demas (4xx como el 429 de /auth, 5xx y fallas de conexion, status 0)
+        "no_2xx": len(latencias) - len(exitosas),
+        #errores: 5xx y fallas de conexion
+        "errores": sum(1 for status in statuses if status == 0 or status >= 500),
+        "status": conteo,
+    }
+    for nombre, p in PERCENTILES:
+        resultado[f"{nombre}_ms"] = round(percentil(exitosas, p) * 1000, 2) if exitosas else None
+    resultado["max_ms"] = round(exitosas[-1] * 1000, 2) if exitosas else None
+    return resultado
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def reporte(segundos, muestras, configuracion):
+    """Reporte serializable a JSON: totales y, por operacion, throughput y percentiles de latencia de las 2xx."""
+    por_operacion = {}
+    for nombre, latencia, status in muestras:
+        latencias, statuses = por_operacion.setdefault(nombre, ([], []))
+        latencias.append(latencia)
+        statuses.append(status)
+    return {
+        "fecha": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": _commit_actual(),
+        "configuracion": configuracion,
+        "segundos": round(segundos, 2),
+        "total": _estadisticas([m[1] for m in muestras], [m[2] for m in muestras], segundos) if muestras else {},
+        "endpoints": {
+            nombre: _estadisticas(latencias, statuses, segundos)
+            for nombre, (latencias, statuses) in sorted(por_operacion.items())
+        },
+    }
+
+
+def comparar(base, actual, tolerancia=0.1):
+    """Regresiones de ``actual`` frente a ``base``: p99 que sube o throughput que baja mas que ``tolerancia``."""
+    regresiones = []
+    for nombre, datos in sorted(actual["endpoints"].items()):
+        anterior = base["endpoints"].get(nombre)
+        if anterior is None:
+            continue
+        if datos["p99_ms"] is not None and anterior["p99_ms"] is not None \
+                and datos["p99_ms"] > anterior["p99_ms"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p99 {anterior['p99_ms']} ms -> {datos['p99_ms']} ms")
+        if datos["por_segundo"] < anterior["por_segundo"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: {anterior['por_segundo']} req/s -> {datos['por_segundo']} req/s")
+        if datos["errores"] > anterior["errores"]:
+            regresiones.append(f"{nombre}: errores {anterior['errores']} -> {datos['errores']}")
+        if datos.get("no_2xx", 0) > anterior.get("no_2xx", 0) * (1 + tolerancia):
+            regresiones.append(f"{nombre}: no 2xx {anterior.get('no_2xx', 0)} -> {datos['no_2xx']}")
+    return regresiones
+
+
+def imprimir(informe):
+    print(f"{'operacion':<12}{'peticiones':>11}{'2xx/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'no 2xx':>9}{'errores':>9}")
+    for nombre, datos in [*informe["endpoints"].items(), ("total", informe["total"])]:
+        if datos:
+            print(f"{nombre:<12}{datos['peticiones']:>11}{datos['por_segundo']:>9}{str(datos['p50_ms']):>9}"
+                  f"{str(datos['p95_ms']):>9}{str(datos['p99_ms']):>9}{datos['no_2xx']:>9}{datos['errores']:>9}")
+
+
+def _mezcla(texto):
+    mezcla = dict(MEZCLA_DEFECTO)
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        if nombre.strip() not in MEZCLA_DEFECTO:
+            raise argparse.ArgumentTypeError(f"operacion desconocida: {nombre} (use {', '.join(MEZCLA_DEFECTO)})")
+        mezcla[nombre.strip()] = float(peso)
+    return mezcla
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con una mezcla ponderada de peticiones")
+    parser.add_argument('--url', help='Servidor a probar; sin --url la app corre en este proceso (DATABASE_PATH)')
+    parser.add_argument('--usuarios', type=int, default=100, help='Usuarios sembrados con flask seed')
+    parser.add_argument('--prefijo', default='carga')
+    parser.add_argument('--password', default='carga123')
+    parser.add_argument('--clientes', type=int, default=8, help='Clientes concurrentes (un hilo cada uno)')
+    parser.add_argument('--duracion', type=float, default=10.0, help='Segundos de carga')
+    parser.add_argument('--mezcla', type=_mezcla, default=MEZCLA_DEFECTO,
+                        help='Pesos, p. ej. listar=20,crear=1 (el resto toma el valor por defecto)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Archivo JSON del reporte')
+    parser.add_argument('--comparar', help='Reporte JSON anterior; sale con codigo 1 si hay regresiones')
+    parser.add_argument('--tolerancia', type=float, default=0.1, help='Variacion aceptada frente a --comparar')
+    args = parser.parse_args(argv)
+
+    if args.url:
+        def crear_transporte(indice):
+            return TransporteHttp(args.url)
+    else:
+        from app import create_app
+        #el registro de consultas lentas y los logs por peticion distorsionan la medicion
+        logging.disable(logging.CRITICAL)
+        app = create_app({'CAMBIOS_INTERVALO_COMPACTACION': 0})
+
+        def crear_transporte(indice):
+            return TransporteProceso(app, indice)
+
+    segundos, muestras = ejecutar_carga(crear_transporte, args.usuarios, args.clientes, args.duracion,
+                                        args.mezcla, args.prefijo, args.password, args.semilla)
+    informe = reporte(segundos, muestras, {
+        "modo": "http" if args.url else "proceso",
+        "url": args.url,
+        "clientes": args.clientes,
+        "duracion": args.duracion,
+        "usuarios": args.usuarios,
+        "mezcla": args.mezcla,
+        "cpus": os.cpu_count(),
+    })
+    imprimir(informe)
+    if args.salida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.salida)), exist_ok=True)
+        with open(args.salida, 'w') as archivo:
+            json.dump(informe, archivo, indent=2)
+        print(f"Reporte guardado en {args.salida}")
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            regresiones = comparar(json.load(archivo), informe, args.tolerancia)
+        for regresion in regresiones:
+            print(f"REGRESION {regresion}")
+        if regresiones:
+            return 1
+        print(f"Sin regresiones frente a {args.comparar} (tolerancia {args.tolerancia:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
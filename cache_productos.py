@@ -0,0 +1,214 @@
+#cache_productos.py
+#cache read-through de listados y productos individuales por usuario
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+logging.basicConfig(level=logging.INFO)
+
+
+def tamano_aproximado(valor):
+    """Bytes aproximados que ocupa un valor cacheable (texto, numeros, listas y dicts)."""
+    if isinstance(valor, (str, bytes)):
+        return 49 + len(valor)
+    if isinstance(valor, dict):
+        return 64 + sum(tamano_aproximado(k) + tamano_aproximado(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return 56 + sum(tamano_aproximado(v) for v in valor)
+    return 32
+
+
+class BackendCache:
+    """Interfaz minima de un backend de cache."""
+
+    def get(self, clave):
+        raise NotImplementedError
+
+    def set(self, clave, valor):
+        raise NotImplementedError
+
+    def delete(self, *claves):
+        raise NotImplementedError
+
+    def estadisticas(self):
+        return {}
+
+
+class CacheNula(BackendCache):
+    """Backend usado cuando la cache esta deshabilitada (CACHE_HABILITADA=False)."""
+
+    def get(self, clave):
+        return None
+
+    def set(self, clave, valor):
+        pass
+
+    def delete(self, *claves):
+        pass
+
+
+class CacheLRU(BackendCache):
+    """Cache en proceso acotada por numero de entradas y por bytes aproximados, con expiracion por TTL.
+
+    Un listado cacheado puede pesar cientos de KB: el limite de entradas solo no
+    acota la memoria. Una entrada mayor que ``max_bytes`` no se guarda.
+    """
+
+    def __init__(self, max_entradas=10000, ttl=60.0, max_bytes=64 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evicciones": 0, "expiradas": 0, "invalidaciones": 0}
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self._stats["misses"] += 1
+                return None
+            valor, expira, tamano = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                self._bytes -= tamano
+                self._stats["expiradas"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._datos.move_to_end(clave)
+            self._stats["hits"] += 1
+            return valor
+
+    def set(self, clave, valor):
+        tamano = tamano_aproximado(clave) + tamano_aproximado(valor)
+        with self._lock:
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+            if tamano > self.max_bytes:
+                return
+            self._datos[clave] = (valor, time.monotonic() + self.ttl, tamano)
+            self._bytes += tamano
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, _, liberado) = self._datos.popitem(last=False)
+                self._bytes -= liberado
+                self._stats["evicciones"] += 1
+
+    def delete(self, *claves):
+        with self._lock:
+            for clave in claves:
+                entrada = self._datos.pop(clave, None)
+                if entrada is not None:
+                    self._bytes -= entrada[2]
+                    self._stats["invalidaciones"] += 1
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entradas"] = len(self._datos)
+            stats["bytes"] = self._bytes
+        stats["max_entradas"] = self.max_entradas
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class CacheCompartida(BackendCache):
+    """Adaptador para un cliente compartido con API tipo redis-py (get, set(ex=), delete).
+
+    Los valores se guardan como JSON para que distintos procesos puedan leerlos.
+    Si el servidor de cache falla, la lectura cuenta como miss y la escritura se
+    omite: la peticion sigue contra la base en lugar de responder 500.
+    """
+
+    def __init__(self, cliente, ttl=60.0, prefijo="inventario:"):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefijo = prefijo
+        self.errores = 0
+
+    def _fallo(self, operacion, error):
+        self.errores += 1
+        logging.warning(f"Cache compartida no disponible ({operacion}): {error}")
+
+    def get(self, clave):
+        try:
+            crudo = self.cliente.get(self.prefijo + clave)
+            return json.loads(crudo) if crudo is not None else None
+        except Exception as e:
+            self._fallo('get', e)
+            return None
+
+    def set(self, clave, valor):
+        try:
+            self.cliente.set(self.prefijo + clave, json.dumps(valor), ex=max(1, int(self.ttl)))
+        except Exception as e:
+            self._fallo('set', e)
+
+    def delete(self, *claves):
+        if not claves:
+            return
+        try:
+            self.cliente.delete(*(self.prefijo + clave for clave in claves))
+        except Exception as e:
+            #una invalidacion perdida queda acotada por el TTL y por la version guardada en la entrada
+            self._fallo('delete', e)
+
+    def estadisticas(self):
+        return {"errores": self.errores}
+
+
+class CacheProductos:
+    """Claves y politica de invalidacion sobre cualquier backend.
+
+    Los listados se indexan por la version del inventario del usuario: cualquier
+    escritura los deja obsoletos sin tener que buscarlos. Los productos individuales
+    guardan la version con la que se leyeron, y ademas se borran explicitamente en
+    cada escritura sobre ese producto.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_listado(self, user_id, version, consulta):
+        return self.backend.get(f"productos:{user_id}:v{version}:l:{consulta}")
+
+    def set_listado(self, user_id, version, consulta, valor):
+        self.backend.set(f"productos:{user_id}:v{version}:l:{consulta}", valor)
+
+    def get_producto(self, user_id, producto_id, version):
+        entrada = self.backend.get(f"productos:{user_id}:p:{producto_id}")
+        #una entrada leida con otra version pudo guardarse en carrera con una escritura
+        if entrada is None or entrada[0] != version:
+            return None
+        return entrada[1]
+
+    def set_producto(self, user_id, producto_id, version, valor):
+        self.backend.set(f"productos:{user_id}:p:{producto_id}", [version, valor])
+
+    def invalidar_productos(self, user_id, *producto_ids):
+        self.backend.delete(*(f"productos:{user_id}:p:{pid}" for pid in producto_ids))
+
+    def estadisticas(self):
+        return self.backend.estadisticas()
+
+
+def crear_cache(config):
+    if not config['CACHE_HABILITADA']:
+        return CacheProductos(CacheNula())
+    backend = config['CACHE_BACKEND']
+    if backend == 'memoria':
+        return CacheProductos(CacheLRU(config['CACHE_MAX_ENTRADAS'], config['CACHE_TTL'], config['CACHE_MAX_BYTES']))
+    #cualquier otro valor se interpreta como un cliente compartido (ej. redis.Redis)
+    return CacheProductos(CacheCompartida(backend, config['CACHE_TTL']))
+
+
+def init_app_cache(app):
+    app.extensions['cache_productos'] = crear_cache(app.config)
+
+
+def get_cache():
+    return current_app.extensions['cache_productos']
@@ -0,0 +1,138 @@
+#cambios.py
+#compactacion del registro de cambios de productos (change feed)
+import logging
+import os
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from db_pool import abrir_conexion
+from shards import bases_productos
+
+logging.basicConfig(level=logging.INFO)
+
+
+def horizonte_cambios(db, user_id):
+    """Version minima desde la que el feed del usuario esta completo (0 si nunca se compacto)."""
+    fila = db.execute(
+        "SELECT version FROM productos_cambios_horizonte WHERE usuario_id = ?", (user_id,)
+    ).fetchone()
+    return fila[0] if fila else 0
+
+
+def leer_cambios(db, user_id, desde, limite=None):
+    """Cambios del usuario con version > desde, en orden, como dicts listos para JSON."""
+    sql = (
+        "SELECT c.version, c.producto_id, c.operacion, p.nombre, p.cantidad, p.precio"
+        " FROM productos_cambios c LEFT JOIN productos p ON p.id = c.producto_id"
+        " WHERE c.usuario_id = ? AND c.version > ? ORDER BY c.version"
+    )
+    params = [user_id, desde]
+    if limite is not None:
+        sql += " LIMIT ?"
+        params.append(limite)
+    cursor = db.execute(sql, params)
+    cursor.row_factory = None
+    cambios = []
+    for version, producto_id, operacion, nombre, cantidad, precio in cursor.fetchall():
+        cambio = {"version": version, "id": producto_id, "operacion": operacion}
+        if operacion == 'upsert':
+            cambio["producto"] = {"id": producto_id, "nombre": nombre, "cantidad": cantidad, "precio": precio}
+        cambios.append(cambio)
+    return cambios
+
+
+def compactar_cambios(db, retencion):
+    """Borra los tombstones mas viejos que ``retencion`` segundos y sube el horizonte de cada usuario.
+
+    Las altas y modificaciones no se compactan: hay una sola fila por producto vivo
+    y el feed desde 0 reconstruye el inventario completo. Devuelve los tombstones borrados.
+    """
+    limite = int(time.time() - retencion)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("""
+            INSERT INTO productos_cambios_horizonte (usuario_id, version)
+            SELECT usuario_id, MAX(version) FROM productos_cambios
+            WHERE operacion = 'delete' AND cambiado_en < ? GROUP BY usuario_id
+            ON CONFLICT (usuario_id) DO UPDATE SET version = MAX(version, excluded.version)
+        """, (limite,))
+        borrados = db.execute(
+            "DELETE FROM productos_cambios WHERE operacion = 'delete' AND cambiado_en < ?", (limite,)
+        ).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if borrados:
+        logging.info(f"Registro de cambios compactado: {borrados} tombstones anteriores a {limite}")
+    return borrados
+
+
+class CompactadorCambios:
+    """Hilo que compacta el registro de cambios cada ``intervalo`` segundos, con su propia conexion.
+
+    ``bases`` es una lista de (database, pragmas): la base principal o cada shard.
+    """
+
+    def __init__(self, bases, intervalo, retencion):
+        self.bases = list(bases)
+        self.intervalo = intervalo
+        self.retencion = retencion
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def iniciar(self):
+        #el hilo no sobrevive a un fork: cada proceso arranca el suyo
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._bucle, name='compactador-cambios', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _bucle(self):
+        conexiones = [abrir_conexion(database, pragmas) for database, pragmas in self.bases]
+        while True:
+            time.sleep(self.intervalo)
+            for db in conexiones:
+                try:
+                    compactar_cambios(db, self.retencion)
+                except Exception as e:
+                    logging.error(f"Error al compactar el registro de cambios: {e}")
+
+
+@click.group('cambios')
+def cambios_cli():
+    """Registro de cambios de productos."""
+
+
+@cambios_cli.command('compactar')
+@click.option('--retencion', type=float, default=None, help='Segundos que se conservan los tombstones.')
+@with_appcontext
+def compactar(retencion):
+    """Borra los tombstones viejos del registro de cambios."""
+    if retencion is None:
+        retencion = current_app.config['CAMBIOS_RETENCION']
+    borrados = 0
+    for pool in bases_productos():
+        db = pool.obtener()
+        try:
+            borrados += compactar_cambios(db, retencion)
+        finally:
+            pool.liberar(db)
+    click.echo(f"Tombstones borrados: {borrados}")
+
+
+def init_app_cambios(app):
+    app.cli.add_command(cambios_cli)
+    config = app.config
+    if config['CAMBIOS_INTERVALO_COMPACTACION'] > 0 and not config.get('TESTING'):
+        compactador = app.extensions['compactador_cambios'] = CompactadorCambios(
+            [(pool.database, pool.pragmas) for pool in bases_productos(app)],
+            config['CAMBIOS_INTERVALO_COMPACTACION'],
+            config['CAMBIOS_RETENCION'],
+        )
+        #se arranca con la primera peticion de cada proceso: con preload_app el master de gunicorn
+        #no atiende peticiones, asi no queda un hilo con conexiones SQLite abiertas durante el fork
+        app.before_request(lambda: compactador.iniciar())
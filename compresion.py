@@ -0,0 +1,182 @@
+#compresion.py
+#compresion de respuestas negociada con Accept-Encoding (gzip, y br/zstd si estan instalados)
+import logging
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+
+#tipos que vale la pena comprimir; imagenes, zip, gzip, etc. ya vienen comprimidos
+TIPOS_COMPRIMIBLES = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'application/xml', 'image/svg+xml', 'text/event-stream',
+}
+
+BUCKETS_RATIO = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0)
+
+
+class _Gzip:
+    def __init__(self, nivel):
+        self._c = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def comprimir(self, datos):
+        return self._c.compress(datos)
+
+    def vaciar(self):
+        #Z_SYNC_FLUSH: lo comprimido hasta ahora se puede decodificar sin esperar al final
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        return self._c.flush()
+
+
+class _Brotli:
+    def __init__(self, nivel):
+        self._c = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, datos):
+        return self._c.process(datos)
+
+    def vaciar(self):
+        return self._c.flush()
+
+    def terminar(self):
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self, nivel):
+        self._c = zstandard.ZstdCompressor(level=nivel).compressobj()
+
+    def comprimir(self, datos):
+        return self._c.compress(datos)
+
+    def vaciar(self):
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def terminar(self):
+        return self._c.flush()
+
+
+def codificaciones_disponibles():
+    """Codificaciones soportadas, en orden de preferencia del servidor."""
+    disponibles = []
+    if zstandard is not None:
+        disponibles.append('zstd')
+    if brotli is not None:
+        disponibles.append('br')
+    disponibles.append('gzip')
+    return disponibles
+
+
+def crear_compresor(codificacion, config):
+    if codificacion == 'gzip':
+        return _Gzip(config['COMPRESION_NIVEL_GZIP'])
+    if codificacion == 'br':
+        return _Brotli(config['COMPRESION_NIVEL_BR'])
+    if codificacion == 'zstd':
+        return _Zstd(config['COMPRESION_NIVEL_ZSTD'])
+    raise ValueError(f"Codificacion no soportada: {codificacion}")
+
+
+def comprimir_stream(partes, compresor, al_terminar=None):
+    """Comprime un iterable de bytes parte por parte, vaciando el compresor en cada una."""
+    original = 0
+    comprimido = 0
+    try:
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode()
+            if not parte:
+                continue
+            original += len(parte)
+            salida = compresor.comprimir(parte) + compresor.vaciar()
+            comprimido += len(salida)
+            yield salida
+        salida = compresor.terminar()
+        comprimido += len(salida)
+        yield salida
+    finally:
+        if al_terminar is not None:
+            al_terminar(original, comprimido)
+
+
+def variantes_etag(etag):
+    """El ETag sin comprimir y sus variantes por codificacion (para If-None-Match)."""
+    return [etag] + [f"{etag}-{codificacion}" for codificacion in codificaciones_disponibles()]
+
+
+def _registrar(codificacion, original, comprimido):
+    if not original:
+        return
+    ratio = comprimido / original
+    logging.debug(f"Respuesta comprimida con {codificacion}: {original} -> {comprimido} bytes (ratio {ratio:.2f})")
+    metricas = current_app.extensions.get('metricas')
+    if metricas is not None:
+        metricas.incrementar('inventario_http_compression_bytes_total', original,
+                             'Bytes de respuesta antes y despues de comprimir',
+                             codificacion=codificacion, etapa='original')
+        metricas.incrementar('inventario_http_compression_bytes_total', comprimido,
+                             'Bytes de respuesta antes y despues de comprimir',
+                             codificacion=codificacion, etapa='comprimido')
+        metricas.observar('inventario_http_compression_ratio', ratio,
+                          'Tamaño comprimido / tamaño original por respuesta',
+                          buckets=BUCKETS_RATIO, codificacion=codificacion)
+
+
+def _comprimir_respuesta(response):
+    config = current_app.config
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    if not (response.mimetype.startswith('text/') or response.mimetype in TIPOS_COMPRIMIBLES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    codificacion = request.accept_encodings.best_match(codificaciones_disponibles())
+    if codificacion is None:
+        return response
+
+    if response.is_streamed:
+        app = current_app._get_current_object()
+
+        def al_terminar(original, comprimido):
+            with app.app_context():
+                _registrar(codificacion, original, comprimido)
+
+        response.response = comprimir_stream(
+            response.response, crear_compresor(codificacion, config), al_terminar
+        )
+        response.headers.pop('Content-Length', None)
+    else:
+        datos = response.get_data()
+        if len(datos) < config['COMPRESION_MIN_BYTES']:
+            return response
+        compresor = crear_compresor(codificacion, config)
+        comprimido = compresor.comprimir(datos) + compresor.terminar()
+        if len(comprimido) >= len(datos):
+            return response
+        response.set_data(comprimido)
+        _registrar(codificacion, len(datos), len(comprimido))
+
+    response.headers['Content-Encoding'] = codificacion
+    #un ETag fuerte identifica bytes exactos: la variante comprimida lleva otro ETag
+    etag, debil = response.get_etag()
+    if etag and not debil:
+        response.set_etag(f"{etag}-{codificacion}")
+    return response
+
+
+def init_app_compresion(app):
+    if app.config['COMPRESION_HABILITADA']:
+        app.after_request(_comprimir_respuesta)
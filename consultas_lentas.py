@@ -0,0 +1,109 @@
+#consultas_lentas.py
+#registro de sentencias lentas con su plan de ejecucion (EXPLAIN QUERY PLAN)
+import logging
+import re
+import sqlite3
+import threading
+import time
+from flask import current_app
+
+logging.basicConfig(level=logging.INFO)
+
+#solo estas sentencias tienen un plan que valga la pena capturar
+_CON_PLAN = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE', 'WITH')
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ESPACIOS = re.compile(r"\s+")
+
+
+def huella(sql):
+    """Normaliza una sentencia para agrupar las que solo difieren en literales."""
+    sql = _LITERALES.sub('?', sql)
+    sql = _LISTAS_IN.sub('(?+)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+def forma_params(params):
+    """Tipos de los parametros (nunca sus valores, que pueden ser datos de clientes)."""
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {clave: type(valor).__name__ for clave, valor in params.items()}
+    return [type(valor).__name__ for valor in params]
+
+
+class RegistroConsultasLentas:
+    """Top-N de huellas de sentencias que superaron ``umbral`` segundos."""
+
+    def __init__(self, umbral, max_huellas=50):
+        self.umbral = umbral
+        self.max_huellas = max_huellas
+        self._huellas = {}
+        self._lock = threading.Lock()
+
+    def _plan(self, conn, sql, params):
+        if not sql.lstrip().upper().startswith(_CON_PLAN):
+            return None
+        try:
+            #se llama a la clase base para que el EXPLAIN no se mida ni se registre a si mismo
+            filas = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+        except sqlite3.Error as e:
+            return [f"(sin plan: {e})"]
+        return [fila[3] for fila in filas]
+
+    def registrar(self, conn, sql, params, duracion, lote=None):
+        clave = huella(sql)
+        with self._lock:
+            entrada = self._huellas.get(clave)
+            capturar_plan = entrada is None
+        plan = self._plan(conn, sql, params) if capturar_plan else None
+
+        with self._lock:
+            entrada = self._huellas.get(clave)
+            if entrada is None:
+                #acotado: antes de agregar se descarta la huella con menos tiempo acumulado; si se
+                #descartara despues, la nueva (con una sola ejecucion) seria casi siempre la menor
+                #y ninguna huella nueva llegaria a acumular tiempo
+                if len(self._huellas) >= self.max_huellas:
+                    menor = min(self._huellas.values(), key=lambda e: e["segundos_total"])
+                    del self._huellas[menor["huella"]]
+                entrada = self._huellas[clave] = {
+                    "huella": clave,
+                    "ejecuciones": 0,
+                    "segundos_total": 0.0,
+                    "segundos_max": 0.0,
+                    "plan": plan,
+                }
+            entrada["ejecuciones"] += 1
+            entrada["segundos_total"] += duracion
+            entrada["segundos_max"] = max(entrada["segundos_max"], duracion)
+            entrada["params"] = forma_params(params)
+            entrada["lote"] = lote
+            entrada["ultima_vez"] = time.time()
+
+        logging.warning(
+            f"Consulta lenta ({duracion * 1000:.1f} ms): {clave} params={forma_params(params)}"
+            + (f" lote={lote}" if lote else "")
+            + (f" plan={plan}" if plan else "")
+        )
+
+    def top(self, limite=20):
+        with self._lock:
+            entradas = [dict(e) for e in self._huellas.values()]
+        entradas.sort(key=lambda e: e["segundos_total"], reverse=True)
+        return entradas[:limite]
+
+    def limpiar(self):
+        with self._lock:
+            self._huellas.clear()
+
+
+def init_app_consultas_lentas(app):
+    app.extensions['consultas_lentas'] = RegistroConsultasLentas(
+        app.config['CONSULTAS_LENTAS_UMBRAL'], app.config['CONSULTAS_LENTAS_MAX']
+    )
+
+
+def get_consultas_lentas():
+    return current_app.extensions['consultas_lentas']
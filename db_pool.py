@@ -0,0 +1,175 @@
+#db_pool.py
+#pool de conexiones SQLite reutilizables entre peticiones
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+
+def abrir_conexion(database, pragmas=(), factory=sqlite3.Connection):
+    """Abre una conexion con la configuracion comun (Row, pragmas) usable desde cualquier hilo."""
+    conn = sqlite3.connect(
+        database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+        factory=factory,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in pragmas:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+
+class PoolAgotado(Exception):
+    """No se obtuvo una conexion libre dentro del tiempo de espera."""
+
+
+class PoolConexiones:
+    """Pool acotado de conexiones SQLite.
+
+    Cada conexion se configura una sola vez al crearse (pragmas) y se presta
+    en exclusiva a un hilo hasta que se devuelve con ``liberar``.
+    """
+
+    def __init__(self, database, max_conexiones=8, timeout=5.0, pragmas=None,
+                 chequeo_inactividad=30.0, factory=sqlite3.Connection):
+        self.database = database
+        self.max_conexiones = max_conexiones
+        self.timeout = timeout
+        self.pragmas = list(pragmas or [])
+        self.chequeo_inactividad = chequeo_inactividad
+        self.factory = factory
+
+        #LIFO: la conexion usada mas recientemente tiene la cache de paginas caliente
+        self._libres = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._abiertas = 0
+        self._stats = {
+            "creadas": 0,
+            "prestamos": 0,
+            "esperas": 0,
+            "timeouts": 0,
+            "descartadas": 0,
+            "chequeos_fallidos": 0,
+        }
+
+    def _crear_conexion(self):
+        return abrir_conexion(self.database, self.pragmas, self.factory)
+
+    def _conexion_sana(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._abiertas -= 1
+            self._stats["descartadas"] += 1
+
+    def obtener(self):
+        """Presta una conexion; crea una nueva si el pool aun no esta lleno."""
+        while True:
+            try:
+                conn, liberada_en = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    puede_crear = self._abiertas < self.max_conexiones
+                    if puede_crear:
+                        self._abiertas += 1
+                if puede_crear:
+                    try:
+                        conn = self._crear_conexion()
+                    except Exception:
+                        with self._lock:
+                            self._abiertas -= 1
+                        raise
+                    with self._lock:
+                        self._stats["creadas"] += 1
+                        self._stats["prestamos"] += 1
+                    return conn
+
+                with self._lock:
+                    self._stats["esperas"] += 1
+                try:
+                    conn, liberada_en = self._libres.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolAgotado(
+                        f"Sin conexiones libres tras {self.timeout}s (max {self.max_conexiones})"
+                    )
+
+            #health check solo si la conexion estuvo inactiva mucho tiempo
+            if time.monotonic() - liberada_en > self.chequeo_inactividad and not self._conexion_sana(conn):
+                with self._lock:
+                    self._stats["chequeos_fallidos"] += 1
+                self._descartar(conn)
+                continue
+
+            with self._lock:
+                self._stats["prestamos"] += 1
+            return conn
+
+    def liberar(self, conn):
+        """Devuelve la conexion al pool, deshaciendo cualquier transaccion pendiente."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            #la conexion fue cerrada por quien la tenia prestada
+            self._descartar(conn)
+            return
+        self._libres.put((conn, time.monotonic()))
+
+    def cerrar(self):
+        while True:
+            try:
+                conn, _ = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["abiertas"] = self._abiertas
+        stats["libres"] = self._libres.qsize()
+        stats["en_uso"] = stats["abiertas"] - stats["libres"]
+        stats["max_conexiones"] = self.max_conexiones
+        return stats
+
+
+def pragmas_desde_config(config, foreign_keys=None):
+    if foreign_keys is None:
+        foreign_keys = config['DB_FOREIGN_KEYS']
+    pragmas = [
+        f"journal_mode = {config['DB_JOURNAL_MODE']}",
+        f"synchronous = {config['DB_SYNCHRONOUS']}",
+        f"busy_timeout = {int(config['DB_BUSY_TIMEOUT'])}",
+        f"cache_size = {int(config['DB_CACHE_SIZE'])}",
+        f"mmap_size = {int(config['DB_MMAP_SIZE'])}",
+        f"foreign_keys = {'ON' if foreign_keys else 'OFF'}",
+    ]
+    return pragmas
+
+
+def crear_pool(app, factory=sqlite3.Connection, database=None, foreign_keys=None):
+    config = app.config
+    database = database or config['DATABASE']
+    pool = PoolConexiones(
+        database,
+        factory=factory,
+        max_conexiones=config['DB_POOL_MAX'],
+        timeout=config['DB_POOL_TIMEOUT'],
+        pragmas=pragmas_desde_config(config, foreign_keys),
+        chequeo_inactividad=config['DB_POOL_CHEQUEO_INACTIVIDAD'],
+    )
+    logging.info(f"Pool SQLite creado para {database} (max {pool.max_conexiones})")
+    return pool
@@ -1,50 +1,65 @@
+import logging
+import math
 import sqlite3
-from flask import current_app, g
+from flask import current_app, g, jsonify
+from db_pool import PoolAgotado, crear_pool
+from metricas import ConexionInstrumentada
+from migraciones import aplicar_migraciones, db_cli
 
 DATABASE = 'instance/proyecto_flask.sqlite'
 
+def get_pool(app=None):
+    app = app or current_app
+    pool = app.extensions.get('db_pool')
+    if pool is None:
+        pool = app.extensions['db_pool'] = crear_pool(app, factory=ConexionInstrumentada)
+    return pool
+
+def preparar_fork(app):
+    """Cierra las conexiones del pool en el proceso padre: una conexion SQLite no debe cruzar un fork."""
+    pool = app.extensions.get('db_pool')
+    if pool is not None:
+        pool.cerrar()
+    router = app.extensions.get('shards')
+    if router is not None:
+        router.cerrar()
+
+def reiniciar_pool(app):
+    """Pool nuevo para el proceso hijo; sus conexiones se abren al primer uso, ya despues del fork."""
+    app.extensions['db_pool'] = crear_pool(app, factory=ConexionInstrumentada)
+    router = app.extensions.get('shards')
+    if router is not None:
+        router.crear_pools(app)
+    return app.extensions['db_pool']
+
 def get_db_connection():
+    #la conexion se toma del pool una vez por peticion y se devuelve en el teardown
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().obtener()
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().liberar(db)
 
-#funcion de inicializacion
+#funcion de inicializacion: el esquema lo definen las migraciones versionadas
 def init_db(app):
     with app.app_context():
-        db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL
-            )
-        """)
-
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS productos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre TEXT NOT NULL,
-                cantidad INTEGER NOT NULL,
-                precio REAL NOT NULL,
-                usuario_id INTEGER NOT NULL,
-                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-            )
-        """)
-
-        db.commit()
+        aplicar_migraciones(get_db_connection())
 
 
 def init_app_db(app):
+    get_pool(app)
     app.teardown_appcontext(close_db)
-    init_db(app)
\ No newline at end of file
+    app.cli.add_command(db_cli)
+    if app.config['MIGRAR_AL_INICIAR']:
+        init_db(app)
+
+    @app.errorhandler(PoolAgotado)
+    def pool_agotado(error):
+        #sobrecarga pasajera: el cliente puede reintentar, no es un error del servidor
+        logging.warning(f"Peticion rechazada por pool agotado: {error}")
+        response = jsonify({"mensaje": "Servidor ocupado, reintente en unos segundos"})
+        response.headers['Retry-After'] = str(max(1, math.ceil(app.config['DB_POOL_TIMEOUT'])))
+        return response, 503
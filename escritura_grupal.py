@@ -0,0 +1,207 @@
+#escritura_grupal.py
+#group commit: un hilo escritor agrupa escrituras concurrentes en una sola transaccion
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from flask import current_app
+from db_pool import abrir_conexion, pragmas_desde_config
+from shards import destino_productos, get_productos_db, verificar_usuario_movido
+
+logging.basicConfig(level=logging.INFO)
+
+
+class EscrituraGrupal:
+    """Cola de operaciones ``operacion(db) -> resultado`` aplicadas por un unico hilo.
+
+    El hilo toma la primera operacion pendiente, espera hasta ``ventana`` segundos
+    (o hasta ``max_operaciones``) a que lleguen mas, y las ejecuta en una sola
+    transaccion con un SAVEPOINT por operacion: si una falla solo se deshace esa.
+    Cada peticion recibe su resultado despues del COMMIT, asi que la durabilidad
+    es la misma que con un commit por peticion, pero con un fsync por lote.
+    Si el hilo muere, las operaciones pendientes fallan y la siguiente arranca
+    otro; una operacion que no empezo en ``timeout`` segundos se cancela.
+    """
+
+    def __init__(self, database, pragmas, ventana=0.002, max_operaciones=64, timeout=10.0):
+        self.database = database
+        self.pragmas = pragmas
+        self.ventana = ventana
+        self.max_operaciones = max_operaciones
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self._stats = {"operaciones": 0, "lotes": 0, "lote_max": 0, "errores_commit": 0}
+
+    def _asegurar_hilo(self):
+        #el hilo no sobrevive a un fork: cada proceso arranca el suyo
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._cola = queue.Queue()
+            threading.Thread(target=self._bucle, args=(self._cola,), name='escritura-grupal', daemon=True).start()
+            self._pid = os.getpid()
+
+    def ejecutar(self, operacion):
+        self._asegurar_hilo()
+        futuro = Future()
+        self._cola.put((operacion, futuro))
+        try:
+            return futuro.result(timeout=self.timeout)
+        except TimeoutError:
+            #si el lote ya la esta aplicando no se puede cancelar: su resultado llega con el COMMIT
+            if not futuro.cancel():
+                return futuro.result()
+            raise sqlite3.OperationalError(f"El escritor no aplico la operacion en {self.timeout}s")
+
+    def _bucle(self, cola):
+        lote = []
+        db = None
+        try:
+            db = abrir_conexion(self.database, self.pragmas)
+            while True:
+                lote = [cola.get()]
+                limite = time.monotonic() + self.ventana
+                while len(lote) < self.max_operaciones:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        lote.append(cola.get(timeout=restante))
+                    except queue.Empty:
+                        break
+                self._aplicar(db, lote)
+        except BaseException as e:
+            logging.error(f"El hilo de escritura grupal termino con error: {e!r}")
+            error = sqlite3.OperationalError(f"El escritor de {self.database} fallo: {e}")
+            with self._lock:
+                #la proxima ejecutar() arranca un hilo nuevo con otra cola
+                if self._cola is cola:
+                    self._pid = None
+            for _, futuro in lote:
+                _fallar(futuro, error)
+            while True:
+                try:
+                    _, futuro = cola.get_nowait()
+                except queue.Empty:
+                    break
+                _fallar(futuro, error)
+            if db is not None:
+                db.close()
+
+    def _aplicar(self, db, lote):
+        #las operaciones canceladas por timeout no se aplican
+        lote[:] = [(operacion, futuro) for operacion, futuro in lote if futuro.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        resultados = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for operacion, futuro in lote:
+                db.execute("SAVEPOINT operacion")
+                try:
+                    resultados.append((futuro, operacion(db), None))
+                    db.execute("RELEASE operacion")
+                except Exception as e:
+                    db.execute("ROLLBACK TO operacion")
+                    db.execute("RELEASE operacion")
+                    resultados.append((futuro, None, e))
+            db.commit()
+        except sqlite3.Error as e:
+            #sin COMMIT ninguna operacion del lote quedo escrita
+            try:
+                db.rollback()
+            except sqlite3.Error:
+                pass
+            logging.error(f"Fallo el commit de un lote de {len(lote)} escrituras: {e}")
+            with self._lock:
+                self._stats["errores_commit"] += 1
+            for _, futuro in lote:
+                futuro.set_exception(e)
+            return
+
+        with self._lock:
+            self._stats["operaciones"] += len(lote)
+            self._stats["lotes"] += 1
+            self._stats["lote_max"] = max(self._stats["lote_max"], len(lote))
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def _fallar(futuro, error):
+    try:
+        futuro.set_exception(error)
+    except InvalidStateError:
+        #ya resuelta o cancelada por timeout
+        pass
+
+
+def ejecutar_escritura(operacion, user_id):
+    """Aplica ``operacion(db)`` en la base con los productos del usuario y la confirma.
+
+    Con group commit la aplica el escritor de esa base; si no, la conexion de la
+    peticion. La operacion no debe hacer commit ni depender de la conexion de la
+    peticion, y debe devolver datos ya leidos (fetchall / dict), no cursores.
+    """
+    indice, _ = destino_productos(user_id)
+    if indice is None:
+        grupal = current_app.extensions.get('escritura_grupal')
+    else:
+        grupal = current_app.extensions.get('escritura_grupal_shards', {}).get(indice)
+    if grupal is not None:
+        try:
+            return grupal.ejecutar(operacion)
+        except sqlite3.IntegrityError as e:
+            verificar_usuario_movido(e, user_id)
+            raise
+
+    db = get_productos_db(user_id)
+    try:
+        resultado = operacion(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        verificar_usuario_movido(e, user_id)
+        raise
+    return resultado
+
+
+def init_app_escritura_grupal(app):
+    config = app.config
+    if not config['GROUP_COMMIT']:
+        return
+    #el lote de adelante puede esperar el lock busy_timeout y el propio otro tanto
+    timeout = 2 * config['DB_BUSY_TIMEOUT'] / 1000
+    app.extensions['escritura_grupal'] = EscrituraGrupal(
+        config['DATABASE'],
+        pragmas_desde_config(config),
+        ventana=config['GROUP_COMMIT_VENTANA'],
+        max_operaciones=config['GROUP_COMMIT_MAX_OPERACIONES'],
+        timeout=timeout,
+    )
+    #con sharding, un escritor por shard: cada archivo tiene su propio lock de escritura
+    router = app.extensions.get('shards')
+    if router is not None:
+        app.extensions['escritura_grupal_shards'] = {
+            indice: EscrituraGrupal(
+                pool.database,
+                pool.pragmas,
+                ventana=config['GROUP_COMMIT_VENTANA'],
+                max_operaciones=config['GROUP_COMMIT_MAX_OPERACIONES'],
+                timeout=timeout,
+            )
+            for indice, pool in enumerate(router.pools)
+        }
@@ -0,0 +1,220 @@
+#eventos.py
+#hub pub/sub en proceso para el stream SSE de cambios de productos
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from flask import current_app
+from cambios import leer_cambios
+from shards import UsuarioEnMovimiento, bases_productos, get_productos_db
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Suscripcion:
+    """Cola acotada de un cliente SSE. Si se llena, el hub la desaloja en vez de bloquear al escritor."""
+
+    __slots__ = ('usuario_id', 'cola', 'desalojada', '_bucle', '_evento')
+
+    def __init__(self, usuario_id, tamano_cola):
+        self.usuario_id = usuario_id
+        self.cola = queue.Queue(maxsize=tamano_cola)
+        self.desalojada = False
+        self._bucle = None
+        self._evento = None
+
+    def siguiente(self, timeout):
+        """Proximo cambio, o None si pasaron ``timeout`` segundos sin eventos (heartbeat)."""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def siguiente_async(self, timeout):
+        """Como ``siguiente`` pero esperando en el bucle de eventos (modo ASGI), sin ocupar un hilo."""
+        if self._evento is None:
+            self._evento = asyncio.Event()
+            self._bucle = asyncio.get_running_loop()
+        limite = self._bucle.time() + timeout
+        while True:
+            #se limpia antes de mirar la cola: un put posterior vuelve a despertar la espera
+            self._evento.clear()
+            try:
+                return self.cola.get_nowait()
+            except queue.Empty:
+                pass
+            restante = limite - self._bucle.time()
+            if restante <= 0 or self.desalojada:
+                return None
+            try:
+                await asyncio.wait_for(self._evento.wait(), restante)
+            except TimeoutError:
+                return None
+
+    def avisar(self):
+        """Despierta a ``siguiente_async``; se llama desde el hilo que publica."""
+        bucle = self._bucle
+        if bucle is None:
+            return
+        try:
+            bucle.call_soon_threadsafe(self._evento.set)
+        except RuntimeError:
+            #el bucle ya se cerro: la conexion termino
+            pass
+
+
+class HubEventos:
+    """Suscripciones por usuario y publicacion ordenada de los cambios del feed.
+
+    El hub es de cada proceso. Las escrituras de este proceso publican al
+    confirmarse; las de otros procesos (workers de gunicorn, la CLI) se detectan
+    cada ``sondeo`` segundos comparando la version maxima del feed de cada base.
+    Con WSGI cada suscriptor ocupa un hilo del servidor mientras dure la conexion
+    (bloqueado en ``Queue.get``); en modo ASGI espera en el bucle de eventos. Por usuario se guarda la ultima version
+    publicada; cada publicacion lee del registro de cambios todo lo posterior, asi
+    los eventos salen en orden de version aunque los commits terminen en otro orden.
+    """
+
+    def __init__(self, tamano_cola=100, sondeo=0.0, app=None):
+        self.tamano_cola = tamano_cola
+        self.sondeo = sondeo
+        self._app = app
+        self._pid = None
+        self._suscripciones = {}
+        self._publicado = {}
+        self._lock = threading.Lock()
+        self._locks_usuarios = [threading.Lock() for _ in range(64)]
+        self.desalojos = 0
+
+    def suscribir(self, usuario_id, version_actual):
+        suscripcion = Suscripcion(usuario_id, self.tamano_cola)
+        with self._lock:
+            self._suscripciones.setdefault(usuario_id, set()).add(suscripcion)
+            self._publicado.setdefault(usuario_id, version_actual)
+        if self.sondeo > 0 and self._app is not None:
+            self._asegurar_sondeo()
+        return suscripcion
+
+    def _asegurar_sondeo(self):
+        #el hilo no sobrevive a un fork: cada worker arranca el suyo con su primer suscriptor
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._sondear, name='sondeo-eventos', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _sondear(self):
+        ultimas = None
+        while True:
+            time.sleep(self.sondeo)
+            with self._lock:
+                usuarios = list(self._suscripciones)
+            if not usuarios:
+                continue
+            try:
+                with self._app.app_context():
+                    #una consulta por base (MAX sobre la clave primaria) mientras nadie escribe
+                    versiones = tuple(_version_maxima(pool) for pool in bases_productos())
+                    if versiones == ultimas:
+                        continue
+                    ultimas = versiones
+                    for usuario_id in usuarios:
+                        try:
+                            self.publicar(get_productos_db(usuario_id), usuario_id)
+                        except UsuarioEnMovimiento:
+                            pass
+            except Exception as e:
+                logging.error(f"Error al sondear el feed de cambios: {e}")
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(suscripcion.usuario_id)
+            if suscripciones is None:
+                return
+            suscripciones.discard(suscripcion)
+            if not suscripciones:
+                del self._suscripciones[suscripcion.usuario_id]
+                del self._publicado[suscripcion.usuario_id]
+
+    def tiene_suscriptores(self, usuario_id):
+        return usuario_id in self._suscripciones
+
+    def publicar(self, db, usuario_id):
+        """Reparte a los suscriptores del usuario los cambios aun no publicados.
+
+        La consulta corre fuera del lock del hub, de a ``tamano_cola`` cambios: el
+        backlog de un usuario no frena las publicaciones de los demas. Un lock por
+        franja de usuarios mantiene el orden de las publicaciones de cada usuario.
+        """
+        with self._locks_usuarios[usuario_id % len(self._locks_usuarios)]:
+            while True:
+                with self._lock:
+                    if usuario_id not in self._suscripciones:
+                        return
+                    desde = self._publicado[usuario_id]
+                cambios = leer_cambios(db, usuario_id, desde, self.tamano_cola)
+                if not cambios:
+                    return
+                with self._lock:
+                    #si todos se fueron y llego un suscriptor nuevo, su version de partida es otra
+                    if self._publicado.get(usuario_id) != desde:
+                        continue
+                    self._publicado[usuario_id] = cambios[-1]["version"]
+                    for suscripcion in list(self._suscripciones[usuario_id]):
+                        try:
+                            for cambio in cambios:
+                                suscripcion.cola.put_nowait(cambio)
+                            suscripcion.avisar()
+                        except queue.Full:
+                            #consumidor lento: se le corta el stream y se reconecta con Last-Event-ID
+                            suscripcion.desalojada = True
+                            self._suscripciones[usuario_id].discard(suscripcion)
+                            self.desalojos += 1
+                            suscripcion.avisar()
+                            logging.warning(f"Suscriptor SSE del usuario {usuario_id} desalojado por cola llena")
+                    if not self._suscripciones[usuario_id]:
+                        del self._suscripciones[usuario_id]
+                        del self._publicado[usuario_id]
+                if len(cambios) < self.tamano_cola:
+                    return
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "suscriptores": sum(len(s) for s in self._suscripciones.values()),
+                "usuarios": len(self._suscripciones),
+                "desalojos": self.desalojos,
+            }
+
+
+def _version_maxima(pool):
+    db = pool.obtener()
+    try:
+        return db.execute("SELECT COALESCE(MAX(version), 0) FROM productos_cambios").fetchone()[0]
+    finally:
+        pool.liberar(db)
+
+
+def notificar_cambios(db, usuario_id):
+    """Llamar despues del commit de una escritura; sin suscriptores del usuario no hace nada."""
+    hub = current_app.extensions.get('eventos')
+    if hub is None or not hub.tiene_suscriptores(usuario_id):
+        return
+    try:
+        hub.publicar(db, usuario_id)
+    except Exception as e:
+        #la escritura ya esta confirmada: un fallo aqui no debe convertirla en error
+        logging.error(f"Error al publicar eventos del usuario {usuario_id}: {e}")
+
+
+def init_app_eventos(app):
+    #en pruebas no se sondea: las escrituras son del mismo proceso
+    sondeo = 0 if app.config.get('TESTING') else app.config['EVENTOS_SONDEO']
+    app.extensions['eventos'] = HubEventos(app.config['EVENTOS_TAMANO_COLA'], sondeo, app)
+
+
+def get_hub():
+    return current_app.extensions['eventos']
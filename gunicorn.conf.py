@@ -0,0 +1,51 @@
+#gunicorn.conf.py
+#servidor de produccion: gunicorn -c gunicorn.conf.py wsgi:app
+#workers prefork (gthread) con la app cargada antes del fork y conexiones SQLite abiertas despues
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+#un worker por CPU: SQLite serializa las escrituras, mas procesos no agregan throughput de escritura
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+#hilos por worker; no deberia superar DB_POOL_MAX (cada peticion toma una conexion del pool).
+#cada suscriptor de GET /productos/events ocupa un hilo mientras dura el stream: con 4 hilos, 4 clientes SSE
+#dejan al worker sin hilos; sumar los suscriptores esperados o servir con asgi:app (ver README)
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+#create_app (migraciones incluidas) corre una sola vez en el master y los workers heredan la app
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+#al recargar (HUP) o detener (TERM) cada worker termina sus peticiones en curso durante este tiempo
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+#reciclar workers cada N peticiones (0 = nunca); el jitter evita que se reinicien todos juntos
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
+
+
+def _app():
+    from wsgi import app
+    return app
+
+
+def when_ready(server):
+    #el master ya no usa la base: sus conexiones (las de las migraciones) se cierran antes de crear workers;
+    #los hilos de fondo (compactador de cambios, respaldos) arrancan en cada worker con su primera peticion
+    from db_utils import preparar_fork
+    preparar_fork(_app())
+    server.log.info("App precargada; conexiones SQLite del master cerradas antes del fork")
+
+
+def post_fork(server, worker):
+    from db_utils import reiniciar_pool
+    reiniciar_pool(_app())
+
+
+def worker_exit(server, worker):
+    from db_utils import preparar_fork
+    preparar_fork(_app())
@@ -0,0 +1,129 @@
+#hashing.py
+#hash de contraseñas fuera de los hilos de peticion, con backpressure
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+#limites superiores (segundos) de los buckets del histograma de latencia
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#un ProcessPoolExecutor por proceso y por cantidad de workers; se recrea tras un fork
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    clave = (os.getpid(), workers)
+    with _executors_lock:
+        executor = _executors.get(clave)
+        if executor is None:
+            #spawn: los workers no heredan hilos ni locks del servidor
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            _executors[clave] = executor
+        return executor
+
+
+@atexit.register
+def _cerrar_executors():
+    for (pid, _), executor in list(_executors.items()):
+        if pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HashSaturado(Exception):
+    """El pool de hashing no tiene cupo o no respondio a tiempo."""
+
+
+class PoolHash:
+    """Ejecuta generate/check_password_hash en un pool de procesos acotado.
+
+    Como maximo ``max_pendientes`` operaciones en cola o en curso en el pool (las
+    que vencieron su timeout siguen ocupando cupo hasta terminar); la siguiente
+    se rechaza de inmediato con HashSaturado. Con ``workers=0`` el hash se
+    calcula en el hilo de la peticion (mismo limite de concurrencia).
+    """
+
+    def __init__(self, workers, max_pendientes, timeout):
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self.timeout = timeout
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+        self._lock = threading.Lock()
+        self._en_curso = 0
+        self._stats = {"operaciones": 0, "rechazadas": 0, "timeouts": 0, "segundos_total": 0.0, "segundos_max": 0.0}
+        self._buckets = [0] * (len(BUCKETS_LATENCIA) + 1)
+
+    def _ejecutar(self, fn, *args):
+        if not self._cupos.acquire(blocking=False):
+            with self._lock:
+                self._stats["rechazadas"] += 1
+            raise HashSaturado("Pool de hashing saturado")
+
+        inicio = time.perf_counter()
+        with self._lock:
+            self._en_curso += 1
+        liberar = True
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            futuro = _get_executor(self.workers).submit(fn, *args)
+            #el cupo se libera cuando el worker termina: un hash en curso no se puede cancelar
+            #y liberarlo al vencer el timeout dejaria encolar mas de max_pendientes
+            futuro.add_done_callback(lambda _: self._cupos.release())
+            liberar = False
+            try:
+                return futuro.result(timeout=self.timeout)
+            except TimeoutError:
+                futuro.cancel()
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise HashSaturado(f"El hash no termino en {self.timeout}s")
+        finally:
+            if liberar:
+                self._cupos.release()
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self._en_curso -= 1
+                self._stats["operaciones"] += 1
+                self._stats["segundos_total"] += duracion
+                self._stats["segundos_max"] = max(self._stats["segundos_max"], duracion)
+                self._buckets[_indice_bucket(duracion)] += 1
+
+    def generar(self, password):
+        return self._ejecutar(generate_password_hash, password)
+
+    def verificar(self, password_hash, password):
+        return self._ejecutar(check_password_hash, password_hash, password)
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["en_curso"] = self._en_curso
+            stats["buckets"] = dict(zip((*BUCKETS_LATENCIA, float('inf')), self._buckets))
+        stats["max_pendientes"] = self.max_pendientes
+        return stats
+
+
+def _indice_bucket(duracion):
+    for i, limite in enumerate(BUCKETS_LATENCIA):
+        if duracion <= limite:
+            return i
+    return len(BUCKETS_LATENCIA)
+
+
+def init_app_hashing(app):
+    config = app.config
+    app.extensions['pool_hash'] = PoolHash(
+        config['HASH_POOL_WORKERS'], config['HASH_POOL_MAX_PENDIENTES'], config['HASH_TIMEOUT']
+    )
+
+
+def get_pool_hash():
+    return current_app.extensions['pool_hash']
@@ -0,0 +1,161 @@
+#json_rapido.py
+#proveedor JSON configurable (orjson si esta instalado) y serializacion directa de filas tupla
+import json
+import math
+from json.encoder import encode_basestring_ascii
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _float_finito(texto):
+    valor = float(texto)
+    if not math.isfinite(valor):
+        raise ValueError(f"numero fuera de rango: {texto}")
+    return valor
+
+
+def _constante_invalida(nombre):
+    raise ValueError(f"{nombre} no es JSON valido")
+
+
+def _verificar_finitos(obj):
+    """Lanza ValueError si hay un float NaN/Infinity (como json.dumps con allow_nan=False)."""
+    if type(obj) is float:
+        if not math.isfinite(obj):
+            raise ValueError("Out of range float values are not JSON compliant")
+    elif isinstance(obj, dict):
+        for valor in obj.values():
+            _verificar_finitos(valor)
+    elif isinstance(obj, (list, tuple)):
+        for valor in obj:
+            _verificar_finitos(valor)
+
+
+class ProveedorEstricto(DefaultJSONProvider):
+    """Proveedor de la libreria estandar que, como orjson, no acepta ni emite NaN/Infinity."""
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('allow_nan', False)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        #json.loads acepta NaN, Infinity y 1e400 (que se convierte en inf)
+        kwargs.setdefault('parse_constant', _constante_invalida)
+        kwargs.setdefault('parse_float', _float_finito)
+        return super().loads(s, **kwargs)
+
+
+class ProveedorOrjson(DefaultJSONProvider):
+    """Proveedor de Flask respaldado por orjson; mismos tipos extra que el de Flask.
+
+    orjson rechaza NaN/Infinity al leer, pero al escribir los convierte en null:
+    si la salida contiene null se revisa el objeto y se lanza ValueError.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            #opciones propias de json.dumps (indent, cls...): se usa la libreria estandar
+            return super().dumps(obj, **kwargs)
+        return self._bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _bytes(self, obj):
+        opciones = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        salida = orjson.dumps(obj, default=self.default, option=opciones)
+        if b'null' in salida:
+            _verificar_finitos(obj)
+        return salida
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._bytes(obj), mimetype=self.mimetype)
+
+
+def _nulo(valor):
+    return 'null'
+
+
+def _booleano(valor):
+    return 'true' if valor else 'false'
+
+
+def _float(valor):
+    if not math.isfinite(valor):
+        raise ValueError("Out of range float values are not JSON compliant")
+    return float.__repr__(valor)
+
+
+#codificadores en C de la libreria estandar, elegidos por tipo exacto de cada valor
+_CODIFICADORES = {
+    int: int.__repr__,
+    float: _float,
+    str: encode_basestring_ascii,
+    type(None): _nulo,
+    bool: _booleano,
+}
+
+
+class SerializadorFilas:
+    """Serializa filas tupla (cursor con row_factory=None) a objetos JSON.
+
+    Las claves se escriben una sola vez en una plantilla; por fila solo se
+    codifican los valores, sin construir un dict intermedio. Con orjson
+    disponible se usa orjson, que es mas rapido aun construyendo el dict.
+    """
+
+    def __init__(self, columnas, usar_orjson):
+        self.columnas = tuple(columnas)
+        self.usar_orjson = usar_orjson and orjson is not None
+        self._plantilla = '{' + ','.join(f'{json.dumps(columna)}:%s' for columna in self.columnas) + '}'
+
+    def _objeto(self, fila):
+        return self._plantilla % tuple([
+            _CODIFICADORES.get(type(valor), json.dumps)(valor) for valor in fila
+        ])
+
+    def lista(self, filas):
+        if self.usar_orjson:
+            columnas = self.columnas
+            salida = orjson.dumps([dict(zip(columnas, fila)) for fila in filas])
+            if b'null' in salida:
+                _verificar_finitos(filas)
+            return salida
+        return ('[' + ','.join([self._objeto(fila) for fila in filas]) + ']').encode()
+
+    def ndjson(self, filas):
+        if self.usar_orjson:
+            columnas = self.columnas
+            salida = b''.join([orjson.dumps(dict(zip(columnas, fila))) + b'\n' for fila in filas])
+            if b'null' in salida:
+                _verificar_finitos(filas)
+            return salida
+        return ''.join([self._objeto(fila) + '\n' for fila in filas]).encode()
+
+
+def usa_orjson(config):
+    proveedor = config['JSON_PROVEEDOR']
+    if proveedor == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVEEDOR='orjson' pero orjson no esta instalado")
+    return proveedor == 'orjson' or (proveedor == 'auto' and orjson is not None)
+
+
+def init_app_json(app):
+    app.json = ProveedorOrjson(app) if usa_orjson(app.config) else ProveedorEstricto(app)
+    app.extensions['serializadores_filas'] = {}
+
+
+def get_serializador(columnas):
+    serializadores = current_app.extensions['serializadores_filas']
+    serializador = serializadores.get(columnas)
+    if serializador is None:
+        serializador = serializadores[columnas] = SerializadorFilas(columnas, usa_orjson(current_app.config))
+    return serializador
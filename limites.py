@@ -0,0 +1,54 @@
+#limites.py
+#limitadores token bucket por clave (usuario, IP)
+import threading
+import time
+from collections import OrderedDict
+
+
+class LimitadorTokens:
+    """Token bucket por clave: ``capacidad`` intentos de rafaga y ``recarga`` tokens por segundo.
+
+    Guarda como mucho ``max_claves`` buckets; los menos usados se descartan
+    (equivale a un bucket lleno la proxima vez que aparezcan).
+    """
+
+    def __init__(self, capacidad, recarga, max_claves=100000):
+        self.capacidad = capacidad
+        self.recarga = recarga
+        self.max_claves = max_claves
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rechazos = 0
+
+    def permitir(self, clave):
+        """Consume un token; devuelve 0 si se permite o los segundos a esperar si no."""
+        return self._tomar(clave, consumir=True)
+
+    def consultar(self, clave):
+        """Como permitir() pero sin consumir: 0 si queda al menos un token."""
+        return self._tomar(clave, consumir=False)
+
+    def _tomar(self, clave, consumir):
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.pop(clave, (self.capacidad, ahora))
+            tokens = min(self.capacidad, tokens + (ahora - ultimo) * self.recarga)
+            if tokens >= 1:
+                espera = 0
+                if consumir:
+                    tokens -= 1
+            else:
+                espera = (1 - tokens) / self.recarga
+                self.rechazos += 1
+            self._buckets[clave] = (tokens, ahora)
+            if len(self._buckets) > self.max_claves:
+                self._buckets.popitem(last=False)
+            return espera
+
+
+def init_app_limites(app):
+    config = app.config
+    app.extensions['limitadores_auth'] = {
+        'ip': LimitadorTokens(config['THROTTLE_IP_CAPACIDAD'], config['THROTTLE_IP_RECARGA']),
+        'usuario': LimitadorTokens(config['THROTTLE_USUARIO_CAPACIDAD'], config['THROTTLE_USUARIO_RECARGA']),
+    }
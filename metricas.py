@@ -0,0 +1,303 @@
+#metricas.py
+#latencias por endpoint, conteo de SQL por peticion y exposicion en formato Prometheus
+import hmac
+import sqlite3
+import threading
+import time
+from flask import current_app, g, has_app_context, jsonify, request
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ConexionInstrumentada(sqlite3.Connection):
+    """Conexion que acumula en ``g`` cuantas sentencias ejecuta la peticion y cuanto tardan.
+
+    Solo se miden execute/executemany/executescript de la conexion; el tiempo de
+    una SELECT cubre la preparacion y la primera fila (el resto se lee al hacer fetch).
+    """
+
+    def _medir(self, metodo, sql, params=None, lote=None):
+        inicio = time.perf_counter()
+        try:
+            if params is None:
+                return metodo(self, sql)
+            return metodo(self, sql, params)
+        finally:
+            if has_app_context():
+                duracion = time.perf_counter() - inicio
+                g._sql_consultas = g.get('_sql_consultas', 0) + 1
+                g._sql_segundos = g.get('_sql_segundos', 0.0) + duracion
+                lentas = current_app.extensions.get('consultas_lentas')
+                if lentas is not None and duracion >= lentas.umbral:
+                    #en un lote, el plan y la forma de los parametros salen de la primera fila
+                    muestra = params if lote is None else (params[0] if params else None)
+                    lentas.registrar(self, sql, muestra, duracion, lote)
+
+    #mismas firmas que sqlite3.Connection (argumentos solo posicionales)
+    def execute(self, sql, parameters=(), /):
+        return self._medir(sqlite3.Connection.execute, sql, parameters)
+
+    def executemany(self, sql, parameters, /):
+        #el iterable puede ser un generador: se materializa para medir el tamaño del lote
+        parameters = list(parameters)
+        return self._medir(sqlite3.Connection.executemany, sql, parameters, lote=len(parameters))
+
+    def executescript(self, sql_script, /):
+        return self._medir(sqlite3.Connection.executescript, sql_script)
+
+
+class _Histograma:
+    __slots__ = ('buckets', 'cuentas', 'suma', 'total')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.cuentas = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.cuentas[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+
+def _etiquetas(labels):
+    if not labels:
+        return ''
+    pares = ','.join(
+        f'{clave}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for clave, valor in labels
+    )
+    return '{' + pares + '}'
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class RegistroMetricas:
+    """Familias de contadores, gauges e histogramas con etiquetas, mas colectores.
+
+    Un colector es una funcion sin argumentos que devuelve una lista de
+    ``(nombre, tipo, ayuda, [(labels_dict, valor), ...])`` leida al exportar;
+    para el tipo histogram el valor es ``{'buckets', 'suma', 'total'}``.
+    """
+
+    def __init__(self):
+        self._familias = {}
+        self._colectores = []
+        self._lock = threading.Lock()
+
+    def _serie(self, nombre, tipo, ayuda, labels, fabrica):
+        familia = self._familias.get(nombre)
+        if familia is None:
+            familia = self._familias[nombre] = {'tipo': tipo, 'ayuda': ayuda, 'series': {}}
+        clave = tuple(sorted(labels.items()))
+        serie = familia['series'].get(clave)
+        if serie is None:
+            serie = familia['series'][clave] = fabrica()
+        return familia['series'], clave, serie
+
+    def incrementar(self, nombre, valor=1, ayuda='', **labels):
+        with self._lock:
+            series, clave, actual = self._serie(nombre, 'counter', ayuda, labels, int)
+            series[clave] = actual + valor
+
+    def fijar(self, nombre, valor, ayuda='', **labels):
+        with self._lock:
+            series, clave, _ = self._serie(nombre, 'gauge', ayuda, labels, int)
+            series[clave] = valor
+
+    def sumar_gauge(self, nombre, valor, ayuda='', **labels):
+        with self._lock:
+            series, clave, actual = self._serie(nombre, 'gauge', ayuda, labels, int)
+            series[clave] = actual + valor
+
+    def observar(self, nombre, valor, ayuda='', buckets=BUCKETS_LATENCIA, **labels):
+        with self._lock:
+            _, _, histograma = self._serie(nombre, 'histogram', ayuda, labels, lambda: _Histograma(buckets))
+            histograma.observar(valor)
+
+    def agregar_colector(self, colector):
+        self._colectores.append(colector)
+
+    def exportar(self):
+        lineas = []
+        with self._lock:
+            for nombre, familia in sorted(self._familias.items()):
+                lineas.append(f"# HELP {nombre} {familia['ayuda']}")
+                lineas.append(f"# TYPE {nombre} {familia['tipo']}")
+                for clave, serie in sorted(familia['series'].items()):
+                    if familia['tipo'] == 'histogram':
+                        acumulado = 0
+                        for limite, cuenta in zip(serie.buckets, serie.cuentas):
+                            acumulado += cuenta
+                            lineas.append(f"{nombre}_bucket{_etiquetas(clave + (('le', _numero(limite)),))} {acumulado}")
+                        lineas.append(f"{nombre}_bucket{_etiquetas(clave + (('le', '+Inf'),))} {serie.total}")
+                        lineas.append(f"{nombre}_sum{_etiquetas(clave)} {_numero(serie.suma)}")
+                        lineas.append(f"{nombre}_count{_etiquetas(clave)} {serie.total}")
+                    else:
+                        lineas.append(f"{nombre}{_etiquetas(clave)} {_numero(serie)}")
+
+        for colector in self._colectores:
+            for nombre, tipo, ayuda, muestras in colector():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for labels, valor in muestras:
+                    clave = tuple(sorted(labels.items()))
+                    if tipo == 'histogram':
+                        #valor: {'buckets': [(limite, acumulado), ...], 'suma': ..., 'total': ...}
+                        for limite, acumulado in valor['buckets']:
+                            lineas.append(f"{nombre}_bucket{_etiquetas(clave + (('le', _numero(limite)),))} {acumulado}")
+                        lineas.append(f"{nombre}_sum{_etiquetas(clave)} {_numero(valor['suma'])}")
+                        lineas.append(f"{nombre}_count{_etiquetas(clave)} {valor['total']}")
+                    else:
+                        lineas.append(f"{nombre}{_etiquetas(clave)} {_numero(valor)}")
+        return '\n'.join(lineas) + '\n'
+
+
+def _antes_de_peticion():
+    g._metricas_inicio = time.perf_counter()
+    g._metricas_endpoint = request.endpoint or 'sin_ruta'
+    get_metricas().sumar_gauge(
+        'inventario_http_requests_in_flight', 1, 'Peticiones en curso', endpoint=g._metricas_endpoint
+    )
+
+
+def _despues_de_peticion(response):
+    g._metricas_status = response.status_code
+    return response
+
+
+def _fin_de_peticion(exc):
+    inicio = g.pop('_metricas_inicio', None)
+    if inicio is None:
+        return
+    duracion = time.perf_counter() - inicio
+    endpoint = g.pop('_metricas_endpoint')
+    status = 500 if exc is not None else g.pop('_metricas_status', 500)
+    metricas = get_metricas()
+
+    metricas.sumar_gauge('inventario_http_requests_in_flight', -1, 'Peticiones en curso', endpoint=endpoint)
+    metricas.observar('inventario_http_request_duration_seconds', duracion,
+                      'Latencia de las peticiones por endpoint', endpoint=endpoint)
+    metricas.incrementar('inventario_http_requests_total', 1,
+                         'Peticiones por endpoint y codigo de estado', endpoint=endpoint, status=status)
+    metricas.incrementar('inventario_sql_queries_total', g.pop('_sql_consultas', 0),
+                         'Sentencias SQL ejecutadas por endpoint', endpoint=endpoint)
+    metricas.incrementar('inventario_sql_query_duration_seconds_total', g.pop('_sql_segundos', 0.0),
+                         'Tiempo total en sentencias SQL por endpoint', endpoint=endpoint)
+    #impacto de los snapshots: la misma latencia separada segun haya o no un snapshot en curso
+    respaldos = current_app.extensions.get('respaldos')
+    if respaldos is not None:
+        metricas.observar('inventario_http_request_duration_by_backup_seconds', duracion,
+                          'Latencia de las peticiones con y sin snapshot en curso',
+                          respaldo='en_curso' if respaldos.en_curso() else 'inactivo')
+
+
+def _colector_componentes(app):
+    def colectar():
+        familias = []
+        pool = app.extensions.get('db_pool')
+        if pool is not None:
+            stats = pool.estadisticas()
+            familias.append(('inventario_db_pool_connections', 'gauge', 'Conexiones del pool SQLite',
+                             [({'estado': estado}, stats[estado]) for estado in ('abiertas', 'en_uso', 'libres')]))
+            familias.append(('inventario_db_pool_events_total', 'counter', 'Eventos del pool SQLite',
+                             [({'evento': evento}, stats[evento])
+                              for evento in ('creadas', 'prestamos', 'esperas', 'timeouts', 'descartadas')]))
+
+        cache = app.extensions.get('cache_productos')
+        if cache is not None:
+            stats = cache.estadisticas()
+            familias.append(('inventario_cache_events_total', 'counter', 'Eventos de la cache de productos',
+                             [({'evento': evento}, stats[evento])
+                              for evento in ('hits', 'misses', 'evicciones', 'expiradas', 'invalidaciones', 'errores')
+                              if evento in stats]))
+            if 'entradas' in stats:
+                familias.append(('inventario_cache_entries', 'gauge', 'Entradas en la cache de productos',
+                                 [({}, stats['entradas'])]))
+                familias.append(('inventario_cache_bytes', 'gauge', 'Bytes aproximados en la cache de productos',
+                                 [({}, stats['bytes'])]))
+
+        pool_hash = app.extensions.get('pool_hash')
+        if pool_hash is not None:
+            stats = pool_hash.estadisticas()
+            acumulado = 0
+            buckets = []
+            for limite, cuenta in stats['buckets'].items():
+                acumulado += cuenta
+                buckets.append((limite, acumulado))
+            familias.append(('inventario_password_hash_duration_seconds', 'histogram',
+                             'Latencia del hash de contraseñas (incluye la espera en el pool)',
+                             [({}, {'buckets': buckets, 'suma': stats['segundos_total'], 'total': stats['operaciones']})]))
+            familias.append(('inventario_password_hash_rejected_total', 'counter',
+                             'Operaciones de hash rechazadas por saturacion o timeout',
+                             [({'motivo': 'saturado'}, stats['rechazadas']), ({'motivo': 'timeout'}, stats['timeouts'])]))
+
+        escritores = [app.extensions['escritura_grupal']] if 'escritura_grupal' in app.extensions else []
+        escritores += app.extensions.get('escritura_grupal_shards', {}).values()
+        if escritores:
+            stats = {tipo: sum(e.estadisticas()[tipo] for e in escritores)
+                     for tipo in ('operaciones', 'lotes', 'errores_commit')}
+            familias.append(('inventario_group_commit_total', 'counter', 'Escrituras y lotes confirmados por group commit',
+                             [({'tipo': 'operaciones'}, stats['operaciones']), ({'tipo': 'lotes'}, stats['lotes']),
+                              ({'tipo': 'errores_commit'}, stats['errores_commit'])]))
+
+        hub = app.extensions.get('eventos')
+        if hub is not None:
+            stats = hub.estadisticas()
+            familias.append(('inventario_sse_subscribers', 'gauge', 'Suscriptores SSE conectados',
+                             [({}, stats['suscriptores'])]))
+            familias.append(('inventario_sse_evictions_total', 'counter', 'Suscriptores SSE desalojados por cola llena',
+                             [({}, stats['desalojos'])]))
+
+        limitadores = app.extensions.get('limitadores_auth')
+        if limitadores is not None:
+            familias.append(('inventario_auth_throttled_total', 'counter', 'Intentos de /auth rechazados por limite',
+                             [({'clave': tipo}, limitador.rechazos) for tipo, limitador in limitadores.items()]))
+
+        respaldos = app.extensions.get('respaldos')
+        if respaldos is not None:
+            stats = respaldos.estadisticas()
+            familias.append(('inventario_backup_in_progress', 'gauge', 'Snapshot en curso (en cualquier proceso)',
+                             [({}, int(stats['en_curso']))]))
+            familias.append(('inventario_backup_last_success_timestamp_seconds', 'gauge',
+                             'Fecha del snapshot mas nuevo de cada base',
+                             [({'base': base}, creado) for base, creado in stats['ultimos'].items()]))
+        return familias
+    return colectar
+
+
+def init_app_metricas(app):
+    metricas = app.extensions['metricas'] = RegistroMetricas()
+    metricas.agregar_colector(_colector_componentes(app))
+    app.before_request(_antes_de_peticion)
+    app.after_request(_despues_de_peticion)
+    app.teardown_request(_fin_de_peticion)
+
+    def exportar_metricas():
+        token = current_app.config.get('METRICAS_TOKEN')
+        if token:
+            autorizacion = request.headers.get('Authorization', '')
+            if not autorizacion.startswith('Bearer '):
+                response = jsonify({"mensaje": "Se requiere token de metricas"})
+                response.status_code = 401
+                response.headers['WWW-Authenticate'] = 'Bearer'
+                return response
+            if not hmac.compare_digest(autorizacion[len('Bearer '):].encode(), token.encode()):
+                return jsonify({"mensaje": "Token de metricas invalido"}), 403
+        return current_app.response_class(
+            metricas.exportar(), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+    app.add_url_rule('/metrics', 'metricas', exportar_metricas)
+
+
+def get_metricas():
+    return current_app.extensions['metricas']
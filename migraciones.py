@@ -0,0 +1,399 @@
+#migraciones.py
+#migraciones versionadas del esquema; cada una se aplica en su propia transaccion
+import logging
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ErrorMigracion(Exception):
+    pass
+
+
+def _columnas(db, tabla):
+    return {fila[1] for fila in db.execute(f"PRAGMA table_info({tabla})")}
+
+
+def _m001_tablas_base(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS productos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            precio REAL NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+
+
+def _m002_reconciliar_productos(db):
+    """Une las dos definiciones de productos: la de init_db y la del antiguo schema.sql.
+
+    Una base creada con schema.sql tiene (descripcion, stock) y ningun dueño: se
+    reconstruye la tabla pasando stock -> cantidad y asignando los productos al
+    primer usuario. Una base creada por init_db solo necesita la columna descripcion.
+    """
+    columnas = _columnas(db, 'productos')
+    if 'stock' in columnas and 'usuario_id' not in columnas:
+        dueno = db.execute("SELECT MIN(id) FROM usuarios").fetchone()[0]
+        huerfanos = db.execute("SELECT COUNT(*) FROM productos").fetchone()[0]
+        if huerfanos and dueno is None:
+            raise ErrorMigracion(
+                "productos (esquema de schema.sql) tiene filas pero no hay usuarios a quien asignarlas"
+            )
+        db.execute("""
+            CREATE TABLE productos_migracion (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL,
+                cantidad INTEGER NOT NULL,
+                precio REAL NOT NULL,
+                usuario_id INTEGER NOT NULL,
+                descripcion TEXT,
+                FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+            )
+        """)
+        db.execute(
+            "INSERT INTO productos_migracion (id, nombre, cantidad, precio, usuario_id, descripcion)"
+            " SELECT id, nombre, stock, precio, ?, descripcion FROM productos",
+            (dueno,)
+        )
+        db.execute("DROP TABLE productos")
+        db.execute("ALTER TABLE productos_migracion RENAME TO productos")
+        logging.info(f"productos migrada desde el esquema de schema.sql ({huerfanos} filas asignadas al usuario {dueno})")
+    elif 'descripcion' not in columnas:
+        db.execute("ALTER TABLE productos ADD COLUMN descripcion TEXT")
+
+
+#deltas del resumen por fila de productos (cuerpo de los triggers de la migracion 8)
+_UMBRAL_STOCK_BAJO = "(SELECT umbral_stock_bajo FROM inventario_resumen_config WHERE id = 1)"
+_SUMAR_RESUMEN = (
+    "INSERT INTO inventario_resumen (usuario_id, productos, unidades, valor, stock_bajo)"
+    " VALUES ({fila}.usuario_id, 1, {fila}.cantidad, {fila}.cantidad * {fila}.precio,"
+    " {fila}.cantidad <= " + _UMBRAL_STOCK_BAJO + ")"
+    " ON CONFLICT (usuario_id) DO UPDATE SET productos = productos + 1,"
+    " unidades = unidades + excluded.unidades, valor = valor + excluded.valor,"
+    " stock_bajo = stock_bajo + excluded.stock_bajo;"
+)
+_RESTAR_RESUMEN = (
+    "UPDATE inventario_resumen SET productos = productos - 1, unidades = unidades - {fila}.cantidad,"
+    " valor = valor - {fila}.cantidad * {fila}.precio,"
+    " stock_bajo = stock_bajo - ({fila}.cantidad <= " + _UMBRAL_STOCK_BAJO + ")"
+    " WHERE usuario_id = {fila}.usuario_id;"
+)
+
+
+#cada migracion es (version, descripcion, lista de sentencias o funcion(db))
+MIGRACIONES = [
+    (1, "tablas base usuarios y productos", _m001_tablas_base),
+    (2, "reconciliar productos con schema.sql (descripcion, stock -> cantidad, usuario_id)", _m002_reconciliar_productos),
+    (3, "indices por usuario para listados y busquedas por id", [
+        #SQLite agrega el rowid al final de cada indice, asi sirven para el keyset (col, id)
+        "CREATE INDEX IF NOT EXISTS idx_productos_usuario_id ON productos (usuario_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_productos_usuario_nombre ON productos (usuario_id, nombre)",
+        "CREATE INDEX IF NOT EXISTS idx_productos_usuario_precio ON productos (usuario_id, precio)",
+        "CREATE INDEX IF NOT EXISTS idx_productos_usuario_cantidad ON productos (usuario_id, cantidad)",
+        #equivalente a idx_productos_usuario_id; lo creaba el init_db anterior
+        "DROP INDEX IF EXISTS idx_productos_usuario",
+    ]),
+    (4, "version del inventario por usuario (ETag)", [
+        """
+        CREATE TABLE IF NOT EXISTS inventario_version (
+            usuario_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        *(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_productos_version_{evento.lower()}
+            AFTER {evento} ON productos
+            BEGIN
+                INSERT INTO inventario_version (usuario_id, version) VALUES ({fila}.usuario_id, 1)
+                ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+            END
+            """
+            for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+        ),
+    ]),
+    (5, "tokens JWT revocados", [
+        """
+        CREATE TABLE IF NOT EXISTS tokens_revocados (
+            jti TEXT PRIMARY KEY,
+            expira INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tokens_revocados_expira ON tokens_revocados (expira)",
+    ]),
+    (6, "registro de cambios de productos (change feed) con tombstones", [
+        #una fila por producto: cada escritura la reemplaza con una version nueva (AUTOINCREMENT
+        #nunca reutiliza valores), asi el registro crece con los productos y no con las escrituras
+        """
+        CREATE TABLE IF NOT EXISTS productos_cambios (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL UNIQUE,
+            operacion TEXT NOT NULL CHECK (operacion IN ('upsert', 'delete')),
+            cambiado_en INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_productos_cambios_usuario ON productos_cambios (usuario_id, version)",
+        #version mas alta de tombstone compactado por usuario: por debajo el feed ya no es completo
+        """
+        CREATE TABLE IF NOT EXISTS productos_cambios_horizonte (
+            usuario_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        *(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_productos_cambios_{evento.lower()}
+            AFTER {evento} ON productos
+            BEGIN
+                INSERT OR REPLACE INTO productos_cambios (usuario_id, producto_id, operacion, cambiado_en)
+                VALUES ({fila}.usuario_id, {fila}.id, '{operacion}', CAST(strftime('%s', 'now') AS INTEGER));
+            END
+            """
+            for evento, fila, operacion in (('INSERT', 'NEW', 'upsert'), ('UPDATE', 'NEW', 'upsert'), ('DELETE', 'OLD', 'delete'))
+        ),
+        #los productos existentes entran al registro como altas
+        """
+        INSERT OR IGNORE INTO productos_cambios (usuario_id, producto_id, operacion, cambiado_en)
+        SELECT usuario_id, id, 'upsert', CAST(strftime('%s', 'now') AS INTEGER) FROM productos ORDER BY id
+        """,
+    ]),
+    (7, "busqueda de texto completo (FTS5) sobre nombre y descripcion", [
+        #contenido externo: el indice no duplica el texto, lo lee de productos por rowid.
+        #usuario_id se indexa como termino para acotar la busqueda al usuario dentro del MATCH
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+            nombre, descripcion, usuario_id,
+            content='productos', content_rowid='id',
+            prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_insert AFTER INSERT ON productos
+        BEGIN
+            INSERT INTO productos_fts (rowid, nombre, descripcion, usuario_id)
+            VALUES (NEW.id, NEW.nombre, NEW.descripcion, NEW.usuario_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_delete AFTER DELETE ON productos
+        BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, descripcion, usuario_id)
+            VALUES ('delete', OLD.id, OLD.nombre, OLD.descripcion, OLD.usuario_id);
+        END
+        """,
+        #los ajustes de stock y precio no tocan el indice
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_update AFTER UPDATE OF nombre, descripcion, usuario_id ON productos
+        BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, descripcion, usuario_id)
+            VALUES ('delete', OLD.id, OLD.nombre, OLD.descripcion, OLD.usuario_id);
+            INSERT INTO productos_fts (rowid, nombre, descripcion, usuario_id)
+            VALUES (NEW.id, NEW.nombre, NEW.descripcion, NEW.usuario_id);
+        END
+        """,
+        "INSERT INTO productos_fts (productos_fts) VALUES ('rebuild')",
+    ]),
+    (8, "resumen agregado del inventario por usuario (valoracion y stock bajo)", [
+        """
+        CREATE TABLE IF NOT EXISTS inventario_resumen (
+            usuario_id INTEGER PRIMARY KEY,
+            productos INTEGER NOT NULL,
+            unidades INTEGER NOT NULL,
+            valor REAL NOT NULL,
+            stock_bajo INTEGER NOT NULL
+        )
+        """,
+        #una sola fila: el umbral lo leen los triggers, cambiarlo exige recalcular (flask resumen recalcular)
+        """
+        CREATE TABLE IF NOT EXISTS inventario_resumen_config (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            umbral_stock_bajo INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO inventario_resumen_config (id, umbral_stock_bajo) VALUES (1, 5)",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_productos_resumen_insert AFTER INSERT ON productos
+        BEGIN
+            {_SUMAR_RESUMEN.format(fila='NEW')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_productos_resumen_delete AFTER DELETE ON productos
+        BEGIN
+            {_RESTAR_RESUMEN.format(fila='OLD')}
+        END
+        """,
+        #los cambios de nombre o descripcion no afectan al resumen
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_productos_resumen_update
+        AFTER UPDATE OF cantidad, precio, usuario_id ON productos
+        BEGIN
+            {_RESTAR_RESUMEN.format(fila='OLD')}
+            {_SUMAR_RESUMEN.format(fila='NEW')}
+        END
+        """,
+        f"""
+        INSERT OR REPLACE INTO inventario_resumen (usuario_id, productos, unidades, valor, stock_bajo)
+        SELECT usuario_id, COUNT(*), SUM(cantidad), SUM(cantidad * precio), SUM(cantidad <= {_UMBRAL_STOCK_BAJO})
+        FROM productos GROUP BY usuario_id
+        """,
+    ]),
+    (9, "directorio de shards por usuario y secuencia global de ids", [
+        #solo se usa en la base principal; moviendo=1 mientras el usuario se migra de shard
+        """
+        CREATE TABLE IF NOT EXISTS usuarios_shard (
+            usuario_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            moviendo INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        #ids de productos unicos entre shards: se reservan por bloques desde la base principal
+        """
+        CREATE TABLE IF NOT EXISTS secuencia_productos (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            valor INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO secuencia_productos (id, valor) VALUES (1, 0)",
+    ]),
+    (10, "secuencia AUTOINCREMENT en tokens revocados para la sincronizacion entre procesos", [
+        #el rowid implicito se reutiliza al podar las filas vencidas; seq nunca se repite
+        """
+        CREATE TABLE tokens_revocados_migracion (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti TEXT UNIQUE NOT NULL,
+            expira INTEGER NOT NULL
+        )
+        """,
+        "INSERT INTO tokens_revocados_migracion (jti, expira) SELECT jti, expira FROM tokens_revocados ORDER BY rowid",
+        "DROP TABLE tokens_revocados",
+        "ALTER TABLE tokens_revocados_migracion RENAME TO tokens_revocados",
+        "CREATE INDEX IF NOT EXISTS idx_tokens_revocados_expira ON tokens_revocados (expira)",
+    ]),
+    (11, "cierre de escrituras de los usuarios movidos a otro shard", [
+        #una fila por usuario cuyos productos ya no viven en esta base (la escribe shards mover)
+        """
+        CREATE TABLE IF NOT EXISTS usuarios_movidos (
+            usuario_id INTEGER PRIMARY KEY
+        )
+        """,
+        *(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_productos_usuario_movido_{evento.lower()}
+            BEFORE {evento} ON productos
+            WHEN EXISTS (SELECT 1 FROM usuarios_movidos WHERE usuario_id = NEW.usuario_id)
+            BEGIN
+                SELECT RAISE(ABORT, 'usuario movido a otro shard');
+            END
+            """
+            for evento in ('INSERT', 'UPDATE')
+        ),
+    ]),
+]
+
+
+def _crear_tabla_control(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migraciones (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            aplicada_en INTEGER NOT NULL
+        )
+    """)
+    db.commit()
+
+
+def versiones_aplicadas(db):
+    _crear_tabla_control(db)
+    return {fila[0] for fila in db.execute("SELECT version FROM schema_migraciones")}
+
+
+def aplicar_migraciones(db, hasta=None):
+    """Aplica en orden las migraciones pendientes. Devuelve las versiones aplicadas."""
+    aplicadas = versiones_aplicadas(db)
+    nuevas = []
+    for version, descripcion, migracion in MIGRACIONES:
+        if version in aplicadas or (hasta is not None and version > hasta):
+            continue
+        #BEGIN explicito: el DDL tambien queda dentro de la transaccion
+        db.execute("BEGIN IMMEDIATE")
+        #con el lock tomado se vuelve a mirar: otro proceso que arranco a la vez pudo aplicarla
+        if db.execute("SELECT 1 FROM schema_migraciones WHERE version = ?", (version,)).fetchone():
+            db.rollback()
+            continue
+        try:
+            if callable(migracion):
+                migracion(db)
+            else:
+                for sentencia in migracion:
+                    db.execute(sentencia)
+            db.execute(
+                "INSERT INTO schema_migraciones (version, descripcion, aplicada_en) VALUES (?, ?, ?)",
+                (version, descripcion, int(time.time()))
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            logging.error(f"Fallo la migracion {version} ({descripcion}); se deshizo")
+            raise
+        logging.info(f"Migracion {version} aplicada: {descripcion}")
+        nuevas.append(version)
+    return nuevas
+
+
+@click.group('db')
+def db_cli():
+    """Migraciones del esquema de la base de datos."""
+
+
+@db_cli.command('upgrade')
+@click.option('--hasta', type=int, default=None, help='Aplicar solo hasta esta version.')
+@with_appcontext
+def upgrade(hasta):
+    """Aplica las migraciones pendientes."""
+    from db_utils import get_db_connection
+    nuevas = aplicar_migraciones(get_db_connection(), hasta)
+    click.echo(f"Migraciones aplicadas: {nuevas}" if nuevas else "El esquema ya esta actualizado")
+    #los shards (DB_SHARDS) tienen el mismo esquema
+    router = current_app.extensions.get('shards')
+    if router is not None:
+        for ruta, pool in zip(router.rutas, router.pools):
+            db = pool.obtener()
+            try:
+                nuevas = aplicar_migraciones(db, hasta)
+            finally:
+                pool.liberar(db)
+            click.echo(f"shard {ruta}: {f'migraciones aplicadas {nuevas}' if nuevas else 'actualizado'}")
+
+
+@db_cli.command('status')
+@with_appcontext
+def status():
+    """Lista las migraciones y si estan aplicadas."""
+    from db_utils import get_db_connection
+    aplicadas = versiones_aplicadas(get_db_connection())
+    for version, descripcion, _ in MIGRACIONES:
+        click.echo(f"[{'x' if version in aplicadas else ' '}] {version:03d} {descripcion}")
+    router = current_app.extensions.get('shards')
+    if router is not None:
+        for ruta, pool in zip(router.rutas, router.pools):
+            db = pool.obtener()
+            try:
+                pendientes = [v for v, _, _ in MIGRACIONES if v not in versiones_aplicadas(db)]
+            finally:
+                pool.liberar(db)
+            click.echo(f"shard {ruta}: {f'pendientes {pendientes}' if pendientes else 'actualizado'}")
@@ -0,0 +1,209 @@
+#puente_asgi.py
+#modo ASGI: el bucle de eventos atiende las conexiones y las vistas de Flask corren en un pool de hilos acotado
+import asyncio
+import contextvars
+import logging
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO)
+
+#cuerpos de peticion hasta este tamaño se guardan en memoria; los mas grandes (import) en disco
+CUERPO_EN_MEMORIA = 1024 * 1024
+
+#una vista puede dejar en el environ una fabrica de generador async que continua su respuesta
+#despues del primer bloque (el stream SSE): el puente lo itera en el bucle, sin hilo
+CLAVE_STREAM_ASYNC = 'inventario.stream_async'
+
+_FIN = object()
+
+
+class AppAsgi:
+    """Aplicacion ASGI 3 que sirve una app Flask (WSGI) sin bloquear el bucle de eventos.
+
+    Leer el cuerpo y enviar la respuesta son operaciones async: un cliente lento o
+    una conexion keep-alive inactiva no ocupan un hilo. Solo la ejecucion de la
+    vista (SQLite, JWT, JSON) pasa a un pool de ``hilos`` hilos (ASGI_HILOS, por
+    defecto DB_POOL_MAX), porque cada vista toma una conexion del pool y mas
+    hilos solo esperarian por ella. El stream SSE sigue en el bucle de eventos
+    (``CLAVE_STREAM_ASYNC``) y no ocupa hilos mientras espera. Las demas
+    respuestas en streaming (export) se iteran en un pool aparte
+    (ASGI_HILOS_STREAMS) para que no le quiten hilos a las vistas: como mucho
+    ``hilos_streams`` exportaciones avanzan a la vez y el resto espera turno.
+    Rutas, JWT y formato de las respuestas son los de ``create_app``.
+    """
+
+    def __init__(self, wsgi_app, hilos=None, hilos_streams=None):
+        config = wsgi_app.config
+        self.wsgi_app = wsgi_app
+        self.hilos = hilos or config['ASGI_HILOS'] or config['DB_POOL_MAX']
+        self.hilos_streams = hilos_streams or config['ASGI_HILOS_STREAMS']
+        self._vistas = None
+        self._streams = None
+
+    def _pools(self):
+        #se crean en el proceso que atiende (despues del fork de los workers del servidor)
+        if self._vistas is None:
+            self._vistas = ThreadPoolExecutor(self.hilos, thread_name_prefix='asgi-vista')
+            self._streams = ThreadPoolExecutor(self.hilos_streams, thread_name_prefix='asgi-stream')
+        return self._vistas, self._streams
+
+    def cerrar(self):
+        if self._vistas is not None:
+            self._vistas.shutdown(wait=False)
+            self._streams.shutdown(wait=False)
+            self._vistas = self._streams = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            #websockets no estan soportados
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                self._pools()
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                self.cerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _leer_cuerpo(self, receive):
+        cuerpo = tempfile.SpooledTemporaryFile(max_size=CUERPO_EN_MEMORIA)
+        longitud = 0
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'http.disconnect':
+                cuerpo.close()
+                return None, 0
+            bloque = mensaje.get('body', b'')
+            cuerpo.write(bloque)
+            longitud += len(bloque)
+            if not mensaje.get('more_body', False):
+                cuerpo.seek(0)
+                return cuerpo, longitud
+
+    def _environ(self, scope, cuerpo, longitud):
+        servidor = scope.get('server') or ('localhost', 80)
+        cliente = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+            #WSGI espera la ruta como bytes decodificados en latin-1
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': servidor[0],
+            'SERVER_PORT': str(servidor[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': cliente[0],
+            'REMOTE_PORT': str(cliente[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': cuerpo,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for nombre, valor in scope.get('headers', []):
+            nombre = nombre.decode('latin-1').upper().replace('-', '_')
+            valor = valor.decode('latin-1')
+            if nombre == 'CONTENT_TYPE':
+                environ[nombre] = valor
+                continue
+            if nombre == 'CONTENT_LENGTH':
+                continue
+            clave = f'HTTP_{nombre}'
+            environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+        #el cuerpo ya esta completo (tambien si llego con Transfer-Encoding: chunked)
+        environ['CONTENT_LENGTH'] = str(longitud)
+        return environ
+
+    def _ejecutar_vista(self, environ):
+        """Corre la vista y lee el primer bloque del cuerpo (toda la respuesta si no es streaming)."""
+        inicio = {}
+
+        def start_response(status, headers, exc_info=None):
+            inicio['status'] = int(status.split(' ', 1)[0])
+            inicio['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        iterable = self.wsgi_app(environ, start_response)
+        iterador = iter(iterable)
+        primero = next(iterador, _FIN)
+        return inicio, iterable, iterador, primero
+
+    async def _http(self, scope, receive, send):
+        cuerpo, longitud = await self._leer_cuerpo(receive)
+        if cuerpo is None:
+            return
+        loop = asyncio.get_running_loop()
+        vistas, streams = self._pools()
+        #la vista y cada paso del stream corren en hilos distintos pero con el mismo contexto:
+        #stream_with_context guarda el contexto de Flask en contextvars
+        contexto = contextvars.copy_context()
+        environ = self._environ(scope, cuerpo, longitud)
+        try:
+            inicio, iterable, iterador, bloque = await loop.run_in_executor(
+                vistas, contexto.run, self._ejecutar_vista, environ
+            )
+        finally:
+            cuerpo.close()
+
+        cabeceras = dict(inicio['headers'])
+        longitud = cabeceras.get(b'content-length')
+        pendiente = int(longitud) if longitud is not None else None
+        #si la respuesta se comprime, los bloques tienen que pasar por el compresor del iterable WSGI
+        fabrica = None if b'content-encoding' in cabeceras else environ.get(CLAVE_STREAM_ASYNC)
+        desconexion = asyncio.ensure_future(receive())
+        try:
+            await send({'type': 'http.response.start', 'status': inicio['status'], 'headers': inicio['headers']})
+            if fabrica is not None and bloque is not _FIN:
+                await send({'type': 'http.response.body', 'body': bloque, 'more_body': True})
+                await self._stream_async(fabrica(), desconexion, send)
+                bloque = _FIN
+            while bloque is not _FIN:
+                if bloque:
+                    await send({'type': 'http.response.body', 'body': bloque, 'more_body': True})
+                    if pendiente is not None:
+                        pendiente -= len(bloque)
+                        if pendiente <= 0:
+                            #respuesta con Content-Length completa: no hace falta otro salto de hilo
+                            break
+                if desconexion.done():
+                    break
+                bloque = await loop.run_in_executor(streams, contexto.run, next, iterador, _FIN)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            desconexion.cancel()
+            if hasattr(iterable, 'close'):
+                #cierra el generador (p. ej. cancela la suscripcion SSE) y dispara el teardown de Flask;
+                #es una tarea corta: va al pool de vistas y no espera turno detras de los streams
+                await loop.run_in_executor(vistas, contexto.run, iterable.close)
+
+    async def _stream_async(self, generador, desconexion, send):
+        """Itera en el bucle un generador async de la vista hasta que termina o el cliente se va."""
+        try:
+            while True:
+                siguiente = asyncio.ensure_future(generador.__anext__())
+                await asyncio.wait({siguiente, desconexion}, return_when=asyncio.FIRST_COMPLETED)
+                if not siguiente.done():
+                    #el cliente se fue: se espera la cancelacion antes de cerrar el generador
+                    siguiente.cancel()
+                    await asyncio.wait({siguiente})
+                    return
+                try:
+                    bloque = siguiente.result()
+                except StopAsyncIteration:
+                    return
+                if isinstance(bloque, str):
+                    bloque = bloque.encode('utf-8')
+                await send({'type': 'http.response.body', 'body': bloque, 'more_body': True})
+        finally:
+            await generador.aclose()
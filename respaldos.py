@@ -0,0 +1,422 @@
+#respaldos.py
+#snapshots en caliente con la API de backup de SQLite: por pasos, verificados, comprimidos y con retencion
+import contextlib
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from db_pool import abrir_conexion
+from db_utils import get_pool
+
+try:
+    import fcntl
+except ImportError:
+    #sin fcntl (Windows) solo se evita la concurrencia dentro del proceso
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+
+#limites superiores (segundos) de los buckets del histograma de duracion de snapshots
+BUCKETS_RESPALDO = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+EXTENSIONES = ('.db', '.db.gz')
+ARCHIVO_BLOQUEO = '.respaldo.lock'
+
+
+class RespaldoEnCurso(Exception):
+    """Ya hay un snapshot en curso (en este u otro proceso)."""
+
+
+def prefijo_snapshot(database):
+    """Prefijo de los snapshots de una base: nombre del archivo mas un crc32 de su ruta absoluta.
+
+    Solo con el nombre, dos bases homonimas en distintos directorios (data/s0.db y
+    bak/s0.db) compartirian prefijo y la retencion de una borraria snapshots de la otra.
+    """
+    ruta = os.path.abspath(database)
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    return f"{nombre}-{zlib.crc32(ruta.encode()):08x}-"
+
+
+def copiar_en_caliente(database, destino, pragmas=(), paginas=512, pausa=0.005):
+    """Copia ``database`` a ``destino`` con la API de backup, ``paginas`` paginas por paso.
+
+    La conexion de origen mantiene abierta una transaccion de lectura durante
+    toda la copia: con WAL eso fija el snapshot (la copia es de un instante) y los
+    commits de otros escritores no reinician el backup. Entre pasos se duerme
+    ``pausa`` segundos para ceder CPU y E/S a las peticiones. Devuelve (pasos, paginas).
+    """
+    origen = abrir_conexion(database, pragmas)
+    copia = sqlite3.connect(destino)
+    pasos = 0
+
+    def progreso(status, restantes, total):
+        nonlocal pasos
+        pasos += 1
+        if restantes:
+            time.sleep(pausa)
+
+    try:
+        origen.execute("BEGIN")
+        origen.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        origen.backup(copia, pages=paginas, progress=progreso)
+        origen.rollback()
+        #la copia es un archivo suelto: sin WAL se puede abrir, verificar y restaurar tal cual
+        copia.execute("PRAGMA journal_mode = DELETE")
+        total = copia.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        copia.close()
+        origen.close()
+    return pasos, total
+
+
+def verificar_integridad(ruta):
+    """(ok, mensajes) de PRAGMA integrity_check sobre un snapshot (.db o .db.gz)."""
+    if ruta.endswith('.gz'):
+        temporal = ruta[:-len('.gz')] + '.verificacion'
+        try:
+            #leer el gzip completo tambien valida su CRC
+            with gzip.open(ruta, 'rb') as comprimido, open(temporal, 'wb') as plano:
+                shutil.copyfileobj(comprimido, plano, 1024 * 1024)
+            return verificar_integridad(temporal)
+        except (OSError, EOFError) as e:
+            return False, [f"gzip invalido: {e}"]
+        finally:
+            if os.path.exists(temporal):
+                os.unlink(temporal)
+    try:
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        try:
+            mensajes = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return False, [str(e)]
+    return mensajes == ['ok'], mensajes
+
+
+def crear_snapshot(database, directorio, pragmas=(), paginas=512, pausa=0.005, comprimir=True):
+    """Copia, verifica y (opcionalmente) comprime un snapshot de ``database``. Devuelve sus datos.
+
+    Se escribe con extension ``.parcial`` y se renombra al final: un archivo
+    ``.db``/``.db.gz`` en el directorio siempre es un snapshot completo y verificado.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    instante = time.time()
+    nombre = prefijo_snapshot(database) + time.strftime('%Y%m%d-%H%M%S', time.gmtime(instante)) + \
+        f"{int(instante * 1000) % 1000:03d}"
+    parcial = os.path.join(directorio, nombre + '.db.parcial')
+    inicio = time.perf_counter()
+    try:
+        pasos, paginas_total = copiar_en_caliente(database, parcial, pragmas, paginas, pausa)
+        ok, mensajes = verificar_integridad(parcial)
+        if not ok:
+            raise sqlite3.DatabaseError(f"integrity_check del snapshot fallo: {'; '.join(mensajes[:5])}")
+        if comprimir:
+            final = os.path.join(directorio, nombre + '.db.gz')
+            with open(parcial, 'rb') as plano, gzip.open(final + '.parcial', 'wb', compresslevel=6) as comprimido:
+                shutil.copyfileobj(plano, comprimido, 1024 * 1024)
+            os.replace(final + '.parcial', final)
+            os.unlink(parcial)
+        else:
+            final = os.path.join(directorio, nombre + '.db')
+            os.replace(parcial, final)
+    except BaseException:
+        for resto in (parcial, parcial.replace('.db.parcial', '.db.gz.parcial')):
+            if os.path.exists(resto):
+                os.unlink(resto)
+        raise
+    return {
+        "base": database,
+        "archivo": final,
+        "bytes": os.path.getsize(final),
+        "paginas": paginas_total,
+        "pasos": pasos,
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "comprimido": comprimir,
+        "integridad": "ok",
+    }
+
+
+def listar_snapshots(directorio, database=None):
+    """Snapshots completos del directorio (de una base o de todas), del mas nuevo al mas viejo."""
+    if not os.path.isdir(directorio):
+        return []
+    prefijo = prefijo_snapshot(database) if database else ''
+    snapshots = []
+    for nombre in os.listdir(directorio):
+        if nombre.startswith(prefijo) and nombre.endswith(EXTENSIONES):
+            ruta = os.path.join(directorio, nombre)
+            snapshots.append({"archivo": ruta, "bytes": os.path.getsize(ruta), "creado": int(os.path.getmtime(ruta))})
+    #el nombre lleva la fecha en UTC: el orden alfabetico es el cronologico dentro de cada base
+    return sorted(snapshots, key=lambda s: (s["creado"], s["archivo"]), reverse=True)
+
+
+def aplicar_retencion(directorio, database, conservar):
+    """Borra los snapshots de ``database`` mas alla de los ``conservar`` mas nuevos. Devuelve los borrados."""
+    borrados = []
+    for snapshot in listar_snapshots(directorio, database)[conservar:]:
+        os.unlink(snapshot["archivo"])
+        borrados.append(snapshot["archivo"])
+    return borrados
+
+
+class GestorRespaldos:
+    """Snapshots de la base principal y de cada shard, uno a la vez entre todos los procesos.
+
+    ``bases`` es una lista de (database, pragmas). Un archivo de bloqueo (flock) en
+    el directorio evita snapshots simultaneos desde la CLI, el endpoint de admin o
+    el programador de otro worker. El programador solo crea un snapshot si el mas
+    nuevo tiene mas de ``intervalo`` segundos, asi varios procesos no duplican trabajo.
+    """
+
+    def __init__(self, bases, directorio, conservar=7, comprimir=True, paginas=512, pausa=0.005, metricas=None):
+        self.bases = list(bases)
+        self.directorio = directorio
+        self.conservar = conservar
+        self.comprimir = comprimir
+        self.paginas = paginas
+        self.pausa = pausa
+        self.metricas = metricas
+        self.ultimo = None
+        self._lock = threading.Lock()
+        self._local = False
+        self._visto = (0.0, False)
+        self._lock_programador = threading.Lock()
+        self._pid = None
+
+    def en_curso(self):
+        """Hay un snapshot en curso en este o en otro proceso (se consulta el bloqueo como mucho 1 vez/s)."""
+        if self._local:
+            return True
+        consultado, valor = self._visto
+        ahora = time.monotonic()
+        if ahora - consultado > 1.0:
+            valor = self._bloqueado_por_otro()
+            self._visto = (ahora, valor)
+        return valor
+
+    def _bloqueado_por_otro(self):
+        #sondeo con LOCK_SH no bloqueante: el flock lo suelta el kernel si el proceso muere, asi
+        #un snapshot interrumpido no queda "en curso" para siempre (como pasaria con un archivo marca)
+        if fcntl is None:
+            return False
+        try:
+            fd = os.open(os.path.join(self.directorio, ARCHIVO_BLOQUEO), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            #cerrar el descriptor suelta el LOCK_SH
+            os.close(fd)
+        return False
+
+    @contextlib.contextmanager
+    def _bloqueo(self):
+        if not self._lock.acquire(blocking=False):
+            raise RespaldoEnCurso("Ya hay un snapshot en curso en este proceso")
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            fd = os.open(os.path.join(self.directorio, ARCHIVO_BLOQUEO), os.O_CREAT | os.O_RDWR)
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        raise RespaldoEnCurso("Ya hay un snapshot en curso en otro proceso")
+                #con el bloqueo tomado, cualquier .parcial es de un snapshot interrumpido
+                for nombre in os.listdir(self.directorio):
+                    if nombre.endswith('.parcial'):
+                        os.unlink(os.path.join(self.directorio, nombre))
+                self._local = True
+                try:
+                    yield
+                finally:
+                    self._local = False
+            finally:
+                os.close(fd)
+        finally:
+            self._lock.release()
+
+    def ejecutar(self):
+        """Snapshot de cada base, retencion y metricas. Devuelve la lista de resultados."""
+        with self._bloqueo():
+            return self._respaldar()
+
+    def _respaldar(self):
+        resultados = []
+        for database, pragmas in self.bases:
+            base = prefijo_snapshot(database).rstrip('-')
+            try:
+                resultado = crear_snapshot(database, self.directorio, pragmas, self.paginas, self.pausa, self.comprimir)
+            except Exception as e:
+                logging.error(f"Fallo el snapshot de {database}: {e}")
+                self._registrar_metricas(base, None)
+                resultados.append({"base": database, "error": str(e)})
+                continue
+            resultado["borrados"] = aplicar_retencion(self.directorio, database, self.conservar)
+            self._registrar_metricas(base, resultado)
+            logging.info(
+                f"Snapshot {resultado['archivo']}: {resultado['paginas']} paginas en {resultado['pasos']} pasos,"
+                f" {resultado['segundos']}s, {resultado['bytes']} bytes"
+            )
+            resultados.append(resultado)
+        self.ultimo = {"terminado": int(time.time()), "resultados": resultados}
+        return resultados
+
+    def ejecutar_en_segundo_plano(self):
+        """Inicia un snapshot en otro hilo; RespaldoEnCurso si ya hay uno en este u otro proceso.
+
+        El bloqueo se toma aqui, antes de responder: quien recibe el 202 sabe que su
+        snapshot arranco, y el hilo lo suelta al terminar.
+        """
+        bloqueo = self._bloqueo()
+        bloqueo.__enter__()
+
+        def correr():
+            try:
+                self._respaldar()
+            except Exception as e:
+                logging.error(f"Error en el snapshot: {e}")
+            finally:
+                bloqueo.__exit__(None, None, None)
+
+        try:
+            threading.Thread(target=correr, name='respaldo', daemon=True).start()
+        except BaseException:
+            bloqueo.__exit__(None, None, None)
+            raise
+
+    def _registrar_metricas(self, base, resultado):
+        if self.metricas is None:
+            return
+        self.metricas.incrementar('inventario_backups_total', 1, 'Snapshots por resultado',
+                                  base=base, resultado='ok' if resultado else 'error')
+        if resultado:
+            self.metricas.observar('inventario_backup_duration_seconds', resultado['segundos'],
+                                   'Duracion de los snapshots (copia, verificacion y compresion)',
+                                   buckets=BUCKETS_RESPALDO, base=base)
+            self.metricas.fijar('inventario_backup_size_bytes', resultado['bytes'],
+                                'Tamaño del ultimo snapshot', base=base)
+
+    def estadisticas(self):
+        #el ultimo snapshot sale del directorio: lo ven todos los procesos, no solo el que lo creo
+        ultimos = {}
+        for database, _ in self.bases:
+            snapshots = listar_snapshots(self.directorio, database)
+            if snapshots:
+                ultimos[prefijo_snapshot(database).rstrip('-')] = snapshots[0]["creado"]
+        return {"en_curso": self.en_curso(), "ultimos": ultimos}
+
+    def vencido(self, intervalo):
+        snapshots = listar_snapshots(self.directorio, self.bases[0][0])
+        return not snapshots or time.time() - snapshots[0]["creado"] >= intervalo
+
+    def iniciar_programador(self, intervalo):
+        #el hilo no sobrevive a un fork: cada proceso arranca el suyo (y el bloqueo evita duplicados)
+        if self._pid == os.getpid():
+            return
+        with self._lock_programador:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._programador, args=(intervalo,), name='programador-respaldos',
+                                 daemon=True).start()
+                self._pid = os.getpid()
+
+    def _programador(self, intervalo):
+        while True:
+            time.sleep(min(intervalo, 60))
+            if not self.vencido(intervalo):
+                continue
+            try:
+                self.ejecutar()
+            except RespaldoEnCurso:
+                pass
+            except Exception as e:
+                logging.error(f"Error en el snapshot programado: {e}")
+
+
+def bases_a_respaldar(app):
+    """(database, pragmas) de la base principal y de cada shard."""
+    pools = [get_pool(app)]
+    router = app.extensions.get('shards')
+    if router is not None:
+        pools += router.pools
+    return [(pool.database, pool.pragmas) for pool in pools]
+
+
+def get_respaldos():
+    return current_app.extensions['respaldos']
+
+
+@click.group('respaldo')
+def respaldo_cli():
+    """Snapshots en caliente de la base de datos."""
+
+
+@respaldo_cli.command('crear')
+@click.option('--sin-comprimir', is_flag=True, help='Guardar el .db sin gzip.')
+@with_appcontext
+def crear(sin_comprimir):
+    """Crea un snapshot de cada base, lo verifica y aplica la retencion."""
+    gestor = get_respaldos()
+    if sin_comprimir:
+        gestor.comprimir = False
+    try:
+        resultados = gestor.ejecutar()
+    except RespaldoEnCurso as e:
+        raise click.ClickException(str(e))
+    for resultado in resultados:
+        if "error" in resultado:
+            click.echo(f"ERROR {resultado['base']}: {resultado['error']}")
+        else:
+            click.echo(f"{resultado['archivo']} ({resultado['bytes']} bytes, {resultado['segundos']}s, integridad ok)")
+    if any("error" in resultado for resultado in resultados):
+        raise SystemExit(1)
+
+
+@respaldo_cli.command('listar')
+@with_appcontext
+def listar():
+    """Lista los snapshots del directorio."""
+    for snapshot in listar_snapshots(get_respaldos().directorio):
+        creado = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['creado']))
+        click.echo(f"{creado}  {snapshot['bytes']:>12}  {snapshot['archivo']}")
+
+
+@respaldo_cli.command('verificar')
+@click.argument('archivo')
+def verificar(archivo):
+    """Corre integrity_check sobre un snapshot (.db o .db.gz)."""
+    ok, mensajes = verificar_integridad(archivo)
+    click.echo('\n'.join(mensajes))
+    if not ok:
+        raise SystemExit(1)
+
+
+def init_app_respaldos(app):
+    app.cli.add_command(respaldo_cli)
+    config = app.config
+    gestor = app.extensions['respaldos'] = GestorRespaldos(
+        bases_a_respaldar(app),
+        config['RESPALDOS_DIRECTORIO'],
+        conservar=config['RESPALDOS_CONSERVAR'],
+        comprimir=config['RESPALDOS_COMPRIMIR'],
+        paginas=config['RESPALDOS_PAGINAS_POR_PASO'],
+        pausa=config['RESPALDOS_PAUSA'],
+        metricas=app.extensions.get('metricas'),
+    )
+    intervalo = config['RESPALDOS_INTERVALO']
+    if intervalo > 0 and not config.get('TESTING'):
+        #se arranca con la primera peticion de cada proceso: con preload_app el master de gunicorn
+        #no atiende peticiones, asi los snapshots (y sus metricas) quedan en los workers
+        app.before_request(lambda: gestor.iniciar_programador(intervalo))
@@ -0,0 +1,131 @@
+#resumenes.py
+#resumen agregado del inventario por usuario: lectura O(1), verificacion y recalculo
+import logging
+import math
+import click
+from flask.cli import with_appcontext
+from shards import bases_productos
+
+logging.basicConfig(level=logging.INFO)
+
+CAMPOS_RESUMEN = ('productos', 'unidades', 'valor', 'stock_bajo')
+
+#mismo calculo que hacen los triggers, pero sobre toda la tabla
+SQL_RECALCULO = """
+    SELECT usuario_id, COUNT(*), SUM(cantidad), SUM(cantidad * precio),
+           SUM(cantidad <= (SELECT umbral_stock_bajo FROM inventario_resumen_config WHERE id = 1))
+    FROM productos GROUP BY usuario_id
+"""
+
+
+def umbral_stock_bajo(db):
+    return db.execute("SELECT umbral_stock_bajo FROM inventario_resumen_config WHERE id = 1").fetchone()[0]
+
+
+def leer_resumen(db, user_id):
+    fila = db.execute(
+        "SELECT productos, unidades, valor, stock_bajo FROM inventario_resumen WHERE usuario_id = ?", (user_id,)
+    ).fetchone()
+    resumen = dict(zip(CAMPOS_RESUMEN, fila)) if fila else dict.fromkeys(CAMPOS_RESUMEN, 0)
+    #la suma incremental de REAL acumula error de redondeo: se presenta en centavos
+    resumen['valor'] = round(resumen['valor'], 2)
+    return resumen
+
+
+def verificar_resumenes(db):
+    """Compara el resumen mantenido por triggers con un recalculo completo. Devuelve las diferencias.
+
+    Las dos lecturas van en una misma transaccion de lectura (una sola instantanea
+    del WAL): una escritura confirmada entre ambas no aparece como diferencia.
+    """
+    propia = not db.in_transaction
+    if propia:
+        db.execute("BEGIN")
+    try:
+        guardados = {
+            fila[0]: tuple(fila[1:])
+            for fila in db.execute("SELECT usuario_id, productos, unidades, valor, stock_bajo FROM inventario_resumen")
+        }
+        calculados = {fila[0]: tuple(fila[1:]) for fila in db.execute(SQL_RECALCULO)}
+    finally:
+        if propia:
+            db.rollback()
+    diferencias = []
+    for user_id in sorted(guardados.keys() | calculados.keys()):
+        guardado = guardados.get(user_id, (0, 0, 0.0, 0))
+        calculado = calculados.get(user_id, (0, 0, 0.0, 0))
+        iguales = all(
+            math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6) if campo == 'valor' else a == b
+            for campo, a, b in zip(CAMPOS_RESUMEN, guardado, calculado)
+        )
+        if not iguales:
+            diferencias.append({
+                "usuario_id": user_id,
+                "guardado": dict(zip(CAMPOS_RESUMEN, guardado)),
+                "calculado": dict(zip(CAMPOS_RESUMEN, calculado)),
+            })
+    return diferencias
+
+
+def recalcular_resumenes(db, umbral=None):
+    """Reconstruye inventario_resumen desde productos (y cambia el umbral de stock bajo si se indica)."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if umbral is not None:
+            db.execute("UPDATE inventario_resumen_config SET umbral_stock_bajo = ? WHERE id = 1", (umbral,))
+        db.execute("DELETE FROM inventario_resumen")
+        db.execute(
+            "INSERT INTO inventario_resumen (usuario_id, productos, unidades, valor, stock_bajo) " + SQL_RECALCULO
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logging.info("Resumen del inventario recalculado")
+
+
+@click.group('resumen')
+def resumen_cli():
+    """Resumen agregado del inventario por usuario."""
+
+
+@resumen_cli.command('verificar')
+@click.option('--corregir', is_flag=True, help='Recalcular si hay diferencias.')
+@with_appcontext
+def verificar(corregir):
+    """Detecta diferencias entre el resumen y los productos."""
+    hay_diferencias = False
+    for pool in bases_productos():
+        db = pool.obtener()
+        try:
+            diferencias = verificar_resumenes(db)
+            for diferencia in diferencias:
+                click.echo(f"usuario {diferencia['usuario_id']}: guardado {diferencia['guardado']} != calculado {diferencia['calculado']}")
+            if diferencias and corregir:
+                recalcular_resumenes(db)
+                click.echo(f"Resumen recalculado en {pool.database}")
+            hay_diferencias = hay_diferencias or bool(diferencias)
+        finally:
+            pool.liberar(db)
+    if not hay_diferencias:
+        click.echo("El resumen coincide con los productos")
+    elif not corregir:
+        raise SystemExit(1)
+
+
+@resumen_cli.command('recalcular')
+@click.option('--umbral', type=int, default=None, help='Nuevo umbral de stock bajo (cantidad <= umbral).')
+@with_appcontext
+def recalcular(umbral):
+    """Reconstruye el resumen completo."""
+    for pool in bases_productos():
+        db = pool.obtener()
+        try:
+            recalcular_resumenes(db, umbral)
+        finally:
+            pool.liberar(db)
+    click.echo("Resumen recalculado")
+
+
+def init_app_resumenes(app):
+    app.cli.add_command(resumen_cli)
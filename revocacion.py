@@ -0,0 +1,81 @@
+#revocacion.py
+#lista de tokens JWT revocados: dict en memoria respaldado por SQLite
+import heapq
+import threading
+import time
+from flask import current_app
+from db_utils import get_db_connection
+
+
+class ListaRevocacion:
+    """Consulta O(1) de jti revocados.
+
+    Las revocaciones se escriben en ``tokens_revocados`` y se mantienen en un dict
+    en memoria. Cada ``intervalo_sync`` segundos se leen las filas nuevas (por ``seq``,
+    AUTOINCREMENT: el rowid implicito se reutilizaria al podar las filas vencidas),
+    asi un token revocado en otro proceso tambien se rechaza aqui. Las entradas
+    expiradas se podan de memoria y de la tabla: un token vencido ya lo rechaza JWT.
+    """
+
+    def __init__(self, intervalo_sync=5.0):
+        self.intervalo_sync = intervalo_sync
+        self._revocados = {}
+        self._expiraciones = []
+        self._ultima_seq = 0
+        self._proxima_sync = 0.0
+        self._lock = threading.Lock()
+
+    def _agregar(self, jti, expira):
+        if jti not in self._revocados:
+            self._revocados[jti] = expira
+            heapq.heappush(self._expiraciones, (expira, jti))
+
+    def _podar(self, ahora):
+        while self._expiraciones and self._expiraciones[0][0] < ahora:
+            _, jti = heapq.heappop(self._expiraciones)
+            self._revocados.pop(jti, None)
+
+    def _sincronizar(self, db):
+        ahora = time.time()
+        filas = db.execute(
+            "SELECT seq, jti, expira FROM tokens_revocados WHERE seq > ? AND expira >= ? ORDER BY seq",
+            (self._ultima_seq, int(ahora))
+        ).fetchall()
+        with self._lock:
+            for seq, jti, expira in filas:
+                self._agregar(jti, expira)
+                self._ultima_seq = max(self._ultima_seq, seq)
+            self._podar(ahora)
+
+    def revocar(self, jti, expira):
+        db = get_db_connection()
+        db.execute(
+            "INSERT OR IGNORE INTO tokens_revocados (jti, expira) VALUES (?, ?)", (jti, int(expira))
+        )
+        #las filas vencidas ya no hacen falta; el indice por expira hace barato el borrado
+        db.execute("DELETE FROM tokens_revocados WHERE expira < ?", (int(time.time()),))
+        db.commit()
+        with self._lock:
+            self._agregar(jti, expira)
+
+    def esta_revocado(self, jti):
+        ahora = time.monotonic()
+        if ahora >= self._proxima_sync:
+            self._proxima_sync = ahora + self.intervalo_sync
+            self._sincronizar(get_db_connection())
+        return jti in self._revocados
+
+    def __len__(self):
+        return len(self._revocados)
+
+
+def init_app_revocacion(app, jwt):
+    lista = app.extensions['lista_revocacion'] = ListaRevocacion(app.config['REVOCACION_INTERVALO_SYNC'])
+
+    @jwt.token_in_blocklist_loader
+    def token_revocado(jwt_header, jwt_payload):
+        return lista.esta_revocado(jwt_payload['jti'])
+
+
+def get_lista_revocacion():
+    return current_app.extensions['lista_revocacion']
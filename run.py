@@ -1,6 +1,8 @@
+#servidor de desarrollo; en produccion: gunicorn -c gunicorn.conf.py wsgi:app
+import os
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
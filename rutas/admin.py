@@ -0,0 +1,94 @@
+#rutas/admin.py
+#endpoints de diagnostico reservados a los usuarios de ADMIN_USUARIOS
+import functools
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from consultas_lentas import get_consultas_lentas
+from shards import bases_productos
+from resumenes import umbral_stock_bajo, verificar_resumenes
+from respaldos import RespaldoEnCurso, get_respaldos, listar_snapshots
+
+#creacion de blueprint
+admin_bp = Blueprint('admin', __name__)
+
+
+def admin_requerido(fn):
+    @functools.wraps(fn)
+    @jwt_required()
+    def decorated_view(*args, **kwargs):
+        if get_jwt_identity() not in current_app.config['ADMIN_USUARIOS']:
+            return jsonify({"msg": "Se requieren permisos de administrador"}), 403
+        return fn(*args, **kwargs)
+    return decorated_view
+
+
+@admin_bp.route('/consultas-lentas', methods=['GET', 'DELETE'])
+@admin_requerido
+def consultas_lentas():
+    registro = get_consultas_lentas()
+    if request.method == 'DELETE':
+        registro.limpiar()
+        return '', 204
+
+    try:
+        limite = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"mensaje": "limit debe ser un entero"}), 400
+    return jsonify({"umbral_segundos": registro.umbral, "consultas": registro.top(limite)}), 200
+
+
+@admin_bp.route('/resumen', methods=['GET'])
+@admin_requerido
+def resumen_global():
+    """Totales de todos los usuarios; con ?verificar=1 compara contra un recalculo completo."""
+    verificar = request.args.get('verificar', '').lower() in ('1', 'true', 'si')
+    totales = [0, 0, 0, 0.0, 0]
+    diferencias = []
+    #con sharding se suman los resumenes de cada shard (un usuario vive en uno solo)
+    for pool in bases_productos():
+        db = pool.obtener()
+        try:
+            fila = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(productos), 0), COALESCE(SUM(unidades), 0),"
+                " COALESCE(SUM(valor), 0.0), COALESCE(SUM(stock_bajo), 0) FROM inventario_resumen"
+            ).fetchone()
+            totales = [total + valor for total, valor in zip(totales, fila)]
+            umbral = umbral_stock_bajo(db)
+            if verificar:
+                diferencias.extend(verificar_resumenes(db))
+        finally:
+            pool.liberar(db)
+    resumen = {
+        "usuarios": totales[0],
+        "productos": totales[1],
+        "unidades": totales[2],
+        "valor": round(totales[3], 2),
+        "stock_bajo": totales[4],
+        "umbral_stock_bajo": umbral,
+    }
+    if verificar:
+        resumen["diferencias"] = diferencias
+    return jsonify(resumen), 200
+
+
+@admin_bp.route('/respaldos', methods=['GET', 'POST'])
+@admin_requerido
+def respaldos():
+    """GET: estado y snapshots. POST: inicia un snapshot (202); con ?esperar=1 espera el resultado (201)."""
+    gestor = get_respaldos()
+    if request.method == 'GET':
+        return jsonify({
+            "en_curso": gestor.en_curso(),
+            "ultimo": gestor.ultimo,
+            "snapshots": listar_snapshots(gestor.directorio),
+        }), 200
+
+    try:
+        if request.args.get('esperar', '').lower() in ('1', 'true', 'si'):
+            resultados = gestor.ejecutar()
+            fallidos = [r for r in resultados if "error" in r]
+            return jsonify({"resultados": resultados}), 500 if fallidos else 201
+        gestor.ejecutar_en_segundo_plano()
+    except RespaldoEnCurso as e:
+        return jsonify({"mensaje": str(e)}), 409
+    return jsonify({"mensaje": "Snapshot iniciado"}), 202
@@ -1,17 +1,42 @@
 #rutas/auth.py
 import functools
+import math
 import sqlite3
 import logging
-from flask import Blueprint, request, jsonify, g, session
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, jsonify, g, session, current_app
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt
 from db_utils import get_db_connection
+from hashing import get_pool_hash, HashSaturado
+from revocacion import get_lista_revocacion
 
 logging.basicConfig(level=logging.INFO)
 #creacion de blueprint
 auth_bp = Blueprint('auth', __name__)
 
 
+def _limitar(consultar=(), **claves):
+    """Respuesta 429 si alguna clave (ip=..., usuario=...) agoto su bucket, o None.
+
+    Las claves cuyo tipo esta en ``consultar`` se revisan sin consumir un token.
+    """
+    limitadores = current_app.extensions['limitadores_auth']
+    espera = max(
+        limitadores[tipo].consultar(clave) if tipo in consultar else limitadores[tipo].permitir(clave)
+        for tipo, clave in claves.items()
+    )
+    if espera:
+        response = jsonify({"msg": "Demasiados intentos, intente mas tarde"})
+        response.headers['Retry-After'] = str(math.ceil(espera))
+        return response, 429
+    return None
+
+
+def _saturado():
+    response = jsonify({"msg": "Servicio de autenticacion saturado, intente mas tarde"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -20,8 +45,16 @@ def register():
 
     if not username or not password:
         return jsonify({"mensaje": "Nombre de usuario y contraseña son requeridos"}), 400
-    #genera el hash de la contraseña
-    password_hash = generate_password_hash(password)
+
+    limitado = _limitar(ip=request.remote_addr)
+    if limitado:
+        return limitado
+
+    #genera el hash de la contraseña (en el pool de hashing)
+    try:
+        password_hash = get_pool_hash().generar(password)
+    except HashSaturado:
+        return _saturado()
 
     db = get_db_connection()
 
@@ -51,21 +84,51 @@ def login():
     if not username or not password:
         return jsonify({"msg": "Faltan nombre de usuario o contraseña"}), 400
 
+    #el bucket del usuario solo se descuenta con intentos fallidos: conocer un nombre
+    #de usuario no alcanza para bloquearle el login a su dueño
+    limitado = _limitar(consultar=('usuario',), ip=request.remote_addr, usuario=username)
+    if limitado:
+        return limitado
+
     try:
         user_record = db.execute(
             "SELECT id, username, password_hash FROM usuarios WHERE username = ?", (username,)
         ).fetchone()
 
-        if user_record is None or not check_password_hash(user_record['password_hash'], password):
+        if user_record is None or not get_pool_hash().verificar(user_record['password_hash'], password):
+            current_app.extensions['limitadores_auth']['usuario'].permitir(username)
             return jsonify({"msg": "Credenciales invalidas (usuario no encontrado)"}), 401
         
-        access_token = create_access_token(identity=str(user_record['id']))
-        return jsonify(access_token=access_token), 201
-    
+        identidad = str(user_record['id'])
+        access_token = create_access_token(identity=identidad, fresh=True)
+        refresh_token = create_refresh_token(identity=identidad)
+        return jsonify(access_token=access_token, refresh_token=refresh_token), 201
+
+    except HashSaturado:
+        return _saturado()
     except Exception as e:
         logging.error(f"Error en la ruta de login: {e}")
         return jsonify({"msg": f"Error interno del servidor durante el login"}), 500
 
+@auth_bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    #solo se verifica la firma del refresh token: no hay hash de contraseña
+    access_token = create_access_token(identity=get_jwt_identity(), fresh=False)
+    return jsonify(access_token=access_token), 200
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    #revoca el token presentado (access o refresh) hasta su expiracion
+    token = get_jwt()
+    try:
+        get_lista_revocacion().revocar(token['jti'], token['exp'])
+    except sqlite3.Error as e:
+        logging.error(f"Error al revocar token: {e}")
+        return jsonify({"msg": "Error interno del servidor al cerrar sesion"}), 500
+    return jsonify({"msg": f"Token {token['type']} revocado"}), 200
+
 def token_required():
     def wrapper(fn):
         @functools.wraps(fn)
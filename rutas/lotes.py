@@ -0,0 +1,418 @@
+#rutas/lotes.py
+#operaciones masivas sobre el inventario (exportacion, importacion y lotes de escrituras)
+import codecs
+import csv
+import io
+import json
+import logging
+import sqlite3
+import time
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required
+from shards import MENSAJE_USUARIO_MOVIDO, get_productos_db, ids_nuevos, reclamar_ids, verificar_usuario_movido
+from cache_productos import get_cache
+from json_rapido import get_serializador
+from compresion import comprimir_stream, crear_compresor
+from eventos import notificar_cambios
+from rutas.productos import usuario_id_del_token, validar_producto_nuevo, validar_actualizacion
+
+logging.basicConfig(level=logging.INFO)
+
+#creacion de blueprint (comparte el prefijo /productos)
+lotes_bp = Blueprint('lotes', __name__)
+
+COLUMNAS_EXPORT = ('id', 'nombre', 'cantidad', 'precio')
+
+
+def _ndjson(filas):
+    return get_serializador(COLUMNAS_EXPORT).ndjson(filas)
+
+
+def _csv(filas):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(filas)
+    return buffer.getvalue().encode()
+
+
+FORMATOS_EXPORT = {
+    'ndjson': ('application/x-ndjson', _ndjson),
+    'csv': ('text/csv', _csv),
+}
+
+
+@lotes_bp.route('/export', methods=['GET'])
+@jwt_required()
+def exportar():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"msg": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    formato = request.args.get('format', 'ndjson')
+    if formato not in FORMATOS_EXPORT:
+        return jsonify({"mensaje": f"Formato no soportado. Use uno de: {', '.join(FORMATOS_EXPORT)}"}), 400
+    mimetype, serializar = FORMATOS_EXPORT[formato]
+    comprimir = request.args.get('gzip', '').lower() in ('1', 'true', 'si')
+    tamano_lote = current_app.config['EXPORT_TAMANO_LOTE']
+
+    db = get_productos_db(user_id_int)
+    cursor = db.execute(
+        "SELECT id, nombre, cantidad, precio FROM productos WHERE usuario_id = ? ORDER BY id",
+        (user_id_int,)
+    )
+    #filas como tuplas: no hace falta construir sqlite3.Row para serializar
+    cursor.row_factory = None
+
+    def generar():
+        inicio = time.perf_counter()
+        filas = 0
+        try:
+            if formato == 'csv':
+                yield (','.join(COLUMNAS_EXPORT) + '\n').encode()
+            while True:
+                bloque = cursor.fetchmany(tamano_lote)
+                if not bloque:
+                    break
+                filas += len(bloque)
+                yield serializar(bloque)
+        finally:
+            cursor.close()
+            duracion = time.perf_counter() - inicio
+            logging.info(
+                f"Exportacion {formato} usuario {user_id_int}: {filas} filas en {duracion:.2f}s "
+                f"({filas / duracion if duracion else 0:.0f} filas/s)"
+            )
+
+    cuerpo = generar()
+    headers = {'Content-Disposition': f'attachment; filename="inventario.{formato}"'}
+    if comprimir:
+        #gzip explicito aunque el cliente no envie Accept-Encoding (descarga de archivos)
+        cuerpo = comprimir_stream(cuerpo, crear_compresor('gzip', current_app.config))
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(cuerpo), mimetype=mimetype, headers=headers)
+
+
+def _duenos(db, ids):
+    """{id: usuario_id} de los ids que existen en la base, de cualquier usuario (consultas IN por tramos)."""
+    ids = list(ids)
+    encontrados = {}
+    for i in range(0, len(ids), 500):
+        tramo = ids[i:i + 500]
+        marcadores = ', '.join('?' * len(tramo))
+        encontrados.update(
+            db.execute(f"SELECT id, usuario_id FROM productos WHERE id IN ({marcadores})", tramo).fetchall()
+        )
+    return encontrados
+
+
+@lotes_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"msg": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    data = request.get_json(silent=True) or {}
+    operaciones = data.get('operaciones')
+    if not isinstance(operaciones, list) or not operaciones:
+        return jsonify({"mensaje": "Se requiere una lista 'operaciones' no vacia"}), 400
+    maximo = current_app.config['BULK_MAX_OPERACIONES']
+    if len(operaciones) > maximo:
+        return jsonify({"mensaje": f"Maximo {maximo} operaciones por lote"}), 413
+
+    resultados = [None] * len(operaciones)
+    inserciones = []        #(indice, (nombre, cantidad, precio))
+    actualizaciones = []    #(indice, id, (nombre, cantidad, precio))
+    altas_con_id = {}       #id -> (valores, error) si el upsert con id no encuentra el producto
+    eliminaciones = []      #(indice, id)
+    ids_vistos = set()
+
+    for indice, operacion in enumerate(operaciones):
+        if not isinstance(operacion, dict):
+            resultados[indice] = {"indice": indice, "status": 400, "mensaje": "La operacion debe ser un objeto"}
+            continue
+        op = operacion.get('op')
+        producto_id = operacion.get('id')
+
+        if producto_id is not None:
+            if not isinstance(producto_id, int):
+                resultados[indice] = {"indice": indice, "status": 400, "mensaje": "id debe ser un entero"}
+                continue
+            #un id repetido dependeria del orden de aplicacion dentro del lote
+            if producto_id in ids_vistos:
+                resultados[indice] = {"indice": indice, "status": 409, "mensaje": "id repetido en el lote"}
+                continue
+            ids_vistos.add(producto_id)
+
+        if op == 'upsert' and producto_id is None:
+            valores, error = validar_producto_nuevo(operacion)
+            if error:
+                resultados[indice] = {"indice": indice, "status": 400, "mensaje": error}
+            else:
+                inserciones.append((indice, valores))
+        elif op == 'upsert':
+            campos = {k: v for k, v in operacion.items() if k not in ('op', 'id')}
+            valores, error = validar_actualizacion(campos)
+            if error:
+                resultados[indice] = {"indice": indice, "status": 400, "mensaje": error}
+            else:
+                actualizaciones.append((indice, producto_id, valores))
+                altas_con_id[producto_id] = validar_producto_nuevo(operacion)
+        elif op == 'delete':
+            if producto_id is None:
+                resultados[indice] = {"indice": indice, "status": 400, "mensaje": "delete requiere id"}
+            else:
+                eliminaciones.append((indice, producto_id))
+        else:
+            resultados[indice] = {"indice": indice, "status": 400, "mensaje": "op debe ser 'upsert' o 'delete'"}
+
+    db = get_productos_db(user_id_int)
+    try:
+        #con sharding los ids se reservan antes de tomar el lock del shard
+        ids = ids_nuevos(user_id_int, len(inserciones)) if inserciones else []
+        reclamables = reclamar_ids(id_ for id_, (_, error) in altas_con_id.items() if error is None)
+        #BEGIN IMMEDIATE toma el lock de escritura desde el inicio: todo el lote es un commit
+        db.execute("BEGIN IMMEDIATE")
+
+        duenos = _duenos(db, ids_vistos)
+        #un upsert con un id que no existe (de nadie) crea el producto con ese id
+        altas = []          #(indice, id, (nombre, cantidad, precio))
+        for item in [item for item in actualizaciones if item[1] not in duenos]:
+            indice, producto_id, _ = item
+            nuevos, error = altas_con_id[producto_id]
+            if error:
+                actualizaciones.remove(item)
+                resultados[indice] = {"indice": indice, "status": 400, "mensaje": error}
+            elif producto_id in reclamables:
+                actualizaciones.remove(item)
+                altas.append((indice, producto_id, nuevos))
+        for pendientes in (actualizaciones, eliminaciones):
+            for item in [item for item in pendientes if duenos.get(item[1]) != user_id_int]:
+                pendientes.remove(item)
+                resultados[item[0]] = {"indice": item[0], "status": 404, "mensaje": "producto no encontrado o no autorizado"}
+
+        if inserciones:
+            db.executemany(
+                "INSERT INTO productos (id, nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, ?, ?)",
+                [(producto_id, *valores, user_id_int) for producto_id, (_, valores) in zip(ids, inserciones)]
+            )
+            if ids[0] is None:
+                #con el lock de escritura tomado y AUTOINCREMENT, los ids del lote son consecutivos
+                ultimo = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+                ids = range(ultimo - len(inserciones) + 1, ultimo + 1)
+            for producto_id, (indice, _) in zip(ids, inserciones):
+                resultados[indice] = {"indice": indice, "status": 201, "id": producto_id}
+
+        if altas:
+            #despues de las altas sin id: last_insert_rowid ya se leyo
+            db.executemany(
+                "INSERT INTO productos (id, nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, ?, ?)",
+                [(producto_id, *valores, user_id_int) for _, producto_id, valores in altas]
+            )
+            for indice, producto_id, _ in altas:
+                resultados[indice] = {"indice": indice, "status": 201, "id": producto_id}
+
+        if actualizaciones:
+            db.executemany(
+                "UPDATE productos SET nombre = COALESCE(?, nombre), cantidad = COALESCE(?, cantidad),"
+                " precio = COALESCE(?, precio) WHERE id = ? AND usuario_id = ?",
+                [(*valores, producto_id, user_id_int) for _, producto_id, valores in actualizaciones]
+            )
+            for indice, producto_id, _ in actualizaciones:
+                resultados[indice] = {"indice": indice, "status": 200, "id": producto_id}
+
+        if eliminaciones:
+            db.executemany(
+                "DELETE FROM productos WHERE id = ? AND usuario_id = ?",
+                [(producto_id, user_id_int) for _, producto_id in eliminaciones]
+            )
+            for indice, producto_id in eliminaciones:
+                resultados[indice] = {"indice": indice, "status": 204, "id": producto_id}
+
+        db.commit()
+        get_cache().invalidar_productos(
+            user_id_int,
+            *(producto_id for _, producto_id, _ in actualizaciones),
+            *(producto_id for _, producto_id in eliminaciones)
+        )
+        notificar_cambios(db, user_id_int)
+    except sqlite3.Error as e:
+        db.rollback()
+        verificar_usuario_movido(e, user_id_int)
+        logging.error(f"Error al aplicar lote de productos: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al aplicar el lote"}), 500
+
+    aplicadas = sum(1 for r in resultados if r["status"] < 300)
+    return jsonify({"aplicadas": aplicadas, "rechazadas": len(resultados) - aplicadas, "resultados": resultados}), 200
+
+
+#se entrega en lugar de una linea que supera IMPORT_MAX_LINEA (ya descartada)
+LINEA_DEMASIADO_LARGA = object()
+MENSAJE_LINEA_LARGA = "Linea demasiado larga"
+
+
+def _lineas(stream, max_linea, tamano_bloque=64 * 1024):
+    """Lee el cuerpo por bloques y entrega lineas de texto sin bufferizar el upload completo.
+
+    Una linea de mas de ``max_linea`` caracteres se descarta a medida que llega y se
+    entrega LINEA_DEMASIADO_LARGA: la memoria queda acotada aunque el cuerpo no
+    tenga saltos de linea.
+    """
+    decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+    pendiente = ''
+    descartando = False
+    while True:
+        bloque = stream.read(tamano_bloque)
+        texto = decodificador.decode(bloque or b'', final=not bloque)
+        if texto:
+            pendiente += texto
+            *completas, pendiente = pendiente.split('\n')
+            for linea in completas:
+                if descartando or len(linea) > max_linea:
+                    descartando = False
+                    yield LINEA_DEMASIADO_LARGA
+                else:
+                    yield linea + '\n'
+            if len(pendiente) > max_linea:
+                pendiente = ''
+                descartando = True
+        if not bloque:
+            break
+    if descartando:
+        yield LINEA_DEMASIADO_LARGA
+    elif pendiente:
+        yield pendiente
+
+
+def _filas_csv(lineas):
+    """(numero_linea, datos | None, error) desde CSV con cabecera nombre,cantidad,precio."""
+    largas = []
+
+    def sin_largas():
+        #el lector CSV solo acepta texto: una linea larga pasa como linea vacia (que saltea)
+        #y su error se informa antes de la fila siguiente
+        for numero, linea in enumerate(lineas, start=1):
+            if linea is LINEA_DEMASIADO_LARGA:
+                largas.append(numero)
+                linea = '\n'
+            yield linea
+
+    lector = csv.DictReader(sin_largas())
+    for datos in lector:
+        linea = lector.line_num
+        while largas and largas[0] < linea:
+            yield largas.pop(0), None, MENSAJE_LINEA_LARGA
+        try:
+            cantidad = datos.get('cantidad')
+            precio = datos.get('precio')
+            datos['cantidad'] = int(cantidad) if cantidad not in (None, '') else None
+            datos['precio'] = float(precio) if precio not in (None, '') else None
+        except ValueError:
+            yield linea, None, "Cantidad debe ser un entero, el precio debe ser un numero"
+            continue
+        yield linea, datos, None
+    for numero in largas:
+        yield numero, None, MENSAJE_LINEA_LARGA
+
+
+def _filas_ndjson(lineas):
+    for linea, texto in enumerate(lineas, start=1):
+        if texto is LINEA_DEMASIADO_LARGA:
+            yield linea, None, MENSAJE_LINEA_LARGA
+            continue
+        if not texto.strip():
+            continue
+        try:
+            datos = json.loads(texto)
+        except ValueError:
+            yield linea, None, "JSON invalido"
+            continue
+        if not isinstance(datos, dict):
+            yield linea, None, "Cada linea debe ser un objeto JSON"
+            continue
+        yield linea, datos, None
+
+
+FORMATOS_IMPORT = {
+    'csv': _filas_csv,
+    'ndjson': _filas_ndjson,
+}
+
+
+@lotes_bp.route('/import', methods=['POST'])
+@jwt_required()
+def importar():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"msg": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    formato = request.args.get('format')
+    if formato is None:
+        formato = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if formato not in FORMATOS_IMPORT:
+        return jsonify({"mensaje": f"Formato no soportado. Use uno de: {', '.join(FORMATOS_IMPORT)}"}), 400
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'si')
+    tamano_chunk = current_app.config['IMPORT_TAMANO_CHUNK']
+    max_errores = current_app.config['IMPORT_MAX_ERRORES']
+    max_linea = current_app.config['IMPORT_MAX_LINEA']
+
+    db = get_productos_db(user_id_int)
+    importadas = 0
+    rechazadas = 0
+    errores = []
+    chunk = []
+
+    def guardar(chunk):
+        #un commit por chunk: acota el tamaño de la transaccion y del WAL
+        if dry_run:
+            return
+        db.executemany(
+            "INSERT INTO productos (id, nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, ?, ?)",
+            [(producto_id, *fila) for producto_id, fila in zip(ids_nuevos(user_id_int, len(chunk)), chunk)]
+        )
+        db.commit()
+        notificar_cambios(db, user_id_int)
+
+    try:
+        for linea, datos, error in FORMATOS_IMPORT[formato](_lineas(request.stream, max_linea)):
+            if error is None:
+                valores, error = validar_producto_nuevo(datos)
+            if error:
+                rechazadas += 1
+                if len(errores) < max_errores:
+                    errores.append({"linea": linea, "mensaje": error})
+                continue
+
+            chunk.append((*valores, user_id_int))
+            if len(chunk) >= tamano_chunk:
+                guardar(chunk)
+                importadas += len(chunk)
+                chunk = []
+
+        if chunk:
+            guardar(chunk)
+            importadas += len(chunk)
+    except (sqlite3.Error, csv.Error, UnicodeDecodeError) as e:
+        db.rollback()
+        if isinstance(e, sqlite3.IntegrityError) and MENSAJE_USUARIO_MOVIDO in str(e):
+            #el usuario se movio de shard durante la importacion: se reintenta el resto con el shard nuevo
+            response = jsonify({
+                "mensaje": "Inventario en mantenimiento; los chunks anteriores ya fueron guardados",
+                "importadas": importadas,
+            })
+            response.headers['Retry-After'] = '2'
+            return response, 503
+        logging.error(f"Error al importar productos: {e}")
+        return jsonify({
+            "mensaje": "La importacion se interrumpio; los chunks anteriores ya fueron guardados",
+            "importadas": importadas,
+        }), 500 if isinstance(e, sqlite3.Error) else 400
+
+    return jsonify({
+        "dry_run": dry_run,
+        #en dry_run indica cuantas filas se hubieran importado
+        "importadas": importadas,
+        "rechazadas": rechazadas,
+        "errores": errores,
+        "errores_truncados": rechazadas > len(errores),
+    }), 200
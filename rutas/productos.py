@@ -1,35 +1,331 @@
+import base64
+import json
+import math
+import re
+import zlib
 import sqlite3
 import logging
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app, url_for, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from db_utils import get_db_connection
+from cache_productos import get_cache
+from json_rapido import get_serializador
+from compresion import variantes_etag
+from escritura_grupal import ejecutar_escritura
+from shards import UsuarioEnMovimiento, comprobar_usuario_movido, get_productos_db, ids_nuevos
+from cambios import horizonte_cambios, leer_cambios
+from eventos import get_hub, notificar_cambios
+from puente_asgi import CLAVE_STREAM_ASYNC
+from resumenes import leer_resumen, umbral_stock_bajo
 
 
 logging.basicConfig(level=logging.INFO)
 
 #creacion de blueprint
 productos_bp = Blueprint('productos', __name__, url_prefix='/productos')
+
+# --- paginacion por cursor (keyset) del listado ---
+
+#columnas ordenables; cada una tiene un indice (usuario_id, columna) que incluye el id
+COLUMNAS_ORDEN = ('id', 'nombre', 'precio', 'cantidad')
+
+#columnas del listado, en el orden del SELECT (las filas se leen como tuplas)
+COLUMNAS_LISTADO = ('id', 'nombre', 'cantidad', 'precio')
+
+#parametro -> (columna, operador, conversion)
+FILTROS_RANGO = {
+    'precio_min': ('precio', '>=', float),
+    'precio_max': ('precio', '<=', float),
+    'cantidad_min': ('cantidad', '>=', int),
+    'cantidad_max': ('cantidad', '<=', int),
+}
+
+
+#tipos JSON validos del valor de un cursor segun la columna de orden ('rango' es el bm25 de la busqueda)
+TIPOS_CURSOR = {'id': (int,), 'nombre': (str,), 'precio': (int, float), 'cantidad': (int,), 'rango': (int, float)}
+
+
+class ParametroInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(orden, valor, producto_id):
+    crudo = json.dumps([orden, valor, producto_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, orden):
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        orden_cursor, valor, producto_id = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        raise ParametroInvalido("cursor invalido")
+    if orden_cursor != orden:
+        raise ParametroInvalido("el cursor no corresponde al orden solicitado")
+    #un cursor armado a mano con otro tipo compararia contra la columna con las reglas de SQLite
+    #(texto > numero) y saltaria o repetiria filas en silencio
+    if not (_es_de_tipo(valor, TIPOS_CURSOR[orden.lstrip('-')]) and _es_de_tipo(producto_id, (int,))):
+        raise ParametroInvalido("cursor invalido")
+    return valor, producto_id
+
+
+def _es_de_tipo(valor, tipos):
+    if isinstance(valor, bool) or not isinstance(valor, tipos):
+        return False
+    return not isinstance(valor, float) or math.isfinite(valor)
+
+
+def limite_pagina(args):
+    try:
+        limite = int(args.get('limit', current_app.config['PRODUCTOS_LIMITE_DEFECTO']))
+    except ValueError:
+        raise ParametroInvalido("limit debe ser un entero")
+    if not 1 <= limite <= current_app.config['PRODUCTOS_LIMITE_MAX']:
+        raise ParametroInvalido(f"limit debe estar entre 1 y {current_app.config['PRODUCTOS_LIMITE_MAX']}")
+    return limite
+
+
+def consulta_listado(user_id, args):
+    """Construye el SELECT de una pagina del listado a partir de los query params.
+
+    Devuelve (sql, params, orden, limite). Se pide una fila de mas para saber
+    si existe pagina siguiente sin hacer un COUNT.
+    """
+    orden = args.get('sort', 'id')
+    descendente = orden.startswith('-')
+    columna = orden.lstrip('-')
+    if columna not in COLUMNAS_ORDEN:
+        raise ParametroInvalido(f"sort debe ser uno de {', '.join(COLUMNAS_ORDEN)} (prefijo '-' para descendente)")
+
+    limite = limite_pagina(args)
+
+    condiciones = ["usuario_id = ?"]
+    params = [user_id]
+    for nombre, (col, operador, conversion) in FILTROS_RANGO.items():
+        if nombre in args:
+            try:
+                params.append(conversion(args[nombre]))
+            except ValueError:
+                raise ParametroInvalido(f"{nombre} no es un numero valido")
+            condiciones.append(f"{col} {operador} ?")
+
+    comparador = '<' if descendente else '>'
+    cursor = args.get('cursor')
+    if cursor:
+        valor, producto_id = decodificar_cursor(cursor, orden)
+        if columna == 'id':
+            condiciones.append(f"id {comparador} ?")
+            params.append(producto_id)
+        else:
+            condiciones.append(f"({columna}, id) {comparador} (?, ?)")
+            params.extend([valor, producto_id])
+
+    direccion = 'DESC' if descendente else 'ASC'
+    orden_sql = f"id {direccion}" if columna == 'id' else f"{columna} {direccion}, id {direccion}"
+    sql = (
+        "SELECT id, nombre, cantidad, precio FROM productos"
+        f" WHERE {' AND '.join(condiciones)} ORDER BY {orden_sql} LIMIT ?"
+    )
+    params.append(limite + 1)
+    return sql, params, orden, limite
+
+# --- busqueda de texto completo (FTS5) ---
+
+COLUMNAS_BUSQUEDA = ('id', 'nombre', 'cantidad', 'precio', 'descripcion')
+
+#pesos de bm25 por columna de productos_fts: nombre, descripcion, usuario_id
+PESOS_BUSQUEDA = (10.0, 1.0, 0.0)
+
+MAX_TERMINOS_BUSQUEDA = 8
+
+
+def expresion_busqueda(texto, user_id):
+    """Expresion MATCH: cada palabra como prefijo, todas requeridas, acotada al usuario.
+
+    Las palabras van entre comillas, asi el texto del cliente nunca se interpreta
+    como sintaxis de FTS5 (operadores, columnas, parentesis).
+    """
+    terminos = re.findall(r'\w+', texto)[:MAX_TERMINOS_BUSQUEDA]
+    if not terminos:
+        raise ParametroInvalido("q debe contener al menos una palabra")
+    prefijos = ' '.join(f'"{termino}"*' for termino in terminos)
+    return f'usuario_id : "{user_id}" AND {{nombre descripcion}} : ({prefijos})'
+
+
+def consulta_busqueda(user_id, args):
+    """SELECT de una pagina de resultados ordenados por relevancia (bm25, menor es mejor)."""
+    expresion = expresion_busqueda(args.get('q', ''), user_id)
+    limite = limite_pagina(args)
+    pesos = ', '.join(str(peso) for peso in PESOS_BUSQUEDA)
+    sql = (
+        "SELECT p.id, p.nombre, p.cantidad, p.precio, p.descripcion,"
+        f" bm25(productos_fts, {pesos}) AS rango"
+        " FROM productos_fts JOIN productos p ON p.id = productos_fts.rowid"
+        " WHERE productos_fts MATCH ?"
+    )
+    params = [expresion]
+    cursor = args.get('cursor')
+    if cursor:
+        rango, producto_id = decodificar_cursor(cursor, 'rango')
+        sql = f"SELECT * FROM ({sql}) WHERE (rango, id) > (?, ?)"
+        params.extend([rango, producto_id])
+    sql += " ORDER BY rango, id LIMIT ?"
+    params.append(limite + 1)
+    return sql, params, limite
+
+def usuario_id_del_token():
+    """ID entero del usuario del JWT, o None si el token trae un valor invalido."""
+    try:
+        return int(get_jwt_identity())
+    except (TypeError, ValueError):
+        logging.error("ID de usuario del token no es convertible a entero")
+        return None
+
+# --- version del inventario y ETags ---
+
+def version_inventario(db, user_id):
+    """Contador que los triggers incrementan con cada escritura en productos del usuario."""
+    fila = db.execute(
+        "SELECT version FROM inventario_version WHERE usuario_id = ?", (user_id,)
+    ).fetchone()
+    return fila[0] if fila else 0
+
+
+def etag_inventario(user_id, version, recurso):
+    return f"{user_id}-{version}-{recurso}"
+
+
+def etag_listado(user_id, version):
+    #cada combinacion de query params es una representacion distinta
+    return etag_inventario(user_id, version, f"l{zlib.crc32(request.query_string):x}")
+
+
+def no_modificado(etag):
+    """Respuesta 304 si el cliente ya tiene esta version (comprimida o no), o None."""
+    for variante in variantes_etag(etag):
+        if request.if_none_match.contains(variante):
+            response = current_app.response_class(status=304)
+            response.set_etag(variante)
+            return response
+    return None
+
+# --- validacion compartida por las rutas individuales y masivas ---
+
+def _entero_sqlite(valor):
+    #SQLite enlaza enteros de 64 bits: uno mayor lanza OverflowError al ejecutar
+    return -2**63 <= valor < 2**63
+
+
+def validar_producto_nuevo(data):
+    """Reglas de creacion. Devuelve ((nombre, cantidad, precio), None) o (None, mensaje)."""
+    nombre = data.get('nombre')
+    cantidad = data.get('cantidad')
+    precio = data.get('precio')
+
+    #validacion basico de datos de entrada
+    if not nombre or cantidad is None or precio is None:
+        return None, "Faltan datos requeridos (nombre, cantidad, precio)"
+
+    #validacion de tipo de datos (asegurar que sean los esperados
+    if not isinstance(cantidad, int) or not isinstance(precio, (int, float)):
+        return None, "Cantidad debe ser un entero, el precio debe ser un numero"
+    if not _entero_sqlite(cantidad):
+        return None, "La cantidad esta fuera de rango (entero de 64 bits)"
+    #NaN/Infinity no son JSON validos al devolver el producto (el CSV de importacion los acepta)
+    if not math.isfinite(precio):
+        return None, "El precio debe ser un numero finito"
+    return (nombre, cantidad, precio), None
+
+
+def validar_descripcion(data):
+    """Descripcion opcional (texto libre, indexada por la busqueda). Devuelve (descripcion, None) o (None, mensaje)."""
+    descripcion = data.get('descripcion')
+    if descripcion is not None and not isinstance(descripcion, str):
+        return None, "La descripcion debe ser texto"
+    return descripcion, None
+
+
+def validar_actualizacion(data):
+    """Reglas de actualizacion parcial.
+
+    Devuelve ((nombre, cantidad, precio), None) con None en los campos no enviados,
+    o (None, mensaje) si no hay campos o los tipos no son convertibles.
+    """
+    if not data:
+        return None, "se requiere al menos un campo para actualizar (nombre, cantidad o precio)"
+    nombre = data.get('nombre')
+    cantidad = data.get('cantidad')
+    precio = data.get('precio')
+    #con COALESCE un nombre vacio o que no es texto se guardaria tal cual
+    if nombre is not None and (not isinstance(nombre, str) or not nombre.strip()):
+        return None, "El nombre debe ser un texto no vacio"
+    try:
+        cantidad = int(cantidad) if cantidad is not None else None
+        precio = float(precio) if precio is not None else None
+    except (TypeError, ValueError, OverflowError):
+        return None, "La cantidad debe ser un entero y el precio un numero"
+    if cantidad is not None and not _entero_sqlite(cantidad):
+        return None, "La cantidad esta fuera de rango (entero de 64 bits)"
+    if precio is not None and not math.isfinite(precio):
+        return None, "El precio debe ser un numero finito"
+    return (nombre, cantidad, precio), None
+
 # --- CRUD para productos ---
 
 @productos_bp.route('/', methods=['GET', 'POST'])
 @jwt_required()
 def handle_productos():
-    db = get_db_connection()
     current_user_id = get_jwt_identity()
     try:
         user_id_int = int(current_user_id)
     except (TypeError, ValueError):
         logging.error("ID de usuario del token no es convertible a entero")
         return jsonify({"msg": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+    db = get_productos_db(user_id_int)
     
 
     if request.method == 'GET':
         try:
-            productos = db.execute(
-                "SELECT id, nombre, cantidad, precio FROM productos WHERE usuario_id = ?",
-                (user_id_int,)
-            ).fetchall()
-            return jsonify([dict(producto) for producto in productos]), 200
+            sql, params, orden, limite = consulta_listado(user_id_int, request.args)
+        except ParametroInvalido as e:
+            return jsonify({"mensaje": str(e)}), 400
+
+        try:
+            #la version se lee antes que las filas: si cambia en medio, el ETag queda viejo y
+            #el proximo poll simplemente recibe un 200
+            version = version_inventario(db, user_id_int)
+            etag = etag_listado(user_id_int, version)
+            respuesta_304 = no_modificado(etag)
+            if respuesta_304:
+                return respuesta_304
+
+            cache = get_cache()
+            consulta = request.query_string.decode()
+            pagina = cache.get_listado(user_id_int, version, consulta)
+            if pagina is None:
+                cursor = db.execute(sql, params)
+                #tuplas en lugar de sqlite3.Row: el serializador no necesita dicts por fila
+                cursor.row_factory = None
+                productos = cursor.fetchall()
+                siguiente = None
+                if len(productos) > limite:
+                    productos = productos[:limite]
+                    ultimo = productos[-1]
+                    siguiente = codificar_cursor(orden, ultimo[COLUMNAS_LISTADO.index(orden.lstrip('-'))], ultimo[0])
+                #se cachea el cuerpo ya serializado: un hit no vuelve a codificar JSON
+                cuerpo = get_serializador(COLUMNAS_LISTADO).lista(productos).decode()
+                pagina = {"cuerpo": cuerpo, "siguiente": siguiente}
+                cache.set_listado(user_id_int, version, consulta, pagina)
+
+            response = current_app.response_class(pagina["cuerpo"], mimetype='application/json')
+
+            #la pagina siguiente se anuncia en cabeceras para no cambiar el cuerpo (lista)
+            if pagina["siguiente"]:
+                args = request.args.to_dict()
+                args['cursor'] = pagina["siguiente"]
+                response.headers['X-Next-Cursor'] = pagina["siguiente"]
+                response.headers['Link'] = f'<{url_for("productos.handle_productos", **args)}>; rel="next"'
+            response.set_etag(etag)
+            return response, 200
         except Exception as e:
             logging.error(f"Error al listar productos: {e}")
             return jsonify({"mensaje": "Error interno del servidor al obtener productos"}), 500
@@ -37,25 +333,29 @@ def handle_productos():
     #POST crear un nuevo producto
     elif request.method == 'POST':
         data = request.get_json()
-        nombre = data.get('nombre')
-        cantidad = data.get('cantidad')
-        precio = data.get('precio')
-        
-        #validacion basico de datos de entrada
-        if not nombre or cantidad is None or precio is None:
-            return jsonify({"msg": "Faltan datos requeridos (nombre, cantidad, precio)"}), 400
-        
-        #validacion de tipo de datos (asegurar que sean los esperados
-        if not isinstance(cantidad, int) or not isinstance(precio, (int, float)):
-            return jsonify({"msg": "Cantidad debe ser un entero, el precio debe ser un numero"}), 400
-        
+        valores, error = validar_producto_nuevo(data)
+        if error:
+            return jsonify({"msg": error}), 400
+        nombre, cantidad, precio = valores
+        descripcion, error = validar_descripcion(data)
+        if error:
+            return jsonify({"msg": error}), 400
+
+        def insertar(conn):
+            #id None: lo asigna AUTOINCREMENT (sin sharding)
+            return conn.execute(
+                "INSERT INTO productos (id, nombre, cantidad, precio, usuario_id, descripcion) VALUES (?, ?, ?, ?, ?, ?)",
+                (producto_id, nombre, cantidad, precio, user_id_int, descripcion)
+            ).lastrowid
+
         try:
-            cursor = db.execute(
-                "INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, ?)",
-                (nombre, cantidad, precio, user_id_int)
-            )
-            db.commit()
-            return jsonify({"mensaje": "Producto agregado con exito", "id": cursor.lastrowid}), 201
+            producto_id, = ids_nuevos(user_id_int, 1)
+            nuevo_id = ejecutar_escritura(insertar, user_id_int)
+            notificar_cambios(db, user_id_int)
+            return jsonify({"mensaje": "Producto agregado con exito", "id": nuevo_id}), 201
+        except UsuarioEnMovimiento:
+            #el errorhandler de shards responde 503 con Retry-After
+            raise
         except Exception as e:
             logging.error(f"Error al agregar producto: {e}")
             return jsonify({"mensaje": "Error interno del servidor al crear producto"}), 500
@@ -65,77 +365,355 @@ def handle_productos():
 @productos_bp.route('/<int:producto_id>', methods=['GET', 'PUT', 'DELETE'])
 @jwt_required()
 def handle_producto_id(producto_id):
-    db = get_db_connection()
     current_user_id = get_jwt_identity()
 
     try:
         user_id_int = int(current_user_id)
     except (TypeError, ValueError):
         return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+    db = get_productos_db(user_id_int)
 
     def get_producto(pid):
         return db.execute(
-            "SELECT id, nombre, cantidad, precio, usuario_id FROM productos WHERE id = ? AND usuario_id = ?",
+            "SELECT id, nombre, cantidad, precio, descripcion, usuario_id FROM productos WHERE id = ? AND usuario_id = ?",
             (pid, user_id_int)
         ).fetchone()
-    #comprobar la existencia del producto antes de cualquier operacion
-    producto_existente = get_producto(producto_id)
+    cache = get_cache()
 
     #GET obtener un producto especifico
     if request.method == 'GET':
-        if producto_existente:
+        #si el cliente ya tiene la version actual no se lee el producto
+        version = version_inventario(db, user_id_int)
+        etag = etag_inventario(user_id_int, version, f"p{producto_id}")
+        respuesta_304 = no_modificado(etag)
+        if respuesta_304:
+            return respuesta_304
+
+        prod_dict = cache.get_producto(user_id_int, producto_id, version)
+        if prod_dict is None:
+            producto_existente = get_producto(producto_id)
+            if not producto_existente:
+                return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
             prod_dict = dict(producto_existente)
             del prod_dict['usuario_id']
-            return jsonify(prod_dict), 200
-        return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
-    
-    if not producto_existente:
-        return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
-
+            cache.set_producto(user_id_int, producto_id, version, prod_dict)
 
+        response = jsonify(prod_dict)
+        response.set_etag(etag)
+        return response, 200
 
-    #PUT actualizar un producto existente
+    #PUT actualizar un producto existente (un solo UPDATE ... RETURNING, sin pre-SELECT)
     elif request.method == 'PUT':
         data = request.get_json()
+        valores, error = validar_actualizacion(data)
+        if not error:
+            descripcion, error = validar_descripcion(data)
+        if error:
+            return jsonify({"mensaje": error}), 400
 
-        #valores del json si se proporcionan
-        nombre = data.get('nombre', producto_existente['nombre'])
-        cantidad = data.get('cantidad', producto_existente['cantidad'])
-        precio = data.get('precio', producto_existente['precio'])
+        #la descripcion admite null para borrarla: solo se conserva si el campo no se envio
+        descripcion_enviada = 'descripcion' in data
+
+        def actualizar(conn):
+            #los campos no enviados (None) conservan su valor actual
+            filas = [dict(fila) for fila in conn.execute(
+                "UPDATE productos SET nombre = COALESCE(?, nombre), cantidad = COALESCE(?, cantidad),"
+                " precio = COALESCE(?, precio), descripcion = CASE WHEN ? THEN ? ELSE descripcion END"
+                " WHERE id = ? AND usuario_id = ?"
+                " RETURNING id, nombre, cantidad, precio, descripcion",
+                (*valores, descripcion_enviada, descripcion, producto_id, user_id_int)
+            ).fetchall()]
+            if not filas:
+                comprobar_usuario_movido(conn, user_id_int)
+            return filas
 
-        if not data:
-            return jsonify({"mensaje": "se requiere al menos un campo para actualizar (nombre, cantidad o precio)"}), 400
-        try:
-            cantidad_final = int(cantidad)
-            precio_final = float(precio)
-        except (TypeError, ValueError):
-            return jsonify({"mensaje": "La cantidad debe ser un entero y el precio un numero"}), 400
-        
         try:
-            db.execute(
-                "UPDATE productos SET nombre = ?, cantidad = ?, precio = ? WHERE id = ? AND usuario_id = ?",
-                (nombre, cantidad_final, precio_final, producto_id, user_id_int)
-            )
-            db.commit()
-
-            productio_actualizado = get_producto(producto_id)
-            if productio_actualizado:
-                prod_dict = dict(productio_actualizado)
-                del prod_dict['usuario_id']
-                return jsonify(prod_dict), 200
-            
-            return jsonify({"mensaje": "Producto actualizado con exito"}), 200
+            actualizados = ejecutar_escritura(actualizar, user_id_int)
+        except UsuarioEnMovimiento:
+            raise
         except Exception as e:
             logging.error(f"Error al actualizar producto: {e}")
             return jsonify({"mensaje": "Error interno del servidor al actualizar"}), 500
 
+        if not actualizados:
+            return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
+        cache.invalidar_productos(user_id_int, producto_id)
+        notificar_cambios(db, user_id_int)
+        return jsonify(actualizados[0]), 200
+
 
     #DELETE eliminar un producto
     elif request.method == 'DELETE':
+        def eliminar(conn):
+            filas = conn.execute(
+                "DELETE FROM productos WHERE id = ? AND usuario_id = ? RETURNING id",
+                (producto_id, user_id_int)
+            ).fetchall()
+            if not filas:
+                comprobar_usuario_movido(conn, user_id_int)
+            return filas
+
         try:
-            db.execute("DELETE FROM productos WHERE id = ? AND usuario_id = ?", (producto_id, user_id_int))
-            db.commit()
-            return '', 204
+            eliminados = ejecutar_escritura(eliminar, user_id_int)
+        except UsuarioEnMovimiento:
+            raise
         except Exception as e:
             logging.error(f"Error al eliminar producto: {e}")
             return jsonify({"mensaje": "Error interno del servidor al eliminar"}), 500
+
+        if not eliminados:
+            return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
+        cache.invalidar_productos(user_id_int, producto_id)
+        notificar_cambios(db, user_id_int)
+        return '', 204
+
+
+#ajuste atomico de stock (escaneres de almacen)
+@productos_bp.route('/<int:producto_id>/stock', methods=['PATCH'])
+@jwt_required()
+def ajustar_stock(producto_id):
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    data = request.get_json(silent=True) or {}
+    delta = data.get('delta')
+    permitir_negativo = data.get('permitir_negativo', False)
+    if not isinstance(delta, int) or isinstance(delta, bool):
+        return jsonify({"mensaje": "delta debe ser un entero (positivo o negativo)"}), 400
+    if not _entero_sqlite(delta):
+        return jsonify({"mensaje": "delta fuera de rango (entero de 64 bits)"}), 400
+    #bool("false") es True: solo se acepta un booleano JSON
+    if not isinstance(permitir_negativo, bool):
+        return jsonify({"mensaje": "permitir_negativo debe ser true o false"}), 400
+
+    def ajustar(conn):
+        #la suma se hace en SQLite: no hay lectura-modificacion-escritura entre escaneres
+        filas = [dict(fila) for fila in conn.execute(
+            "UPDATE productos SET cantidad = cantidad + ?"
+            " WHERE id = ? AND usuario_id = ? AND (? OR cantidad + ? >= 0)"
+            " RETURNING id, nombre, cantidad, precio",
+            (delta, producto_id, user_id_int, permitir_negativo, delta)
+        ).fetchall()]
+        if not filas:
+            comprobar_usuario_movido(conn, user_id_int)
+        return filas
+
+    try:
+        actualizados = ejecutar_escritura(ajustar, user_id_int)
+    except UsuarioEnMovimiento:
+        raise
+    except Exception as e:
+        logging.error(f"Error al ajustar stock: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al ajustar stock"}), 500
+
+    if actualizados:
+        get_cache().invalidar_productos(user_id_int, producto_id)
+        notificar_cambios(get_productos_db(user_id_int), user_id_int)
+        return jsonify(actualizados[0]), 200
+
+    #solo en el camino de error se distingue "no existe" de "stock insuficiente"
+    actual = get_productos_db(user_id_int).execute(
+        "SELECT cantidad FROM productos WHERE id = ? AND usuario_id = ?", (producto_id, user_id_int)
+    ).fetchone()
+    if actual is None:
+        return jsonify({"mensaje": "producto no encontrado o no autorizado"}), 404
+    return jsonify({"mensaje": "Stock insuficiente", "cantidad": actual['cantidad']}), 409
+
+
+#feed de cambios: solo lo modificado despues de la version que tiene el cliente
+@productos_bp.route('/changes', methods=['GET'])
+@jwt_required()
+def cambios_productos():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    try:
+        desde = int(request.args.get('since', 0))
+        limite = int(request.args.get('limit', current_app.config['PRODUCTOS_LIMITE_DEFECTO']))
+    except ValueError:
+        return jsonify({"mensaje": "since y limit deben ser enteros"}), 400
+    if desde < 0 or not 1 <= limite <= current_app.config['PRODUCTOS_LIMITE_MAX']:
+        return jsonify({"mensaje": f"since debe ser >= 0 y limit estar entre 1 y {current_app.config['PRODUCTOS_LIMITE_MAX']}"}), 400
+
+    db = get_productos_db(user_id_int)
+    try:
+        #con since=0 el cliente no tiene nada que borrar: los tombstones compactados no le faltan
+        horizonte = horizonte_cambios(db, user_id_int)
+        if 0 < desde < horizonte:
+            return jsonify({
+                "mensaje": "La version es anterior al historial conservado; sincronizar desde since=0",
+                "horizonte": horizonte,
+            }), 410
+
+        cambios = leer_cambios(db, user_id_int, desde, limite + 1)
+    except Exception as e:
+        logging.error(f"Error al leer el feed de cambios: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al obtener cambios"}), 500
+
+    hay_mas = len(cambios) > limite
+    cambios = cambios[:limite]
+    return jsonify({
+        "cambios": cambios,
+        #el cliente guarda esta version y la manda como since en la siguiente llamada
+        "version": cambios[-1]["version"] if cambios else desde,
+        "hay_mas": hay_mas,
+    }), 200
+
+
+#totales del inventario del usuario (los mantienen triggers: la lectura es una fila)
+@productos_bp.route('/resumen', methods=['GET'])
+@jwt_required()
+def resumen_productos():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    db = get_productos_db(user_id_int)
+    try:
+        resumen = leer_resumen(db, user_id_int)
+        resumen["umbral_stock_bajo"] = umbral_stock_bajo(db)
+    except Exception as e:
+        logging.error(f"Error al leer el resumen del inventario: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al obtener el resumen"}), 500
+    return jsonify(resumen), 200
+
+#busqueda por nombre y descripcion, ordenada por relevancia
+@productos_bp.route('/search', methods=['GET'])
+@jwt_required()
+def buscar_productos():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    try:
+        sql, params, limite = consulta_busqueda(user_id_int, request.args)
+    except ParametroInvalido as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    try:
+        cursor = get_productos_db(user_id_int).execute(sql, params)
+        cursor.row_factory = None
+        filas = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        logging.error(f"Error en la busqueda de productos: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al buscar productos"}), 500
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultimo = filas[-1]
+        siguiente = codificar_cursor('rango', ultimo[-1], ultimo[0])
+    #la ultima columna (rango) solo sirve para el cursor
+    response = current_app.response_class(
+        get_serializador(COLUMNAS_BUSQUEDA).lista([fila[:-1] for fila in filas]), mimetype='application/json'
+    )
+    if siguiente:
+        args = request.args.to_dict()
+        args['cursor'] = siguiente
+        response.headers['X-Next-Cursor'] = siguiente
+        response.headers['Link'] = f'<{url_for("productos.buscar_productos", **args)}>; rel="next"'
+    return response, 200
+
+def _evento_sse(cambio):
+    return f"id: {cambio['version']}\nevent: {cambio['operacion']}\ndata: {json.dumps(cambio)}\n\n"
+
+
+#stream SSE de los cambios del usuario; los ids de evento son versiones del feed de cambios
+@productos_bp.route('/events', methods=['GET'])
+@jwt_required()
+def eventos_productos():
+    user_id_int = usuario_id_del_token()
+    if user_id_int is None:
+        return jsonify({"mensaje": "Error de autenticacion. ID de usuario invalido en el token."}), 401
+
+    #EventSource reenvia Last-Event-ID al reconectar; el query param sirve para la primera conexion
+    ultimo = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        ultimo = int(ultimo) if ultimo else None
+    except ValueError:
+        return jsonify({"mensaje": "Last-Event-ID debe ser un entero"}), 400
+    if ultimo is not None and ultimo < 0:
+        return jsonify({"mensaje": "Last-Event-ID no puede ser negativo"}), 400
+    max_reenvio = current_app.config['EVENTOS_MAX_REENVIO']
+
+    db = get_productos_db(user_id_int)
+    hub = get_hub()
+    try:
+        actual = db.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM productos_cambios WHERE usuario_id = ?", (user_id_int,)
+        ).fetchone()[0]
+        if ultimo is None:
+            ultimo = actual
+        elif 0 < ultimo < horizonte_cambios(db, user_id_int):
+            return jsonify({
+                "mensaje": "El ultimo evento es anterior al historial conservado; recargar el inventario",
+            }), 410
+
+        #primero la suscripcion y despues la lectura: lo que se confirme en medio llega por
+        #las dos vias y el generador descarta las versiones ya enviadas
+        suscripcion = hub.suscribir(user_id_int, actual)
+        try:
+            #los pendientes quedan en memoria mientras dure el stream: se acotan con una fila de mas
+            #para detectar que no entran (Last-Event-ID 0 equivale a todo el inventario)
+            pendientes = leer_cambios(db, user_id_int, ultimo, limite=max_reenvio + 1)
+        except Exception:
+            hub.cancelar(suscripcion)
+            raise
+        if len(pendientes) > max_reenvio:
+            hub.cancelar(suscripcion)
+            return jsonify({
+                "mensaje": "Demasiados eventos pendientes; sincronizar con /productos/changes y reconectar",
+                "since": ultimo,
+            }), 410
+    except Exception as e:
+        logging.error(f"Error al abrir el stream de eventos: {e}")
+        return jsonify({"mensaje": "Error interno del servidor al abrir el stream"}), 500
+
+    heartbeat = current_app.config['EVENTOS_HEARTBEAT']
+
+    #sin stream_with_context: la conexion a la base vuelve al pool al terminar la peticion
+    #y un suscriptor inactivo no retiene nada mas que su cola
+    def generar(enviado):
+        try:
+            #un comentario inicial para que el cliente reciba las cabeceras de inmediato
+            yield ": conectado\n\n"
+            for cambio in pendientes:
+                yield _evento_sse(cambio)
+                enviado = cambio["version"]
+            while True:
+                if suscripcion.desalojada:
+                    yield "event: desalojado\ndata: {}\n\n"
+                    return
+                cambio = suscripcion.siguiente(heartbeat)
+                if cambio is None:
+                    yield ": heartbeat\n\n"
+                elif cambio["version"] > enviado:
+                    yield _evento_sse(cambio)
+                    enviado = cambio["version"]
+        finally:
+            hub.cancelar(suscripcion)
+
+    #modo ASGI: despues del primer bloque el puente sigue con esta version async en el bucle
+    #de eventos (un suscriptor inactivo no ocupa hilo); al terminar cierra ``generar``
+    async def generar_async(enviado):
+        for cambio in pendientes:
+            yield _evento_sse(cambio)
+            enviado = cambio["version"]
+        while True:
+            if suscripcion.desalojada:
+                yield "event: desalojado\ndata: {}\n\n"
+                return
+            cambio = await suscripcion.siguiente_async(heartbeat)
+            if cambio is None:
+                if not suscripcion.desalojada:
+                    yield ": heartbeat\n\n"
+            elif cambio["version"] > enviado:
+                yield _evento_sse(cambio)
+                enviado = cambio["version"]
+
+    request.environ[CLAVE_STREAM_ASYNC] = lambda: generar_async(ultimo)
+
+    return Response(generar(ultimo), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
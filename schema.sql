@@ -1,20 +1,98 @@
--- archivo para inicializar la base de datos (SQLite)
+-- archivo de referencia del esquema (SQLite) tal como queda tras `flask db upgrade`
+-- el esquema real lo crean las migraciones de migraciones.py; no ejecutar sobre una base existente
 
 -- tabla para usuarios
 
 CREATE TABLE IF NOT EXISTS usuarios (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
-    password_hash TEXT NO NULL
+    password_hash TEXT NOT NULL
 );
 
---tabla para productos
+--tabla para productos (cada producto pertenece a un usuario)
 CREATE TABLE IF NOT EXISTS productos (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nombre TEXT NOT NULL,
-    descripcion TEXT,
+    cantidad INTEGER NOT NULL,
     precio REAL NOT NULL,
-    stock INTEGER NOT NULL
+    usuario_id INTEGER NOT NULL,
+    descripcion TEXT,
+    FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_productos_usuario_id ON productos (usuario_id, id);
+CREATE INDEX IF NOT EXISTS idx_productos_usuario_nombre ON productos (usuario_id, nombre);
+CREATE INDEX IF NOT EXISTS idx_productos_usuario_precio ON productos (usuario_id, precio);
+CREATE INDEX IF NOT EXISTS idx_productos_usuario_cantidad ON productos (usuario_id, cantidad);
+
+--version del inventario por usuario (la mantienen triggers sobre productos)
+CREATE TABLE IF NOT EXISTS inventario_version (
+    usuario_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+--tokens JWT revocados
+--seq (AUTOINCREMENT, nunca se reutiliza) es el cursor de sincronizacion entre procesos
+CREATE TABLE IF NOT EXISTS tokens_revocados (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT UNIQUE NOT NULL,
+    expira INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tokens_revocados_expira ON tokens_revocados (expira);
+
+--registro de cambios (una fila por producto; los borrados quedan como tombstone)
+CREATE TABLE IF NOT EXISTS productos_cambios (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario_id INTEGER NOT NULL,
+    producto_id INTEGER NOT NULL UNIQUE,
+    operacion TEXT NOT NULL CHECK (operacion IN ('upsert', 'delete')),
+    cambiado_en INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_productos_cambios_usuario ON productos_cambios (usuario_id, version);
+
+CREATE TABLE IF NOT EXISTS productos_cambios_horizonte (
+    usuario_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+--busqueda de texto completo (contenido externo: el texto se lee de productos)
+CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+    nombre, descripcion, usuario_id,
+    content='productos', content_rowid='id',
+    prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+);
+
+--resumen agregado por usuario (lo mantienen triggers sobre productos)
+CREATE TABLE IF NOT EXISTS inventario_resumen (
+    usuario_id INTEGER PRIMARY KEY,
+    productos INTEGER NOT NULL,
+    unidades INTEGER NOT NULL,
+    valor REAL NOT NULL,
+    stock_bajo INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inventario_resumen_config (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    umbral_stock_bajo INTEGER NOT NULL
+);
+
+--sharding (DB_SHARDS): solo en la base principal. Los shards tienen el mismo esquema pero
+--solo usan productos y sus tablas derivadas
+CREATE TABLE IF NOT EXISTS usuarios_shard (
+    usuario_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    moviendo INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS secuencia_productos (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    valor INTEGER NOT NULL
+);
+
+--en cada base: usuarios cuyos productos se movieron a otro shard (triggers BEFORE INSERT/UPDATE
+--sobre productos rechazan sus escrituras tardias)
+CREATE TABLE IF NOT EXISTS usuarios_movidos (
+    usuario_id INTEGER PRIMARY KEY
 );
 
 --inicializar un usuario de prueba (contraseña: mi_clave_secreta)
@@ -25,6 +103,6 @@ INSERT OR IGNORE INTO usuarios (username, password_hash) VALUES (
 );
 
 --datos iniciales de prueba para productos
-INSERT OR IGNORE INTO productos (id, nombre, descripcion, precio, stock) VALUES
-    (1, 'Laptop Gaming X500', 'Potente laptop para juegos con RTX 4080', 1500.00, 5),
-    (2, 'Monitor Curvo 32"', 'Monitor 4K curvo de 144Hz', 450.00, 10);
+INSERT OR IGNORE INTO productos (id, nombre, descripcion, precio, cantidad, usuario_id) VALUES
+    (1, 'Laptop Gaming X500', 'Potente laptop para juegos con RTX 4080', 1500.00, 5, 1),
+    (2, 'Monitor Curvo 32"', 'Monitor 4K curvo de 144Hz', 450.00, 10, 1);
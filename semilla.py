@@ -0,0 +1,201 @@
+#semilla.py
+#generador de datos sinteticos para benchmarks y pruebas de carga (`flask seed`)
+import logging
+import random
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+from db_pool import abrir_conexion
+from db_utils import get_db_connection, get_pool
+from resumenes import SQL_RECALCULO
+
+logging.basicConfig(level=logging.INFO)
+
+#(categoria, precio tipico): el precio de cada producto varia alrededor del tipico
+CATEGORIAS = (
+    ('Laptop', 1100.0), ('Monitor', 280.0), ('Teclado', 55.0), ('Mouse', 25.0), ('Auriculares', 70.0),
+    ('Impresora', 190.0), ('Disco SSD', 95.0), ('Memoria RAM', 60.0), ('Router', 85.0), ('Cable HDMI', 12.0),
+    ('Silla de oficina', 210.0), ('Escritorio', 260.0), ('Webcam', 45.0), ('Parlante', 65.0), ('Tablet', 420.0),
+)
+MARCAS = ('Acme', 'Nortek', 'Zenda', 'Kora', 'Lumen', 'Vektor', 'Orbis', 'Pampa', 'Andina', 'Tecsur')
+ADJETIVOS = ('Pro', 'Max', 'Lite', 'Plus', 'Ultra', 'Mini', 'Air', 'Gamer', 'Office', 'Eco')
+DETALLES = (
+    'con garantia de 12 meses', 'inalambrico', 'compatible con USB-C', 'edicion 2024', 'color negro',
+    'color blanco', 'para uso intensivo', 'bajo consumo', 'reacondicionado', 'con estuche',
+)
+
+
+def nombre_usuario(prefijo, indice):
+    return f"{prefijo}{indice:06d}"
+
+
+def producto_aleatorio(rng):
+    """(nombre, cantidad, precio, descripcion) con distribuciones parecidas a un inventario real."""
+    categoria, precio_tipico = rng.choice(CATEGORIAS)
+    marca = rng.choice(MARCAS)
+    nombre = f"{categoria} {marca} {rng.choice(ADJETIVOS)} {rng.randint(100, 9999)}"
+    #la mayoria con pocas unidades, algunos agotados y pocos con mucho stock
+    cantidad = 0 if rng.random() < 0.05 else int(rng.expovariate(1 / 40))
+    precio = round(precio_tipico * rng.lognormvariate(0, 0.35), 2)
+    descripcion = f"{categoria} {marca} {rng.choice(DETALLES)}, {rng.choice(DETALLES)}"
+    return nombre, cantidad, precio, descripcion
+
+
+def repartir_productos(rng, usuarios, productos):
+    """Productos por usuario con sesgo (pocos usuarios con inventarios grandes), sumando ``productos``."""
+    pesos = [rng.paretovariate(1.2) for _ in range(usuarios)]
+    total = sum(pesos)
+    cantidades = [int(productos * peso / total) for peso in pesos]
+    #el resto del redondeo va a los primeros usuarios
+    for i in range(productos - sum(cantidades)):
+        cantidades[i % usuarios] += 1
+    return cantidades
+
+
+def suspender_triggers(db):
+    """Abre la transaccion de carga y borra los triggers de productos. Devuelve (id previo, triggers)."""
+    db.execute("BEGIN IMMEDIATE")
+    triggers = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'productos'"
+    ).fetchall()
+    for nombre, _ in triggers:
+        db.execute(f"DROP TRIGGER {nombre}")
+    #los ids nuevos (AUTOINCREMENT o secuencia global) siempre son mayores que los existentes
+    desde_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM productos").fetchone()[0]
+    return desde_id, [sql for _, sql in triggers]
+
+
+def reconstruir_derivadas(db, desde_id, triggers):
+    """Hace de una vez, para los productos con id > desde_id, lo que hubieran hecho los triggers."""
+    db.execute(
+        "INSERT INTO productos_fts (rowid, nombre, descripcion, usuario_id)"
+        " SELECT id, nombre, descripcion, usuario_id FROM productos WHERE id > ?", (desde_id,)
+    )
+    db.execute(
+        "INSERT OR REPLACE INTO productos_cambios (usuario_id, producto_id, operacion, cambiado_en)"
+        " SELECT usuario_id, id, 'upsert', CAST(strftime('%s', 'now') AS INTEGER) FROM productos"
+        " WHERE id > ? ORDER BY id", (desde_id,)
+    )
+    db.execute(
+        "INSERT INTO inventario_version (usuario_id, version)"
+        " SELECT usuario_id, COUNT(*) FROM productos WHERE id > ? GROUP BY usuario_id"
+        " ON CONFLICT (usuario_id) DO UPDATE SET version = version + excluded.version", (desde_id,)
+    )
+    db.execute("DELETE FROM inventario_resumen")
+    db.execute("INSERT INTO inventario_resumen (usuario_id, productos, unidades, valor, stock_bajo) " + SQL_RECALCULO)
+    for sql in triggers:
+        db.execute(sql)
+
+
+def sembrar(usuarios, productos, semilla=0, lote=10000, prefijo='carga', password='carga123', rapido=False):
+    """Crea ``usuarios`` usuarios y reparte entre ellos ``productos`` productos. Devuelve un resumen.
+
+    Todos los usuarios comparten la contraseña (se hashea una sola vez). Los
+    productos se insertan con una conexion propia con synchronous=NORMAL, en
+    transacciones de ``lote`` filas; los triggers mantienen feed, FTS y resumen.
+    Con ``rapido`` todo va en una sola transaccion por base, con los triggers de
+    productos suspendidos y las tablas derivadas reconstruidas al final (unas 3
+    veces mas rapido, pero bloquea las escrituras de la app mientras dura).
+    Con sharding cada usuario va a su shard y los ids salen de la secuencia global.
+    Repetirlo con el mismo prefijo reutiliza los usuarios y agrega productos.
+    """
+    rng = random.Random(semilla)
+    inicio = time.perf_counter()
+    principal = get_db_connection()
+    password_hash = generate_password_hash(password)
+    nombres = [nombre_usuario(prefijo, i) for i in range(1, usuarios + 1)]
+    principal.executemany(
+        "INSERT OR IGNORE INTO usuarios (username, password_hash) VALUES (?, ?)",
+        [(nombre, password_hash) for nombre in nombres]
+    )
+    principal.commit()
+    buscados = set(nombres)
+    ids_usuarios = {
+        fila[0]: fila[1] for fila in principal.execute(
+            "SELECT username, id FROM usuarios WHERE username LIKE ?", (f"{prefijo}%",)
+        ) if fila[0] in buscados
+    }
+
+    router = current_app.extensions.get('shards')
+    pools = router.pools if router is not None else [get_pool()]
+    #synchronous=NORMAL (aunque la app use FULL): con WAL solo sincroniza en los checkpoints y un corte
+    #de luz pierde los ultimos lotes pero no corrompe la base. OFF ahorraba ~7% y podia corromper el
+    #archivo que la app esta sirviendo
+    conexiones = [abrir_conexion(pool.database, [*pool.pragmas, "synchronous = NORMAL"]) for pool in pools]
+    pendientes = [[] for _ in conexiones]
+    suspendidos = [suspender_triggers(db) for db in conexiones] if rapido else None
+
+    def volcar(indice):
+        filas = pendientes[indice]
+        if not filas:
+            return
+        ids = router.ids.reservar(principal, len(filas)) if router is not None else [None] * len(filas)
+        db = conexiones[indice]
+        if not rapido:
+            db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO productos (id, nombre, cantidad, precio, descripcion, usuario_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [(producto_id, *fila) for producto_id, fila in zip(ids, filas)]
+        )
+        if not rapido:
+            db.commit()
+        filas.clear()
+
+    insertados = 0
+    try:
+        for nombre, cantidad in zip(nombres, repartir_productos(rng, usuarios, productos)):
+            user_id = ids_usuarios[nombre]
+            indice = router.indice_de(principal, user_id) if router is not None else 0
+            for _ in range(cantidad):
+                pendientes[indice].append((*producto_aleatorio(rng), user_id))
+                if len(pendientes[indice]) >= lote:
+                    insertados += len(pendientes[indice])
+                    volcar(indice)
+                    logging.info(f"Semilla: {insertados}/{productos} productos")
+        for indice in range(len(conexiones)):
+            insertados += len(pendientes[indice])
+            volcar(indice)
+        if rapido:
+            for db, (desde_id, triggers) in zip(conexiones, suspendidos):
+                reconstruir_derivadas(db, desde_id, triggers)
+                db.commit()
+    finally:
+        for db in conexiones:
+            if db.in_transaction:
+                #el ROLLBACK tambien restaura los triggers borrados
+                db.rollback()
+            db.close()
+
+    duracion = time.perf_counter() - inicio
+    return {
+        "usuarios": len(ids_usuarios),
+        "productos": insertados,
+        "segundos": round(duracion, 2),
+        "productos_por_segundo": round(insertados / duracion) if duracion else 0,
+    }
+
+
+@click.command('seed')
+@click.option('--usuarios', type=int, default=100, show_default=True)
+@click.option('--productos', type=int, default=100000, show_default=True, help='Total, repartido con sesgo entre los usuarios.')
+@click.option('--semilla', type=int, default=0, show_default=True, help='Semilla del generador (datos reproducibles).')
+@click.option('--lote', type=int, default=10000, show_default=True, help='Filas por transaccion.')
+@click.option('--prefijo', default='carga', show_default=True, help='Los usuarios se llaman <prefijo>000001, ...')
+@click.option('--password', default='carga123', show_default=True, help='Contraseña de todos los usuarios generados.')
+@click.option('--rapido', is_flag=True, help='Una transaccion sin triggers; bloquea las escrituras de la app.')
+@with_appcontext
+def seed(usuarios, productos, semilla, lote, prefijo, password, rapido):
+    """Genera usuarios y productos sinteticos para benchmarks."""
+    if usuarios < 1 or productos < 0 or lote < 1:
+        raise click.BadParameter("usuarios y lote deben ser >= 1 y productos >= 0")
+    resultado = sembrar(usuarios, productos, semilla, lote, prefijo, password, rapido)
+    click.echo(
+        f"{resultado['usuarios']} usuarios y {resultado['productos']} productos en {resultado['segundos']}s"
+        f" ({resultado['productos_por_segundo']} productos/s)"
+    )
+
+
+def init_app_semilla(app):
+    app.cli.add_command(seed)
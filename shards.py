@@ -0,0 +1,457 @@
+#shards.py
+#reparto de los productos de cada usuario entre varios archivos SQLite (shards)
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import click
+from flask import current_app, g, jsonify
+from flask.cli import with_appcontext
+from db_pool import crear_pool
+from db_utils import get_db_connection, get_pool
+from metricas import ConexionInstrumentada
+from migraciones import aplicar_migraciones
+
+logging.basicConfig(level=logging.INFO)
+
+#tablas derivadas de productos con filas por usuario (las mantienen triggers)
+TABLAS_DEL_USUARIO = ('inventario_version', 'inventario_resumen', 'productos_cambios', 'productos_cambios_horizonte')
+
+
+#mensaje del RAISE de los triggers que rechazan escrituras de usuarios movidos (migracion 11)
+MENSAJE_USUARIO_MOVIDO = 'usuario movido a otro shard'
+
+
+class UsuarioEnMovimiento(Exception):
+    """Los productos del usuario se estan migrando de shard; reintentar en unos segundos."""
+
+
+def verificar_usuario_movido(error, user_id):
+    """Convierte el rechazo de los triggers de ``usuarios_movidos`` en UsuarioEnMovimiento (503).
+
+    Lo recibe una peticion que resolvio el shard antes de que el usuario se moviera:
+    su escritura no se aplico y al reintentar ira al shard nuevo.
+    """
+    if isinstance(error, sqlite3.IntegrityError) and MENSAJE_USUARIO_MOVIDO in str(error):
+        raise UsuarioEnMovimiento(f"Usuario {user_id} movido de shard durante la peticion") from error
+
+
+def comprobar_usuario_movido(conn, user_id):
+    """Lanza UsuarioEnMovimiento si los productos del usuario ya no viven en la base de ``conn``.
+
+    Los triggers solo cubren INSERT y UPDATE de filas que existen: un UPDATE o DELETE
+    tardio en el origen no encuentra filas (el movimiento las borro) y sin esta
+    comprobacion responderia 404. Se llama dentro de la misma transaccion de la escritura.
+    """
+    if conn.execute("SELECT 1 FROM usuarios_movidos WHERE usuario_id = ?", (user_id,)).fetchone():
+        raise UsuarioEnMovimiento(f"Usuario {user_id} movido de shard durante la peticion")
+
+
+class AsignadorIds:
+    """Ids de productos unicos entre shards: bloques reservados en la base principal (hi/lo).
+
+    Cada proceso reserva ``tamano_bloque`` ids con una sola escritura en la base
+    principal y los reparte en memoria; un producto conserva su id al mudarse de shard.
+    """
+
+    def __init__(self, tamano_bloque=1000):
+        self.tamano_bloque = tamano_bloque
+        self._siguiente = 0
+        self._limite = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def reservar(self, db_principal, cantidad):
+        with self._lock:
+            #un bloque reservado antes de un fork no se comparte con los workers
+            if self._pid != os.getpid():
+                self._siguiente = self._limite = 0
+                self._pid = os.getpid()
+            if self._limite - self._siguiente < cantidad:
+                #el resto del bloque anterior se descarta: los huecos en los ids no importan
+                bloque = max(self.tamano_bloque, cantidad)
+                limite = db_principal.execute(
+                    "UPDATE secuencia_productos SET valor = valor + ? WHERE id = 1 RETURNING valor", (bloque,)
+                ).fetchall()[0][0]
+                db_principal.commit()
+                self._siguiente, self._limite = limite - bloque, limite
+            inicio = self._siguiente + 1
+            self._siguiente += cantidad
+        return list(range(inicio, inicio + cantidad))
+
+
+class RouterShards:
+    """Ubica a cada usuario en un shard y mantiene un pool de conexiones por shard.
+
+    La tabla usuarios_shard de la base principal es la fuente de verdad. Un usuario
+    sin fila se asigna por hash estable (crc32 del id) y la asignacion se guarda, asi
+    agregar shards no mueve a nadie: los usuarios se mueven solo con ``flask shards``.
+    Los shards no tienen la tabla usuarios poblada, por eso usan foreign_keys OFF.
+    """
+
+    def __init__(self, app, rutas):
+        self.rutas = list(rutas)
+        self.crear_pools(app)
+        self.ids = AsignadorIds(app.config['DB_SHARDS_BLOQUE_IDS'])
+
+    def crear_pools(self, app):
+        #tambien en cada worker despues del fork (db_utils.reiniciar_pool)
+        self.pools = [
+            crear_pool(app, factory=ConexionInstrumentada, database=ruta, foreign_keys=False)
+            for ruta in self.rutas
+        ]
+
+    def indice_hash(self, user_id):
+        return zlib.crc32(str(user_id).encode()) % len(self.rutas)
+
+    def indice_de(self, db_principal, user_id):
+        fila = db_principal.execute(
+            "SELECT shard, moviendo FROM usuarios_shard WHERE usuario_id = ?", (user_id,)
+        ).fetchone()
+        if fila is None:
+            db_principal.execute(
+                "INSERT OR IGNORE INTO usuarios_shard (usuario_id, shard) VALUES (?, ?)",
+                (user_id, self.indice_hash(user_id))
+            )
+            db_principal.commit()
+            fila = db_principal.execute(
+                "SELECT shard, moviendo FROM usuarios_shard WHERE usuario_id = ?", (user_id,)
+            ).fetchone()
+        if fila[1]:
+            raise UsuarioEnMovimiento(f"Usuario {user_id} en migracion de shard")
+        return fila[0]
+
+    def migrar(self):
+        for ruta, pool in zip(self.rutas, self.pools):
+            conn = pool.obtener()
+            try:
+                aplicar_migraciones(conn)
+            finally:
+                pool.liberar(conn)
+
+    def cerrar(self):
+        for pool in self.pools:
+            pool.cerrar()
+
+
+def destino_productos(user_id):
+    """(indice, pool) donde estan los productos del usuario; indice None sin sharding."""
+    router = current_app.extensions.get('shards')
+    if router is None:
+        return None, get_pool()
+    ubicaciones = g.setdefault('_shard_de_usuario', {})
+    if user_id not in ubicaciones:
+        ubicaciones[user_id] = router.indice_de(get_db_connection(), user_id)
+    indice = ubicaciones[user_id]
+    return indice, router.pools[indice]
+
+
+def get_productos_db(user_id):
+    """Conexion de la peticion a la base con los productos del usuario (la principal sin sharding)."""
+    indice, pool = destino_productos(user_id)
+    if indice is None:
+        return get_db_connection()
+    conexiones = g.setdefault('_db_shards', {})
+    if indice not in conexiones:
+        conexiones[indice] = pool.obtener()
+    return conexiones[indice]
+
+
+def ids_nuevos(user_id, cantidad):
+    """Ids para insertar productos: reservados si hay shards, None (AUTOINCREMENT) si no."""
+    router = current_app.extensions.get('shards')
+    if router is None:
+        return [None] * cantidad
+    return router.ids.reservar(get_db_connection(), cantidad)
+
+
+def reclamar_ids(ids):
+    """Ids elegidos por el cliente que se pueden usar para altas.
+
+    Sin shards son todos (AUTOINCREMENT nunca reparte un id ya usado). Con shards solo
+    los que superan la secuencia global, que se adelanta hasta el mayor para que
+    ningun proceso los reserve despues; los demas pueden estar en otro shard.
+    """
+    ids = set(ids)
+    router = current_app.extensions.get('shards')
+    if router is None or not ids:
+        return ids
+    db = get_db_connection()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        valor = db.execute("SELECT valor FROM secuencia_productos WHERE id = 1").fetchone()[0]
+        libres = {producto_id for producto_id in ids if producto_id > valor}
+        if libres:
+            db.execute("UPDATE secuencia_productos SET valor = ? WHERE id = 1", (max(libres),))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return libres
+
+
+def bases_productos(app=None):
+    """Pools de todas las bases con productos (para compactacion, verificaciones y migraciones)."""
+    app = app or current_app
+    router = app.extensions.get('shards')
+    return list(router.pools) if router is not None else [get_pool(app)]
+
+
+def _liberar_shards(e=None):
+    for indice, conn in g.pop('_db_shards', {}).items():
+        current_app.extensions['shards'].pools[indice].liberar(conn)
+
+
+def _valor(db, sql, params):
+    fila = db.execute(sql, params).fetchone()
+    return fila[0] if fila and fila[0] is not None else 0
+
+
+def copiar_usuario(origen, destino, user_id):
+    """Copia los productos del usuario (mismos ids) y su estado derivado de origen a destino.
+
+    Borra primero lo que haya del usuario en destino (un intento anterior que fallo).
+    La version del inventario y la del feed de cambios continuan por encima de las
+    del origen: los ETag viejos no validan y un cliente con ``since`` del origen
+    recibe todo el inventario como cambios nuevos, mas los tombstones conservados.
+    """
+    destino.execute("BEGIN IMMEDIATE")
+    try:
+        #el usuario pudo haber vivido antes en destino: se vuelven a permitir sus escrituras
+        destino.execute("DELETE FROM usuarios_movidos WHERE usuario_id = ?", (user_id,))
+        destino.execute("DELETE FROM productos WHERE usuario_id = ?", (user_id,))
+        for tabla in TABLAS_DEL_USUARIO:
+            destino.execute(f"DELETE FROM {tabla} WHERE usuario_id = ?", (user_id,))
+
+        version = _valor(origen, "SELECT version FROM inventario_version WHERE usuario_id = ?", (user_id,))
+        destino.execute("INSERT INTO inventario_version (usuario_id, version) VALUES (?, ?)", (user_id, version))
+        secuencia = _valor(origen, "SELECT seq FROM sqlite_sequence WHERE name = 'productos_cambios'", ())
+        destino.execute("DELETE FROM sqlite_sequence WHERE name = 'productos_cambios' AND seq < ?", (secuencia,))
+        destino.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'productos_cambios', ?"
+            " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'productos_cambios')",
+            (secuencia,)
+        )
+        horizonte = _valor(origen, "SELECT version FROM productos_cambios_horizonte WHERE usuario_id = ?", (user_id,))
+        if horizonte:
+            destino.execute(
+                "INSERT INTO productos_cambios_horizonte (usuario_id, version) VALUES (?, ?)", (user_id, horizonte)
+            )
+
+        destino.executemany(
+            "INSERT INTO productos (id, nombre, cantidad, precio, usuario_id, descripcion) VALUES (?, ?, ?, ?, ?, ?)",
+            origen.execute(
+                "SELECT id, nombre, cantidad, precio, usuario_id, descripcion FROM productos"
+                " WHERE usuario_id = ? ORDER BY id", (user_id,)
+            ).fetchall()
+        )
+        destino.executemany(
+            "INSERT OR REPLACE INTO productos_cambios (usuario_id, producto_id, operacion, cambiado_en)"
+            " VALUES (?, ?, 'delete', ?)",
+            [(user_id, fila[0], fila[1]) for fila in origen.execute(
+                "SELECT producto_id, cambiado_en FROM productos_cambios"
+                " WHERE usuario_id = ? AND operacion = 'delete' ORDER BY version", (user_id,)
+            )]
+        )
+        copiados = _valor(destino, "SELECT COUNT(*) FROM productos WHERE usuario_id = ?", (user_id,))
+        destino.commit()
+    except Exception:
+        destino.rollback()
+        raise
+    return copiados
+
+
+def borrar_usuario(db, user_id):
+    """Quita del origen los productos ya copiados y las filas derivadas del usuario."""
+    db.execute("DELETE FROM productos WHERE usuario_id = ?", (user_id,))
+    for tabla in TABLAS_DEL_USUARIO:
+        db.execute(f"DELETE FROM {tabla} WHERE usuario_id = ?", (user_id,))
+
+
+def mover_usuario(db_principal, origen, destino, user_id, indice_destino, espera=1.0):
+    """Mueve los productos de un usuario entre bases y actualiza el directorio.
+
+    1. Se marca al usuario como ``moviendo``: sus peticiones nuevas reciben 503 y se
+       esperan ``espera`` segundos para que terminen las que ya estaban en curso.
+    2. Con el lock de escritura del origen tomado se copia a destino, se borra del
+       origen, se agrega el usuario a ``usuarios_movidos`` del origen y se apunta el
+       directorio al destino. ``origen`` puede ser la misma conexion que
+       ``db_principal`` (importacion desde la base principal).
+
+    La espera solo evita errores: una peticion que todavia escribe en el origen
+    despues del movimiento (un import largo) la rechazan los triggers de
+    ``usuarios_movidos`` y recibe 503, en lugar de dejar filas huerfanas; un UPDATE
+    o DELETE que no encuentra filas lo detecta ``comprobar_usuario_movido``.
+    """
+    db_principal.execute(
+        "INSERT INTO usuarios_shard (usuario_id, shard, moviendo) VALUES (?, ?, 1)"
+        " ON CONFLICT (usuario_id) DO UPDATE SET moviendo = 1",
+        (user_id, indice_destino)
+    )
+    db_principal.commit()
+    try:
+        time.sleep(espera)
+        origen.execute("BEGIN IMMEDIATE")
+        try:
+            copiados = copiar_usuario(origen, destino, user_id)
+            borrar_usuario(origen, user_id)
+            origen.execute("INSERT OR IGNORE INTO usuarios_movidos (usuario_id) VALUES (?)", (user_id,))
+            db_principal.execute(
+                "UPDATE usuarios_shard SET shard = ?, moviendo = 0 WHERE usuario_id = ?", (indice_destino, user_id)
+            )
+            db_principal.commit()
+        except Exception:
+            origen.rollback()
+            raise
+    except Exception:
+        #el usuario sigue en el origen: se libera sin cambiar de shard
+        db_principal.rollback()
+        db_principal.execute("UPDATE usuarios_shard SET moviendo = 0 WHERE usuario_id = ?", (user_id,))
+        db_principal.commit()
+        raise
+    try:
+        origen.commit()
+    except Exception as e:
+        #el directorio ya apunta al destino: en el origen quedan filas huerfanas, no datos perdidos
+        logging.error(f"No se pudieron borrar del origen los productos del usuario {user_id}: {e}")
+    logging.info(f"Usuario {user_id} movido al shard {indice_destino} ({copiados} productos)")
+    return copiados
+
+
+def _router():
+    router = current_app.extensions.get('shards')
+    if router is None:
+        raise click.ClickException("El sharding no esta activo (DB_SHARDS vacio)")
+    return router
+
+
+def _mover(router, user_id, indice_destino, desde_principal=False):
+    principal = get_db_connection()
+    if desde_principal:
+        origen_pool, origen = None, principal
+    else:
+        fila = principal.execute("SELECT shard FROM usuarios_shard WHERE usuario_id = ?", (user_id,)).fetchone()
+        origen_pool = router.pools[fila[0] if fila else router.indice_hash(user_id)]
+        if origen_pool is router.pools[indice_destino]:
+            return 0
+        origen = origen_pool.obtener()
+    destino_pool = router.pools[indice_destino]
+    destino = destino_pool.obtener()
+    try:
+        return mover_usuario(principal, origen, destino, user_id, indice_destino,
+                             current_app.config['DB_SHARDS_ESPERA_MOVIMIENTO'])
+    finally:
+        if origen_pool is not None:
+            origen_pool.liberar(origen)
+        destino_pool.liberar(destino)
+
+
+def productos_por_shard(router):
+    conteos = []
+    for pool in router.pools:
+        conn = pool.obtener()
+        try:
+            conteos.append(dict(conn.execute(
+                "SELECT usuario_id, COUNT(*) FROM productos GROUP BY usuario_id"
+            ).fetchall()))
+        finally:
+            pool.liberar(conn)
+    return conteos
+
+
+@click.group('shards')
+def shards_cli():
+    """Shards de productos por usuario."""
+
+
+@shards_cli.command('estado')
+@with_appcontext
+def estado():
+    """Usuarios y productos de cada shard."""
+    router = _router()
+    for indice, (ruta, conteo) in enumerate(zip(router.rutas, productos_por_shard(router))):
+        click.echo(f"[{indice}] {ruta}: {len(conteo)} usuarios, {sum(conteo.values())} productos")
+
+
+@shards_cli.command('mover')
+@click.option('--usuario', type=int, required=True)
+@click.option('--shard', 'indice', type=int, required=True, help='Indice del shard destino (0..N-1).')
+@with_appcontext
+def mover(usuario, indice):
+    """Mueve los productos de un usuario a otro shard."""
+    router = _router()
+    if not 0 <= indice < len(router.rutas):
+        raise click.ClickException(f"El shard debe estar entre 0 y {len(router.rutas) - 1}")
+    click.echo(f"Usuario {usuario}: {_mover(router, usuario, indice)} productos movidos al shard {indice}")
+
+
+@shards_cli.command('rebalancear')
+@click.option('--tolerancia', type=float, default=0.1, help='Desvio de productos aceptado respecto de la media.')
+@click.option('--dry-run', is_flag=True, help='Solo mostrar los movimientos.')
+@with_appcontext
+def rebalancear(tolerancia, dry_run):
+    """Mueve usuarios del shard mas cargado al menos cargado hasta quedar dentro de la tolerancia."""
+    router = _router()
+    conteos = productos_por_shard(router)
+    cargas = [sum(conteo.values()) for conteo in conteos]
+    media = sum(cargas) / len(cargas)
+    movimientos = 0
+    while True:
+        mayor = max(range(len(cargas)), key=cargas.__getitem__)
+        menor = min(range(len(cargas)), key=cargas.__getitem__)
+        exceso = cargas[mayor] - media
+        if exceso <= media * tolerancia:
+            break
+        #el usuario mas grande que no deje al destino por encima de la media
+        candidatos = [(n, u) for u, n in conteos[mayor].items() if cargas[menor] + n <= media + media * tolerancia]
+        if not candidatos:
+            break
+        productos, usuario = max(candidatos)
+        click.echo(f"usuario {usuario} ({productos} productos): shard {mayor} -> {menor}")
+        if not dry_run:
+            _mover(router, usuario, menor)
+        del conteos[mayor][usuario]
+        conteos[menor][usuario] = productos
+        cargas[mayor] -= productos
+        cargas[menor] += productos
+        movimientos += 1
+    click.echo(f"Movimientos: {movimientos}")
+
+
+@shards_cli.command('importar-principal')
+@with_appcontext
+def importar_principal():
+    """Mueve a sus shards los productos que aun estan en la base principal (al activar el sharding)."""
+    router = _router()
+    principal = get_db_connection()
+    usuarios = [fila[0] for fila in principal.execute("SELECT DISTINCT usuario_id FROM productos")]
+    for usuario in usuarios:
+        indice = router.indice_de(principal, usuario)
+        click.echo(f"Usuario {usuario}: {_mover(router, usuario, indice, desde_principal=True)} productos -> shard {indice}")
+
+
+def init_app_shards(app):
+    app.cli.add_command(shards_cli)
+    rutas = app.config['DB_SHARDS']
+    if not rutas:
+        return
+    router = app.extensions['shards'] = RouterShards(app, rutas)
+    if app.config['MIGRAR_AL_INICIAR']:
+        router.migrar()
+    with app.app_context():
+        #la secuencia arranca por encima de los ids que ya existian en la base principal
+        principal = get_db_connection()
+        principal.execute(
+            "UPDATE secuencia_productos SET valor = MAX(valor,"
+            " COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'productos'), 0)) WHERE id = 1"
+        )
+        principal.commit()
+    app.teardown_appcontext(_liberar_shards)
+
+    @app.errorhandler(UsuarioEnMovimiento)
+    def usuario_en_movimiento(error):
+        response = jsonify({"mensaje": "Inventario en mantenimiento, reintente en unos segundos"})
+        response.headers['Retry-After'] = '2'
+        return response, 503
@@ -2,6 +2,7 @@ import pytest
 import sqlite3
 import os
 import tempfile
+import io
 import json
 from werkzeug.security import generate_password_hash
 
@@ -252,3 +253,1493 @@ def test_productos_delete_item_not_found(client, auth_header):
     response = client.delete('/productos/999', headers=auth_header, follow_redirects=True)
     # Espera 404 (Not Found)
     assert response.status_code == 404
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL POOL DE CONEXIONES
+# ----------------------------------------------------------------------
+
+def test_pool_reutiliza_conexiones(client, app, auth_header):
+    """Varias peticiones seguidas deben reutilizar la misma conexion del pool."""
+    for _ in range(3):
+        assert client.get('/productos/', headers=auth_header).status_code == 200
+
+    stats = app.extensions['db_pool'].estadisticas()
+    assert stats['en_uso'] == 0
+    assert stats['prestamos'] > stats['creadas']
+
+def test_pool_aplica_pragmas(app):
+    """Las conexiones del pool salen configuradas (WAL, foreign_keys)."""
+    with app.app_context():
+        db = get_db_connection()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+def test_pool_agotado_responde_503(client, app, auth_header):
+    """Sin conexiones libres dentro de DB_POOL_TIMEOUT la peticion recibe 503 con Retry-After."""
+    pool = app.extensions['db_pool']
+    pool.timeout = 0.05
+    with app.app_context():
+        ocupadas = [pool.obtener() for _ in range(pool.max_conexiones)]
+    try:
+        response = client.get('/productos/', headers=auth_header)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+        assert 'mensaje' in response.get_json()
+    finally:
+        for conn in ocupadas:
+            pool.liberar(conn)
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE PAGINACION DEL LISTADO
+# ----------------------------------------------------------------------
+
+def _insertar_productos(app, filas):
+    """Inserta (nombre, cantidad, precio) para el usuario de prueba."""
+    with app.app_context():
+        db = get_db_connection()
+        db.executemany(
+            "INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES (?, ?, ?, 1)",
+            filas
+        )
+        db.commit()
+
+def test_productos_listado_paginado_por_cursor(client, app, auth_header):
+    """Recorre el listado ordenado por precio descendente pagina a pagina."""
+    _insertar_productos(app, [(f'Item {i}', i, float(i % 4)) for i in range(7)])
+
+    vistos = []
+    url = '/productos/?sort=-precio&limit=3'
+    while url:
+        response = client.get(url, headers=auth_header)
+        assert response.status_code == 200
+        pagina = json.loads(response.data)
+        assert len(pagina) <= 3
+        vistos.extend(pagina)
+        siguiente = response.headers.get('X-Next-Cursor')
+        url = f'/productos/?sort=-precio&limit=3&cursor={siguiente}' if siguiente else None
+
+    assert len(vistos) == 8
+    assert len({p['id'] for p in vistos}) == 8
+    claves = [(p['precio'], p['id']) for p in vistos]
+    assert claves == sorted(claves, reverse=True)
+
+def test_productos_listado_filtros_de_rango(client, app, auth_header):
+    """Los filtros de precio y stock se aplican en el servidor."""
+    _insertar_productos(app, [('Barato', 50, 5.0), ('Medio', 2, 50.0), ('Caro', 8, 500.0)])
+
+    response = client.get('/productos/?precio_min=10&precio_max=1500&cantidad_min=3&sort=nombre', headers=auth_header)
+    assert response.status_code == 200
+    nombres = [p['nombre'] for p in json.loads(response.data)]
+    assert nombres == ['Caro', 'Laptop']
+
+def test_productos_listado_parametros_invalidos(client, auth_header):
+    """Orden, limite o cursor invalidos devuelven 400."""
+    assert client.get('/productos/?sort=usuario_id', headers=auth_header).status_code == 400
+    assert client.get('/productos/?limit=0', headers=auth_header).status_code == 400
+    assert client.get('/productos/?cursor=no-es-un-cursor', headers=auth_header).status_code == 400
+
+def test_productos_cursor_con_tipos_incorrectos_400(client, auth_header):
+    """Un cursor bien codificado pero con valores del tipo equivocado para la columna se rechaza."""
+    from rutas.productos import codificar_cursor
+    for orden, valor, producto_id in (('precio', 'caro', 1), ('-precio', float('nan'), 1), ('nombre', 5, 1),
+                                      ('cantidad', 1.5, 1), ('id', 1, '1'), ('precio', 1.0, True)):
+        cursor = codificar_cursor(orden, valor, producto_id)
+        response = client.get(f'/productos/?sort={orden}&cursor={cursor}', headers=auth_header)
+        assert response.status_code == 400, (orden, valor, producto_id)
+    cursor = codificar_cursor('precio', 10, 1)
+    assert client.get(f'/productos/?sort=precio&cursor={cursor}', headers=auth_header).status_code == 200
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE EXPORTACION
+# ----------------------------------------------------------------------
+
+def test_productos_export_ndjson(client, app, auth_header):
+    """La exportacion NDJSON devuelve una linea JSON por producto."""
+    _insertar_productos(app, [(f'Item {i}', i, 1.5) for i in range(5)])
+
+    response = client.get('/productos/export', headers=auth_header)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in response.data.decode().splitlines()]
+    assert len(lineas) == 6
+    assert lineas[0] == {'id': 100, 'nombre': 'Laptop', 'cantidad': 5, 'precio': 1200.0}
+
+def test_productos_export_csv_gzip(client, auth_header):
+    """La exportacion CSV comprimida se puede descomprimir con gzip."""
+    import gzip
+    response = client.get('/productos/export?format=csv&gzip=1', headers=auth_header)
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lineas = gzip.decompress(response.data).decode().splitlines()
+    assert lineas == ['id,nombre,cantidad,precio', '100,Laptop,5,1200.0']
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE OPERACIONES MASIVAS
+# ----------------------------------------------------------------------
+
+def test_productos_bulk_mixto(client, app, auth_header):
+    """Un lote con altas, cambios, bajas y errores devuelve un resultado por item."""
+    _insertar_productos(app, [('Borrar', 1, 1.0)])
+    with app.app_context():
+        borrar_id = get_db_connection().execute(
+            "SELECT id FROM productos WHERE nombre = 'Borrar'").fetchone()[0]
+
+    response = client.post('/productos/bulk', headers=auth_header, json={'operaciones': [
+        {'op': 'upsert', 'nombre': 'Mouse', 'cantidad': 3, 'precio': 10.5},
+        {'op': 'upsert', 'nombre': 'Pad', 'cantidad': 1, 'precio': 2},
+        {'op': 'upsert', 'id': 100, 'cantidad': 7},
+        {'op': 'delete', 'id': borrar_id},
+        {'op': 'upsert', 'nombre': 'Sin precio', 'cantidad': 1},
+        {'op': 'delete', 'id': 999},
+    ]})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [r['status'] for r in data['resultados']] == [201, 201, 200, 204, 400, 404]
+    assert data['aplicadas'] == 4
+
+    mouse_id = data['resultados'][0]['id']
+    assert json.loads(client.get(f'/productos/{mouse_id}', headers=auth_header).data)['nombre'] == 'Mouse'
+    assert json.loads(client.get(f"/productos/{data['resultados'][1]['id']}", headers=auth_header).data)['nombre'] == 'Pad'
+    laptop = json.loads(client.get('/productos/100', headers=auth_header).data)
+    assert laptop['cantidad'] == 7 and laptop['nombre'] == 'Laptop'
+    assert client.get(f'/productos/{borrar_id}', headers=auth_header).status_code == 404
+
+def test_productos_bulk_limite(client, app, auth_header):
+    """Un lote mayor al configurado se rechaza con 413."""
+    app.config['BULK_MAX_OPERACIONES'] = 2
+    operaciones = [{'op': 'delete', 'id': i} for i in range(3)]
+    response = client.post('/productos/bulk', headers=auth_header, json={'operaciones': operaciones})
+    assert response.status_code == 413
+
+def test_productos_bulk_upsert_con_id_inexistente_crea(client, app, auth_header):
+    """Un upsert con un id que no existe crea el producto; el id de otro usuario sigue siendo 404."""
+    with app.app_context():
+        db = get_db_connection()
+        db.execute("INSERT INTO usuarios (id, username, password_hash) VALUES (2, 'otro', 'x')")
+        db.execute("INSERT INTO productos (id, nombre, cantidad, precio, usuario_id) VALUES (200, 'Ajeno', 1, 1, 2)")
+        db.commit()
+
+    response = client.post('/productos/bulk', headers=auth_header, json={'operaciones': [
+        {'op': 'upsert', 'id': 500, 'nombre': 'Nuevo', 'cantidad': 2, 'precio': 3.0},
+        {'op': 'upsert', 'id': 501, 'cantidad': 2},
+        {'op': 'upsert', 'id': 200, 'nombre': 'Robado', 'cantidad': 1, 'precio': 1.0},
+        {'op': 'upsert', 'id': 100, 'nombre': ''},
+    ]})
+    resultados = response.get_json()['resultados']
+    assert [r['status'] for r in resultados] == [201, 400, 404, 400]
+    assert resultados[0]['id'] == 500
+    assert client.get('/productos/500', headers=auth_header).get_json()['nombre'] == 'Nuevo'
+    assert client.get('/productos/100', headers=auth_header).get_json()['nombre'] == 'Laptop'
+
+def test_productos_import_csv_con_errores(client, auth_header, app):
+    """La importacion CSV guarda las filas validas y reporta las rechazadas."""
+    app.config['IMPORT_TAMANO_CHUNK'] = 2
+    cuerpo = (
+        'nombre,cantidad,precio\n'
+        'Cable,10,3.5\n'
+        'Hub,x,20\n'
+        'Cargador,4,15\n'
+        ',1,1\n'
+        '"Funda, negra",2,8\n'
+    )
+    response = client.post('/productos/import', headers=auth_header,
+                           data=cuerpo, content_type='text/csv')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['importadas'] == 3
+    assert [e['linea'] for e in data['errores']] == [3, 5]
+
+    nombres = {p['nombre'] for p in json.loads(client.get('/productos/', headers=auth_header).data)}
+    assert {'Cable', 'Cargador', 'Funda, negra'} <= nombres
+
+def test_productos_import_ndjson_dry_run(client, auth_header):
+    """En dry_run solo se valida: no se escribe nada."""
+    cuerpo = '{"nombre": "A", "cantidad": 1, "precio": 2.0}\n{"nombre": "B", "cantidad": "1", "precio": 2}\n'
+    response = client.post('/productos/import?dry_run=1', headers=auth_header,
+                           data=cuerpo, content_type='application/x-ndjson')
+    data = json.loads(response.data)
+    assert data['dry_run'] is True
+    assert data['importadas'] == 1 and data['rechazadas'] == 1
+    assert len(json.loads(client.get('/productos/', headers=auth_header).data)) == 1
+
+def test_productos_import_cantidad_fuera_de_rango(client, auth_header):
+    """Una cantidad que no cabe en 64 bits se rechaza como fila, en la importacion y en POST/PUT."""
+    cuerpo = f'nombre,cantidad,precio\nCable,1,1\nEnorme,{2**70},1\n'
+    response = client.post('/productos/import?format=csv', headers=auth_header, data=cuerpo, content_type='text/csv')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['importadas'] == 1 and [e['linea'] for e in data['errores']] == [3]
+
+    enorme = json.dumps({'nombre': 'Enorme', 'cantidad': 2**70, 'precio': 1})
+    for metodo, ruta in (('post', '/productos/'), ('put', '/productos/100')):
+        response = getattr(client, metodo)(ruta, headers=auth_header, data=enorme, content_type='application/json')
+        assert response.status_code == 400, metodo
+
+@pytest.mark.parametrize('formato', ['csv', 'ndjson'])
+def test_productos_import_linea_demasiado_larga(client, auth_header, app, formato):
+    """Una linea que supera IMPORT_MAX_LINEA se rechaza como fila y el resto se importa."""
+    from rutas import lotes
+    app.config['IMPORT_MAX_LINEA'] = 100
+    larga = 'x' * 1000
+    if formato == 'csv':
+        cuerpo = f'nombre,cantidad,precio\nCable,1,1\n{larga},1,1\nHub,2,2\n{larga}'
+    else:
+        cuerpo = ('{"nombre": "Cable", "cantidad": 1, "precio": 1}\n' + larga + '\n'
+                  '{"nombre": "Hub", "cantidad": 2, "precio": 2}\n' + larga)
+    response = client.post(f'/productos/import?format={formato}', headers=auth_header, data=cuerpo)
+    data = response.get_json()
+    assert data['importadas'] == 2
+    inicio = 3 if formato == 'csv' else 2
+    assert data['errores'] == [{'linea': inicio, 'mensaje': lotes.MENSAJE_LINEA_LARGA},
+                               {'linea': inicio + 2, 'mensaje': lotes.MENSAJE_LINEA_LARGA}]
+
+    #sin saltos de linea la memoria queda acotada: los bloques se descartan a medida que llegan
+    lineas = list(lotes._lineas(io.BytesIO(b'y' * 10000 + b'\nok\n'), 100, tamano_bloque=64))
+    assert lineas == [lotes.LINEA_DEMASIADO_LARGA, 'ok\n']
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE ETAG / VERSION DEL INVENTARIO
+# ----------------------------------------------------------------------
+
+def test_productos_etag_304_y_escritura(client, auth_header):
+    """If-None-Match con el ETag actual devuelve 304 hasta que hay una escritura."""
+    primera = client.get('/productos/', headers=auth_header)
+    etag = primera.headers['ETag']
+    assert etag
+
+    headers = dict(auth_header, **{'If-None-Match': etag})
+    repetida = client.get('/productos/', headers=headers)
+    assert repetida.status_code == 304
+    assert repetida.data == b''
+
+    client.post('/productos/', headers=auth_header, json={'nombre': 'Nuevo', 'cantidad': 1, 'precio': 1.0})
+    tras_escritura = client.get('/productos/', headers=headers)
+    assert tras_escritura.status_code == 200
+    assert tras_escritura.headers['ETag'] != etag
+
+def test_productos_etag_producto_individual(client, auth_header):
+    """El ETag de un producto cambia al actualizarlo."""
+    etag = client.get('/productos/100', headers=auth_header).headers['ETag']
+    headers = dict(auth_header, **{'If-None-Match': etag})
+    assert client.get('/productos/100', headers=headers).status_code == 304
+
+    client.put('/productos/100', headers=auth_header, json={'cantidad': 9})
+    assert client.get('/productos/100', headers=headers).status_code == 200
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE LA CACHE DE PRODUCTOS
+# ----------------------------------------------------------------------
+
+def test_cache_hits_e_invalidacion(client, app, auth_header):
+    """Las lecturas repetidas salen de la cache y un PUT invalida el producto."""
+    for _ in range(3):
+        client.get('/productos/100', headers=auth_header)
+        client.get('/productos/', headers=auth_header)
+    stats = app.extensions['cache_productos'].estadisticas()
+    assert stats['hits'] == 4
+    assert stats['misses'] == 2
+
+    client.put('/productos/100', headers=auth_header, json={'nombre': 'Laptop Pro'})
+    assert json.loads(client.get('/productos/100', headers=auth_header).data)['nombre'] == 'Laptop Pro'
+    assert json.loads(client.get('/productos/', headers=auth_header).data)[0]['nombre'] == 'Laptop Pro'
+
+def test_cache_lru_acotada():
+    """La cache LRU descarta la entrada menos usada al superar el maximo."""
+    from cache_productos import CacheLRU
+    cache = CacheLRU(max_entradas=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.estadisticas()['evicciones'] == 1
+
+def test_cache_lru_acotada_por_bytes():
+    """La cache descarta entradas viejas cuando los bytes aproximados superan CACHE_MAX_BYTES."""
+    from cache_productos import CacheLRU
+    cache = CacheLRU(max_entradas=100, ttl=60, max_bytes=3000)
+    cache.set('a', 'x' * 1000)
+    cache.set('b', 'x' * 1000)
+    cache.set('c', 'x' * 1000)
+    assert cache.get('a') is None and cache.get('c') is not None
+    cache.set('enorme', 'x' * 5000)
+    assert cache.get('enorme') is None
+    stats = cache.estadisticas()
+    assert stats['bytes'] <= 3000 and stats['entradas'] == 2
+
+def test_cache_compartida_caida_sigue_contra_la_base(app, client, auth_header):
+    """Si el backend compartido lanza errores, las lecturas y escrituras responden igual."""
+    from cache_productos import CacheCompartida, CacheProductos
+
+    class ClienteCaido:
+        def get(self, *a, **k):
+            raise ConnectionError("sin conexion")
+        set = delete = get
+
+    backend = CacheCompartida(ClienteCaido())
+    app.extensions['cache_productos'] = CacheProductos(backend)
+    assert client.get('/productos/100', headers=auth_header).status_code == 200
+    assert client.get('/productos/', headers=auth_header).status_code == 200
+    assert client.put('/productos/100', headers=auth_header, json={'cantidad': 9}).status_code == 200
+    assert backend.estadisticas()['errores'] >= 3
+
+def test_cache_deshabilitada():
+    """Con CACHE_HABILITADA=False no se guarda nada."""
+    app = create_app({'TESTING': True, 'DATABASE': ':memory:', 'CACHE_HABILITADA': False})
+    cache = app.extensions['cache_productos']
+    cache.set_producto(1, 1, 1, {'id': 1})
+    assert cache.get_producto(1, 1, 1) is None
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE HASHING Y LIMITES DE /auth
+# ----------------------------------------------------------------------
+
+def test_auth_login_limitado_por_usuario(client, app):
+    """Superada la rafaga por usuario, el login responde 429 con Retry-After."""
+    app.config['THROTTLE_USUARIO_CAPACIDAD'] = 2
+    from limites import init_app_limites
+    init_app_limites(app)
+
+    for _ in range(2):
+        response = client.post('/auth/login', json={'username': 'testuser', 'password': 'mala'})
+        assert response.status_code == 401
+    response = client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+def test_auth_login_exitoso_no_consume_bucket_de_usuario(client, app):
+    """Los logins correctos no agotan el bucket del usuario; solo cuentan los fallidos."""
+    app.config['THROTTLE_USUARIO_CAPACIDAD'] = 2
+    from limites import init_app_limites
+    init_app_limites(app)
+
+    for _ in range(4):
+        assert client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'}).status_code == 201
+    assert client.post('/auth/login', json={'username': 'testuser', 'password': 'mala'}).status_code == 401
+    assert client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'}).status_code == 201
+
+def test_auth_limite_por_ip_detras_de_proxy(app):
+    """Con PROXIES_CONFIABLES el bucket por IP usa X-Forwarded-For: cada cliente tiene el suyo."""
+    proxy = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'], 'PROXIES_CONFIABLES': 1,
+                        'THROTTLE_IP_CAPACIDAD': 2, 'THROTTLE_IP_RECARGA': 0.01,
+                        'JWT_SECRET_KEY': app.config['JWT_SECRET_KEY']})
+    client = proxy.test_client()
+
+    def login(ip):
+        return client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'},
+                           headers={'X-Forwarded-For': ip}).status_code
+
+    assert [login('10.0.0.1') for _ in range(3)] == [201, 201, 429]
+    assert login('10.0.0.2') == 201
+
+def test_auth_login_pool_hash_saturado(client, app):
+    """Sin cupo en el pool de hashing el login falla rapido con 503."""
+    pool = app.extensions['pool_hash']
+    for _ in range(pool.max_pendientes):
+        pool._cupos.acquire()
+    try:
+        response = client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'})
+        assert response.status_code == 503
+        assert pool.estadisticas()['rechazadas'] == 1
+    finally:
+        for _ in range(pool.max_pendientes):
+            pool._cupos.release()
+
+def test_pool_hash_timeout_conserva_el_cupo():
+    """Un hash que vencio su timeout sigue ocupando cupo hasta que el worker termina."""
+    import time
+    from hashing import PoolHash, HashSaturado
+    pool = PoolHash(workers=1, max_pendientes=1, timeout=30)
+    pool._ejecutar(time.sleep, 0)
+    pool.timeout = 0.2
+    with pytest.raises(HashSaturado):
+        pool._ejecutar(time.sleep, 1.5)
+    with pytest.raises(HashSaturado):
+        pool._ejecutar(time.sleep, 0)
+    assert pool.estadisticas()['rechazadas'] == 1
+    time.sleep(2)
+    pool.timeout = 30
+    assert pool._ejecutar(time.sleep, 0) is None
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE REFRESH TOKENS Y REVOCACION
+# ----------------------------------------------------------------------
+
+def _login_tokens(client):
+    response = client.post('/auth/login', json={'username': 'testuser', 'password': 'testpassword'})
+    return json.loads(response.data)
+
+def test_auth_refresh_emite_access_token(client, app):
+    """Con el refresh token se obtiene un access token nuevo sin volver a verificar la contraseña."""
+    tokens = _login_tokens(client)
+    hashes_antes = app.extensions['pool_hash'].estadisticas()['operaciones']
+
+    response = client.post('/auth/refresh', headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200
+    nuevo = json.loads(response.data)['access_token']
+    assert client.get('/productos/', headers={'Authorization': f'Bearer {nuevo}'}).status_code == 200
+    assert app.extensions['pool_hash'].estadisticas()['operaciones'] == hashes_antes
+
+    #un access token no sirve para refrescar
+    response = client.post('/auth/refresh', headers={'Authorization': f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 422
+
+def test_auth_logout_revoca_refresh_token(client, app):
+    """Un refresh token revocado se rechaza, tambien tras recargar la lista desde SQLite."""
+    tokens = _login_tokens(client)
+    refresh = {'Authorization': f"Bearer {tokens['refresh_token']}"}
+    assert client.post('/auth/logout', headers=refresh).status_code == 200
+    assert client.post('/auth/refresh', headers=refresh).status_code == 401
+
+    #una lista vacia (como en otro proceso) la recupera de la tabla
+    app.extensions['lista_revocacion'].__init__()
+    assert len(app.extensions['lista_revocacion']) == 0
+    assert client.post('/auth/refresh', headers=refresh).status_code == 401
+
+def test_revocacion_sincroniza_tras_podar_la_ultima_fila(app):
+    """Una revocacion posterior a podar la fila mas nueva llega a los otros procesos (seq no se reutiliza)."""
+    import time
+    from revocacion import ListaRevocacion
+    otro_proceso = ListaRevocacion(intervalo_sync=0)
+    expira = time.time() + 3600
+    with app.app_context():
+        lista = app.extensions['lista_revocacion']
+        lista.revocar('jti-1', expira)
+        lista.revocar('jti-2', expira)
+        assert otro_proceso.esta_revocado('jti-2')
+        db = get_db_connection()
+        db.execute("DELETE FROM tokens_revocados WHERE jti = 'jti-2'")
+        db.commit()
+        lista.revocar('jti-3', expira)
+        assert otro_proceso.esta_revocado('jti-3')
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE AJUSTE ATOMICO DE STOCK
+# ----------------------------------------------------------------------
+
+def test_productos_stock_delta(client, auth_header):
+    """PATCH /stock suma el delta y devuelve el producto actualizado."""
+    response = client.patch('/productos/100/stock', headers=auth_header, json={'delta': -3})
+    assert response.status_code == 200
+    assert json.loads(response.data)['cantidad'] == 2
+
+    response = client.patch('/productos/100/stock', headers=auth_header, json={'delta': 10})
+    assert json.loads(response.data)['cantidad'] == 12
+
+def test_productos_stock_no_negativo(client, auth_header):
+    """Sin permitir_negativo un delta que deja stock < 0 se rechaza con 409."""
+    response = client.patch('/productos/100/stock', headers=auth_header, json={'delta': -6})
+    assert response.status_code == 409
+    assert json.loads(response.data)['cantidad'] == 5
+
+    response = client.patch('/productos/100/stock', headers=auth_header,
+                            json={'delta': -6, 'permitir_negativo': True})
+    assert json.loads(response.data)['cantidad'] == -1
+
+    assert client.patch('/productos/999/stock', headers=auth_header, json={'delta': 1}).status_code == 404
+    assert client.patch('/productos/100/stock', headers=auth_header, json={'delta': '1'}).status_code == 400
+
+def test_productos_stock_valida_tipos_y_rango(client, auth_header):
+    """permitir_negativo debe ser booleano y delta caber en 64 bits; si no, 400 sin tocar el stock."""
+    for cuerpo in ({'delta': -6, 'permitir_negativo': 'false'}, {'delta': -6, 'permitir_negativo': 1},
+                   {'delta': 2**63}, {'delta': -2**63 - 1}):
+        response = client.patch('/productos/100/stock', headers=auth_header,
+                                data=json.dumps(cuerpo), content_type='application/json')
+        assert response.status_code == 400
+    assert client.get('/productos/100', headers=auth_header).get_json()['cantidad'] == 5
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE METRICAS
+# ----------------------------------------------------------------------
+
+def test_metrics_formato_prometheus(client, auth_header):
+    """/metrics expone latencias, estados y SQL por endpoint."""
+    client.get('/productos/', headers=auth_header)
+    client.get('/productos/100', headers=auth_header)
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    texto = response.data.decode()
+    assert '# TYPE inventario_http_request_duration_seconds histogram' in texto
+    assert 'inventario_http_request_duration_seconds_count{endpoint="productos.handle_productos"} 1' in texto
+    assert 'inventario_http_requests_total{endpoint="auth.login",status="201"} 1' in texto
+    assert 'inventario_http_requests_in_flight{endpoint="productos.handle_productos"} 0' in texto
+    assert 'inventario_password_hash_duration_seconds_count 1' in texto
+
+    lineas = dict(linea.rsplit(' ', 1) for linea in texto.splitlines() if not linea.startswith('#'))
+    #producto individual: version del inventario + SELECT del producto
+    assert int(lineas['inventario_sql_queries_total{endpoint="productos.handle_producto_id"}']) == 2
+
+def test_metrics_con_token(app, client):
+    """Con METRICAS_TOKEN, /metrics exige el token como Bearer."""
+    app.config['METRICAS_TOKEN'] = 'token-prometheus'
+    response = client.get('/metrics')
+    assert response.status_code == 401 and response.headers['WWW-Authenticate'] == 'Bearer'
+    assert client.get('/metrics', headers={'Authorization': 'Bearer otro'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer token-prometheus'})
+    assert response.status_code == 200 and 'inventario_http_requests_total' in response.get_data(as_text=True)
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL REGISTRO DE CONSULTAS LENTAS
+# ----------------------------------------------------------------------
+
+def test_consultas_lentas_con_plan(client, app, auth_header):
+    """Con umbral 0 toda sentencia se registra con su huella, forma de parametros y plan."""
+    app.extensions['consultas_lentas'].umbral = 0
+    app.config['ADMIN_USUARIOS'] = ['1']
+    client.get('/productos/?sort=precio&precio_min=10', headers=auth_header)
+
+    response = client.get('/admin/consultas-lentas?limit=50', headers=auth_header)
+    assert response.status_code == 200
+    consultas = json.loads(response.data)['consultas']
+    listado = next(c for c in consultas if c['huella'].startswith('SELECT id, nombre, cantidad, precio FROM productos WHERE'))
+    assert listado['params'] == ['int', 'float', 'int']
+    assert any('idx_productos_usuario_precio' in paso for paso in listado['plan'])
+
+def test_consultas_lentas_solo_admin(client, auth_header):
+    """Sin estar en ADMIN_USUARIOS el endpoint responde 403."""
+    assert client.get('/admin/consultas-lentas', headers=auth_header).status_code == 403
+
+def test_consultas_lentas_huella_nueva_entra_al_top():
+    """Con el registro lleno, una huella nueva desplaza a la de menos tiempo en lugar de descartarse."""
+    from consultas_lentas import RegistroConsultasLentas
+    registro = RegistroConsultasLentas(umbral=0, max_huellas=2)
+    conn = sqlite3.connect(':memory:')
+    registro.registrar(conn, "SELECT a", (), 5.0)
+    registro.registrar(conn, "SELECT b", (), 3.0)
+    registro.registrar(conn, "SELECT c", (), 1.0)
+    registro.registrar(conn, "SELECT c", (), 1.0)
+    assert [e['huella'] for e in registro.top()] == ['SELECT a', 'SELECT c']
+    assert registro.top()[1]['ejecuciones'] == 2
+    conn.close()
+
+def test_conexion_instrumentada_firma_de_sqlite3():
+    """execute/executemany aceptan lo mismo que sqlite3.Connection (posicionales, dict o secuencia)."""
+    from metricas import ConexionInstrumentada
+    conn = sqlite3.connect(':memory:', factory=ConexionInstrumentada)
+    conn.execute("CREATE TABLE t (a)")
+    conn.executemany("INSERT INTO t VALUES (?)", ((i,) for i in range(3)))
+    assert conn.execute("SELECT COUNT(*) FROM t WHERE a >= :m", {'m': 1}).fetchone()[0] == 2
+    for metodo in (conn.execute, sqlite3.Connection.execute.__get__(conn)):
+        with pytest.raises(TypeError):
+            metodo("SELECT 1", parameters=())
+    conn.close()
+
+def test_huella_normaliza_literales():
+    """Las sentencias que solo cambian en literales comparten huella."""
+    from consultas_lentas import huella
+    assert huella("SELECT * FROM t WHERE id IN (?, ?, ?)  AND n = 'x'") == huella("SELECT * FROM t WHERE id IN (?, ?) AND n = 'yy'")
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE MIGRACIONES
+# ----------------------------------------------------------------------
+
+ESQUEMA_SCHEMA_SQL_ANTERIOR = """
+    CREATE TABLE usuarios (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password_hash TEXT NO NULL);
+    CREATE TABLE productos (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT NOT NULL, descripcion TEXT,
+                            precio REAL NOT NULL, stock INTEGER NOT NULL);
+    INSERT INTO usuarios (username, password_hash) VALUES ('tester', 'x');
+    INSERT INTO productos (id, nombre, descripcion, precio, stock) VALUES (1, 'Laptop Gaming X500', 'RTX', 1500.00, 5);
+"""
+
+def test_migraciones_reconcilian_schema_sql(tmp_path):
+    """Una base creada con el antiguo schema.sql queda con cantidad, usuario_id e indices."""
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(ESQUEMA_SCHEMA_SQL_ANTERIOR)
+    conn.close()
+
+    app = create_app({'TESTING': True, 'DATABASE': db_path})
+    with app.app_context():
+        db = get_db_connection()
+        producto = dict(db.execute("SELECT id, nombre, cantidad, usuario_id, descripcion FROM productos").fetchone())
+        assert producto == {'id': 1, 'nombre': 'Laptop Gaming X500', 'cantidad': 5, 'usuario_id': 1, 'descripcion': 'RTX'}
+        indices = {fila[1] for fila in db.execute("PRAGMA index_list(productos)")}
+        assert {'idx_productos_usuario_id', 'idx_productos_usuario_nombre'} <= indices
+        from migraciones import MIGRACIONES
+        aplicadas = [fila[0] for fila in db.execute("SELECT version FROM schema_migraciones ORDER BY version")]
+        assert aplicadas == [version for version, _, _ in MIGRACIONES]
+
+def test_migraciones_cli_upgrade_idempotente(app):
+    """`flask db upgrade` sobre una base al dia no aplica nada."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert result.exit_code == 0
+    assert 'ya esta actualizado' in result.output
+    result = runner.invoke(args=['db', 'status'])
+    assert '[x] 001' in result.output
+
+def test_migraciones_aplicadas_por_otro_proceso_se_omiten(tmp_path, monkeypatch):
+    """Si otro proceso aplico una version despues de la lectura inicial, se omite al tomar el lock."""
+    import migraciones
+    conn = sqlite3.connect(str(tmp_path / 'carrera.db'), isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    assert migraciones.aplicar_migraciones(conn)
+    #lectura desactualizada: como si el otro proceso hubiera terminado justo despues
+    monkeypatch.setattr(migraciones, 'versiones_aplicadas', lambda db: set())
+    assert migraciones.aplicar_migraciones(conn) == []
+    conn.close()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL SERIALIZADOR JSON
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize('usar_orjson', [False, True])
+def test_serializador_filas_equivale_a_json(usar_orjson):
+    """La serializacion desde tuplas produce el mismo JSON que json.dumps de dicts."""
+    from json_rapido import SerializadorFilas, orjson
+    if usar_orjson and orjson is None:
+        pytest.skip('orjson no instalado')
+    columnas = ('id', 'nombre', 'descripcion', 'precio')
+    filas = [(1, 'Teclado "ñ"\n', None, 9.99), (2, 'Mouse', 'inalámbrico', 10.0)]
+    serializador = SerializadorFilas(columnas, usar_orjson)
+
+    esperado = [dict(zip(columnas, fila)) for fila in filas]
+    assert json.loads(serializador.lista(filas)) == esperado
+    assert [json.loads(linea) for linea in serializador.ndjson(filas).splitlines()] == esperado
+
+def test_json_proveedor_stdlib_configurable():
+    """JSON_PROVEEDOR='stdlib' usa la libreria estandar (sin NaN/Infinity) en lugar de orjson."""
+    from json_rapido import ProveedorEstricto, ProveedorOrjson
+    app = create_app({'TESTING': True, 'DATABASE': ':memory:', 'JSON_PROVEEDOR': 'stdlib'})
+    assert type(app.json) is ProveedorEstricto
+    assert not isinstance(app.json, ProveedorOrjson)
+
+@pytest.mark.parametrize('proveedor', ['stdlib', 'orjson'])
+def test_json_rechaza_numeros_no_finitos(proveedor, tmp_path):
+    """NaN/Infinity se rechazan al leer (400) y lanzan al serializar, con ambos proveedores."""
+    from json_rapido import SerializadorFilas, orjson
+    if proveedor == 'orjson' and orjson is None:
+        pytest.skip('orjson no instalado')
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'nan.db'), 'JSON_PROVEEDOR': proveedor})
+    for crudo in ('NaN', 'Infinity', '1e400'):
+        with pytest.raises(ValueError):
+            app.json.loads(f'{{"precio": {crudo}}}')
+    for valor in (float('nan'), float('inf')):
+        with pytest.raises(ValueError):
+            app.json.dumps({'precio': valor})
+        serializador = SerializadorFilas(('id', 'precio'), proveedor == 'orjson')
+        with pytest.raises(ValueError):
+            serializador.lista([(1, valor)])
+        with pytest.raises(ValueError):
+            serializador.ndjson([(1, valor)])
+    assert app.json.loads(app.json.dumps({'precio': 1.5, 'nada': None})) == {'precio': 1.5, 'nada': None}
+
+def test_productos_precio_no_finito_400(client, auth_header):
+    """Un precio NaN/Infinity (texto en PUT, o 1e400 en JSON) se rechaza con 400."""
+    assert client.put('/productos/100', headers=auth_header, json={'precio': 'nan'}).status_code == 400
+    assert client.put('/productos/100', headers=auth_header, json={'precio': 'inf'}).status_code == 400
+    response = client.post('/productos/', headers=auth_header, content_type='application/json',
+                           data='{"nombre": "X", "cantidad": 1, "precio": 1e400}')
+    assert response.status_code == 400
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE COMPRESION DE RESPUESTAS
+# ----------------------------------------------------------------------
+
+def test_compresion_gzip_listado_grande(client, app, auth_header):
+    """Un listado grande se comprime con gzip si el cliente lo acepta."""
+    import gzip
+    _insertar_productos(app, [(f'Producto repetido {i}', i, 9.5) for i in range(200)])
+    headers = dict(auth_header, **{'Accept-Encoding': 'gzip'})
+
+    response = client.get('/productos/?limit=200', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    productos = json.loads(gzip.decompress(response.data))
+    assert len(productos) == 200
+    assert len(response.data) < len(json.dumps(productos)) / 3
+
+    #el ETag de la variante comprimida tambien valida el 304
+    headers['If-None-Match'] = response.headers['ETag']
+    assert client.get('/productos/?limit=200', headers=headers).status_code == 304
+
+def test_compresion_omite_respuestas_pequenas(client, auth_header):
+    """Respuestas bajo COMPRESION_MIN_BYTES o sin Accept-Encoding no se comprimen."""
+    headers = dict(auth_header, **{'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in client.get('/productos/100', headers=headers).headers
+    assert 'Content-Encoding' not in client.get('/productos/', headers=auth_header).headers
+
+def test_compresion_stream_export(client, app, auth_header):
+    """La exportacion en streaming se comprime al vuelo segun Accept-Encoding."""
+    import gzip
+    _insertar_productos(app, [(f'Item {i}', i, 1.0) for i in range(50)])
+    response = client.get('/productos/export', headers=dict(auth_header, **{'Accept-Encoding': 'gzip'}))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.data).decode().splitlines()) == 51
+    assert 'inventario_http_compression_ratio_count{codificacion="gzip"} 1' in client.get('/metrics').data.decode()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE GROUP COMMIT
+# ----------------------------------------------------------------------
+
+def test_escritura_grupal_agrupa_y_aisla_errores(app):
+    """Escrituras concurrentes comparten transaccion; la que falla se deshace sola."""
+    import threading
+    from escritura_grupal import EscrituraGrupal
+    grupal = EscrituraGrupal(app.config['DATABASE'], ['busy_timeout = 5000'], ventana=0.2, max_operaciones=8)
+    barrera = threading.Barrier(8)
+    resultados = {}
+
+    def escribir(i):
+        def operacion(conn):
+            if i == 3:
+                conn.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('x', 1, 1, 1)")
+                raise ValueError("operacion invalida")
+            return conn.execute(
+                "INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES (?, 1, 1.0, 1)", (f'g{i}',)
+            ).lastrowid
+        barrera.wait()
+        try:
+            resultados[i] = grupal.ejecutar(operacion)
+        except ValueError as e:
+            resultados[i] = e
+
+    hilos = [threading.Thread(target=escribir, args=(i,)) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert isinstance(resultados.pop(3), ValueError)
+    assert len(set(resultados.values())) == 7
+    stats = grupal.estadisticas()
+    assert stats['operaciones'] == 8 and stats['lotes'] < 8
+    with app.app_context():
+        db = get_db_connection()
+        assert db.execute("SELECT COUNT(*) FROM productos WHERE nombre LIKE 'g%'").fetchone()[0] == 7
+        assert db.execute("SELECT COUNT(*) FROM productos WHERE nombre = 'x'").fetchone()[0] == 0
+
+def test_escritura_grupal_falla_si_el_hilo_muere(tmp_path):
+    """Si el escritor no puede abrir la base, ejecutar() falla en lugar de colgarse y el hilo se reintenta."""
+    import sqlite3
+    from escritura_grupal import EscrituraGrupal
+    grupal = EscrituraGrupal(str(tmp_path / 'no' / 'existe.db'), [], timeout=3)
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            grupal.ejecutar(lambda conn: conn.execute("SELECT 1").fetchone())
+    grupal.database = str(tmp_path / 'existe.db')
+    assert grupal.ejecutar(lambda conn: conn.execute("SELECT 1").fetchone()[0]) == 1
+
+def test_rutas_con_group_commit(client, app, auth_header):
+    """Con GROUP_COMMIT las rutas de productos responden igual que sin el."""
+    from escritura_grupal import EscrituraGrupal
+    app.extensions['escritura_grupal'] = EscrituraGrupal(app.config['DATABASE'], [], ventana=0.001)
+    response = client.post('/productos/', headers=auth_header,
+                           json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0})
+    assert response.status_code == 201
+    nuevo_id = response.get_json()['id']
+    assert client.patch(f'/productos/{nuevo_id}/stock', headers=auth_header, json={'delta': -5}).status_code == 409
+    assert client.put(f'/productos/{nuevo_id}', headers=auth_header, json={'cantidad': 7}).get_json()['cantidad'] == 7
+    assert client.delete(f'/productos/{nuevo_id}', headers=auth_header).status_code == 204
+    assert 'inventario_group_commit_total{tipo="operaciones"} 4' in client.get('/metrics').data.decode()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL FEED DE CAMBIOS
+# ----------------------------------------------------------------------
+
+def test_feed_cambios_incremental_con_tombstones(client, auth_header):
+    """El feed devuelve solo lo cambiado despues de since, con tombstones para los borrados."""
+    inicial = client.get('/productos/changes', headers=auth_header).get_json()
+    assert [c['id'] for c in inicial['cambios']] == [100]
+    assert inicial['cambios'][0]['producto']['nombre'] == 'Laptop'
+    version = inicial['version']
+
+    nuevo_id = client.post('/productos/', headers=auth_header,
+                           json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0}).get_json()['id']
+    client.put(f'/productos/{nuevo_id}', headers=auth_header, json={'cantidad': 9})
+    client.delete('/productos/100', headers=auth_header)
+
+    delta = client.get(f'/productos/changes?since={version}', headers=auth_header).get_json()
+    #una sola entrada por producto: el alta y la modificacion de Mouse se colapsan
+    assert [(c['id'], c['operacion']) for c in delta['cambios']] == [(nuevo_id, 'upsert'), (100, 'delete')]
+    assert delta['cambios'][0]['producto']['cantidad'] == 9
+    assert 'producto' not in delta['cambios'][1]
+
+    pagina = client.get(f'/productos/changes?since={version}&limit=1', headers=auth_header).get_json()
+    assert pagina['hay_mas'] and len(pagina['cambios']) == 1
+    vacio = client.get(f"/productos/changes?since={delta['version']}", headers=auth_header).get_json()
+    assert vacio['cambios'] == [] and vacio['version'] == delta['version']
+
+def test_feed_cambios_compactado_devuelve_410(client, app, auth_header):
+    """Tras compactar tombstones, un since anterior al horizonte recibe 410."""
+    from cambios import compactar_cambios
+    version = client.get('/productos/changes', headers=auth_header).get_json()['version']
+    client.delete('/productos/100', headers=auth_header)
+    with app.app_context():
+        assert compactar_cambios(get_db_connection(), retencion=-1) == 1
+
+    response = client.get(f'/productos/changes?since={version}', headers=auth_header)
+    assert response.status_code == 410
+    assert client.get('/productos/changes?since=0', headers=auth_header).status_code == 200
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL STREAM SSE
+# ----------------------------------------------------------------------
+
+def _eventos_sse(iterador, cantidad):
+    """Lee del stream hasta juntar `cantidad` eventos con id (ignora comentarios y heartbeats)."""
+    eventos = []
+    while len(eventos) < cantidad:
+        bloque = next(iterador).decode()
+        if bloque.startswith('id:'):
+            campos = dict(linea.split(': ', 1) for linea in bloque.strip().splitlines())
+            eventos.append((int(campos['id']), campos['event'], json.loads(campos['data'])))
+    return eventos
+
+def test_sse_publica_cambios_y_reanuda(client, app, auth_header):
+    """El stream recibe los cambios del usuario y al reconectar reenvia desde Last-Event-ID."""
+    app.config['EVENTOS_HEARTBEAT'] = 0.05
+    response = client.get('/productos/events', headers=auth_header, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    iterador = iter(response.response)
+
+    nuevo_id = client.post('/productos/', headers=auth_header,
+                           json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0}).get_json()['id']
+    client.delete('/productos/100', headers=auth_header)
+    (v1, op1, alta), (v2, op2, baja) = _eventos_sse(iterador, 2)
+    assert (op1, alta['producto']['nombre'], op2, baja['id']) == ('upsert', 'Mouse', 'delete', 100)
+    assert v1 < v2
+    response.close()
+    assert app.extensions['eventos'].estadisticas()['suscriptores'] == 0
+
+    #reconexion: solo llega lo posterior al ultimo evento recibido
+    reanudado = client.get('/productos/events', headers=dict(auth_header, **{'Last-Event-ID': str(v1)}),
+                           buffered=False)
+    assert _eventos_sse(iter(reanudado.response), 1)[0][:2] == (v2, 'delete')
+    reanudado.close()
+
+def test_sse_reenvio_acotado(client, app, auth_header):
+    """Un Last-Event-ID negativo es 400 y un reenvio mayor que EVENTOS_MAX_REENVIO es 410 sin suscribir."""
+    app.config['EVENTOS_MAX_REENVIO'] = 1
+    for i in range(2):
+        client.post('/productos/', headers=auth_header, json={'nombre': f'P{i}', 'cantidad': 1, 'precio': 1.0})
+    assert client.get('/productos/events', headers=dict(auth_header, **{'Last-Event-ID': '-1'})).status_code == 400
+    response = client.get('/productos/events', headers=dict(auth_header, **{'Last-Event-ID': '0'}))
+    assert response.status_code == 410 and response.get_json()['since'] == 0
+    assert app.extensions['eventos'].estadisticas()['suscriptores'] == 0
+
+def test_sse_desaloja_consumidor_lento(app):
+    """Si la cola del suscriptor se llena, el hub lo desaloja sin bloquear al escritor."""
+    from eventos import HubEventos
+    hub = HubEventos(tamano_cola=1)
+    with app.app_context():
+        db = get_db_connection()
+        suscripcion = hub.suscribir(1, 0)
+        db.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('A', 1, 1, 1)")
+        db.commit()
+        hub.publicar(db, 1)
+    assert suscripcion.desalojada
+    assert hub.estadisticas() == {"suscriptores": 0, "usuarios": 0, "desalojos": 1}
+
+def test_sse_sondeo_entrega_escrituras_de_otro_proceso(app):
+    """El sondeo del feed publica cambios confirmados por otro proceso (sin notificar_cambios)."""
+    from eventos import HubEventos
+    hub = HubEventos(sondeo=0.05, app=app)
+    with app.app_context():
+        actual = get_db_connection().execute("SELECT MAX(version) FROM productos_cambios").fetchone()[0]
+    suscripcion = hub.suscribir(1, actual)
+    try:
+        otro = sqlite3.connect(app.config['DATABASE'])
+        otro.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('Remoto', 1, 1, 1)")
+        otro.commit()
+        otro.close()
+        cambio = suscripcion.siguiente(timeout=5)
+        assert cambio is not None and cambio['producto']['nombre'] == 'Remoto'
+    finally:
+        hub.cancelar(suscripcion)
+
+def test_sse_publicar_no_retiene_el_lock_del_hub(monkeypatch):
+    """Mientras se lee el backlog de un usuario, el hub sigue atendiendo a los demas."""
+    import threading
+    import eventos
+    leyendo, seguir = threading.Event(), threading.Event()
+
+    def leer_lento(db, usuario_id, desde, limite=None):
+        leyendo.set()
+        seguir.wait(5)
+        return []
+
+    monkeypatch.setattr(eventos, 'leer_cambios', leer_lento)
+    hub = eventos.HubEventos()
+    hub.suscribir(1, 0)
+    hilo = threading.Thread(target=hub.publicar, args=(None, 1))
+    hilo.start()
+    assert leyendo.wait(5)
+    try:
+        assert hub._lock.acquire(timeout=1)
+        hub._lock.release()
+        hub.suscribir(2, 0)
+    finally:
+        seguir.set()
+        hilo.join()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE BUSQUEDA DE TEXTO COMPLETO
+# ----------------------------------------------------------------------
+
+def test_busqueda_prefijo_ranking_y_usuario(client, app, auth_header):
+    """La busqueda usa prefijos, prioriza el nombre y no devuelve productos de otros usuarios."""
+    response = client.post('/productos/', headers=auth_header, json={
+        'nombre': 'Cable HDMI', 'cantidad': 10, 'precio': 5.0, 'descripcion': 'Compatible con laptop y monitor'
+    })
+    cable_id = response.get_json()['id']
+    with app.app_context():
+        db = get_db_connection()
+        db.execute("INSERT INTO usuarios (id, username, password_hash) VALUES (2, 'otro', 'x')")
+        db.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('Laptop ajena', 1, 1, 2)")
+        db.commit()
+
+    resultados = client.get('/productos/search?q=lapt', headers=auth_header).get_json()
+    #Laptop coincide en el nombre (peso mayor) y el cable solo en la descripcion
+    assert [p['id'] for p in resultados] == [100, cable_id]
+    assert resultados[1]['descripcion'] == 'Compatible con laptop y monitor'
+
+    #la actualizacion del nombre reindexa; los caracteres de sintaxis FTS se ignoran
+    client.put(f'/productos/{cable_id}', headers=auth_header, json={'nombre': 'Adaptador'})
+    assert [p['id'] for p in client.get('/productos/search?q=adapt"*(', headers=auth_header).get_json()] == [cable_id]
+    assert client.get('/productos/search?q=', headers=auth_header).status_code == 400
+
+def test_put_descripcion_null_la_borra(client, auth_header):
+    """En PUT, omitir descripcion la conserva y enviar null la borra (y la saca de la busqueda)."""
+    client.put('/productos/100', headers=auth_header, json={'descripcion': 'Equipo portatil'})
+    response = client.put('/productos/100', headers=auth_header, json={'cantidad': 7})
+    assert response.get_json()['descripcion'] == 'Equipo portatil'
+
+    response = client.put('/productos/100', headers=auth_header, json={'descripcion': None})
+    assert response.status_code == 200 and response.get_json()['descripcion'] is None
+    assert client.get('/productos/search?q=portatil', headers=auth_header).get_json() == []
+
+def test_busqueda_paginada_por_cursor(client, app, auth_header):
+    """Los resultados se paginan con X-Next-Cursor sin repetir ni saltar productos."""
+    _insertar_productos(app, [(f'Teclado modelo {i}', i, 30.0) for i in range(5)])
+    vistos = []
+    url = '/productos/search?q=teclado&limit=2'
+    while url:
+        response = client.get(url, headers=auth_header)
+        vistos.extend(p['id'] for p in response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f'/productos/search?q=teclado&limit=2&cursor={cursor}' if cursor else None
+    assert len(vistos) == 5 and len(set(vistos)) == 5
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL RESUMEN DEL INVENTARIO
+# ----------------------------------------------------------------------
+
+def test_resumen_incremental_en_escrituras(client, auth_header):
+    """Cada escritura actualiza el resumen: productos, unidades, valor y stock bajo."""
+    assert client.get('/productos/resumen', headers=auth_header).get_json() == {
+        'productos': 1, 'unidades': 5, 'valor': 6000.0, 'stock_bajo': 1, 'umbral_stock_bajo': 5
+    }
+    nuevo_id = client.post('/productos/', headers=auth_header,
+                           json={'nombre': 'Mouse', 'cantidad': 10, 'precio': 20.0}).get_json()['id']
+    client.patch(f'/productos/{nuevo_id}/stock', headers=auth_header, json={'delta': -7})
+    client.put('/productos/100', headers=auth_header, json={'cantidad': 6})
+    resumen = client.get('/productos/resumen', headers=auth_header).get_json()
+    assert (resumen['productos'], resumen['unidades'], resumen['valor'], resumen['stock_bajo']) == (2, 9, 7260.0, 1)
+
+    client.delete(f'/productos/{nuevo_id}', headers=auth_header)
+    resumen = client.get('/productos/resumen', headers=auth_header).get_json()
+    assert (resumen['productos'], resumen['unidades'], resumen['stock_bajo']) == (1, 6, 0)
+
+def test_resumen_verificar_y_recalcular(app, client, auth_header):
+    """El comando detecta deriva y el recalculo la corrige (tambien al cambiar el umbral)."""
+    with app.app_context():
+        db = get_db_connection()
+        db.execute("UPDATE inventario_resumen SET unidades = 999 WHERE usuario_id = 1")
+        db.commit()
+    runner = app.test_cli_runner()
+    resultado = runner.invoke(args=['resumen', 'verificar'])
+    assert resultado.exit_code == 1 and 'usuario 1' in resultado.output
+
+    assert runner.invoke(args=['resumen', 'recalcular', '--umbral', '2']).exit_code == 0
+    assert runner.invoke(args=['resumen', 'verificar']).exit_code == 0
+    app.config['ADMIN_USUARIOS'] = ['1']
+    resumen = client.get('/admin/resumen?verificar=1', headers=auth_header).get_json()
+    assert (resumen['unidades'], resumen['stock_bajo'], resumen['diferencias']) == (5, 0, [])
+
+def test_resumen_verificar_lee_una_sola_instantanea(app):
+    """Una escritura confirmada entre las dos lecturas de la verificacion no se reporta como deriva."""
+    from resumenes import verificar_resumenes
+    ruta = app.config['DATABASE']
+
+    class ConexionConEscritor(sqlite3.Connection):
+        def execute(self, sql, *args):
+            cursor = super().execute(sql, *args)
+            if 'FROM inventario_resumen' in sql:
+                otro = sqlite3.connect(ruta)
+                otro.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('X', 3, 1, 1)")
+                otro.commit()
+                otro.close()
+            return cursor
+
+    conn = sqlite3.connect(ruta, factory=ConexionConEscritor)
+    try:
+        assert verificar_resumenes(conn) == []
+        assert not conn.in_transaction
+    finally:
+        conn.close()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL MODO ASGI
+# ----------------------------------------------------------------------
+
+def _peticion_asgi(app_asgi, metodo, ruta, headers=None, json_body=None, query=b''):
+    """Ejecuta una peticion contra la app ASGI sin servidor; devuelve (status, headers, cuerpo)."""
+    import asyncio
+    cuerpo = json.dumps(json_body).encode() if json_body is not None else b''
+    cabeceras = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    if json_body is not None:
+        cabeceras.append((b'content-type', b'application/json'))
+    scope = {'type': 'http', 'method': metodo, 'path': ruta, 'query_string': query, 'headers': cabeceras,
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    enviados = []
+
+    async def ejecutar():
+        mensajes = [{'type': 'http.request', 'body': cuerpo, 'more_body': False}]
+        sin_desconexion = asyncio.Event()
+
+        async def receive():
+            if mensajes:
+                return mensajes.pop(0)
+            await sin_desconexion.wait()
+
+        async def send(mensaje):
+            enviados.append(mensaje)
+
+        await app_asgi({**scope}, receive, send)
+
+    asyncio.run(ejecutar())
+    inicio = enviados[0]
+    return (inicio['status'], {k.decode(): v.decode() for k, v in inicio['headers']},
+            b''.join(m.get('body', b'') for m in enviados[1:]))
+
+def test_asgi_mismas_rutas_jwt_y_json(app, client, auth_header):
+    """La app ASGI responde con los mismos status, JWT y cuerpos que la app WSGI."""
+    from puente_asgi import AppAsgi
+    app_asgi = AppAsgi(app)
+    status, _, cuerpo = _peticion_asgi(app_asgi, 'POST', '/auth/login',
+                                       json_body={'username': 'testuser', 'password': 'testpassword'})
+    assert status == 201
+    token = json.loads(cuerpo)['access_token']
+
+    headers = {'Authorization': f'Bearer {token}'}
+    status, cabeceras, cuerpo = _peticion_asgi(app_asgi, 'GET', '/productos/', headers=headers)
+    assert status == 200 and 'etag' in cabeceras
+    assert json.loads(cuerpo) == client.get('/productos/', headers=auth_header).get_json()
+    assert _peticion_asgi(app_asgi, 'GET', '/productos/')[0] == 401
+
+    status, _, cuerpo = _peticion_asgi(app_asgi, 'POST', '/productos/', headers=headers,
+                                       json_body={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0})
+    assert status == 201 and json.loads(cuerpo)['mensaje'] == 'Producto agregado con exito'
+    app_asgi.cerrar()
+
+def test_asgi_respuesta_en_streaming(app, auth_header):
+    """Las respuestas en streaming (export) llegan completas a traves del puente."""
+    from puente_asgi import AppAsgi
+    _insertar_productos(app, [(f'Item {i}', i, 1.0) for i in range(30)])
+    app_asgi = AppAsgi(app)
+    status, cabeceras, cuerpo = _peticion_asgi(app_asgi, 'GET', '/productos/export', headers=auth_header)
+    assert status == 200 and cabeceras['content-type'].startswith('application/x-ndjson')
+    assert len(cuerpo.decode().splitlines()) == 31
+    app_asgi.cerrar()
+
+def test_asgi_sse_no_ocupa_hilos_de_stream(app, client, auth_header):
+    """En modo ASGI el stream SSE espera en el bucle de eventos y se cancela al desconectarse el cliente."""
+    import asyncio
+    from puente_asgi import AppAsgi
+    app.config['EVENTOS_HEARTBEAT'] = 0.05
+    app_asgi = AppAsgi(app)
+    scope = {'type': 'http', 'method': 'GET', 'path': '/productos/events', 'query_string': b'',
+             'headers': [(k.lower().encode(), v.encode()) for k, v in auth_header.items()],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    cuerpos = []
+
+    async def ejecutar():
+        loop = asyncio.get_running_loop()
+        conectado, recibido = asyncio.Event(), asyncio.Event()
+        mensajes = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if mensajes:
+                return mensajes.pop(0)
+            await recibido.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(mensaje):
+            cuerpo = mensaje.get('body', b'')
+            cuerpos.append(cuerpo)
+            if cuerpo.startswith(b': conectado'):
+                conectado.set()
+            elif cuerpo.startswith(b'id:'):
+                recibido.set()
+
+        tarea = asyncio.ensure_future(app_asgi(scope, receive, send))
+        await asyncio.wait_for(conectado.wait(), 5)
+        respuesta = await loop.run_in_executor(None, lambda: client.post(
+            '/productos/', headers=auth_header, json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0}))
+        assert respuesta.status_code == 201
+        await asyncio.wait_for(tarea, 5)
+
+    asyncio.run(ejecutar())
+    assert any(b'Mouse' in cuerpo for cuerpo in cuerpos)
+    assert not app_asgi._streams._threads
+    assert app.extensions['eventos'].estadisticas()['suscriptores'] == 0
+    app_asgi.cerrar()
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL ARRANQUE EN PRODUCCION
+# ----------------------------------------------------------------------
+
+def test_pool_se_reinicia_tras_fork(app):
+    """El master cierra sus conexiones antes del fork y cada worker crea un pool nuevo."""
+    from db_utils import get_pool, preparar_fork, reiniciar_pool
+    with app.app_context():
+        get_db_connection()
+    pool_master = get_pool(app)
+    assert pool_master.estadisticas()['libres'] == 1
+
+    preparar_fork(app)
+    assert pool_master.estadisticas()['abiertas'] == 0
+    pool_worker = reiniciar_pool(app)
+    assert pool_worker is not pool_master and get_pool(app) is pool_worker
+    with app.app_context():
+        assert get_db_connection().execute("SELECT COUNT(*) FROM productos").fetchone()[0] == 1
+
+def test_configuracion_gunicorn():
+    """gunicorn.conf.py precarga la app y usa workers con hilos."""
+    import runpy
+    config = runpy.run_path(os.path.join(os.path.dirname(__file__), 'gunicorn.conf.py'))
+    assert config['preload_app'] is True and config['worker_class'] == 'gthread'
+    assert callable(config['post_fork']) and callable(config['when_ready'])
+
+def test_compactador_arranca_con_la_primera_peticion(tmp_path):
+    """Con preload_app el master no debe quedar con el hilo compactador: arranca en cada worker."""
+    import threading
+    nombres = lambda: [hilo.name for hilo in threading.enumerate()]
+    app = create_app({'DATABASE': str(tmp_path / 'compactador.db'), 'CAMBIOS_INTERVALO_COMPACTACION': 3600})
+    assert 'compactador-cambios' not in nombres()
+    app.test_client().get('/productos')
+    assert nombres().count('compactador-cambios') == 1
+
+# ----------------------------------------------------------------------
+# PRUEBAS DEL SHARDING POR USUARIO
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def app_shards(app, tmp_path):
+    """Misma base principal que ``app`` (usuario 1 y producto 100) mas dos shards vacios."""
+    app_shards = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'JWT_SECRET_KEY': app.config['JWT_SECRET_KEY'],
+        'DB_SHARDS': [str(tmp_path / 'shard0.db'), str(tmp_path / 'shard1.db')],
+        'DB_SHARDS_ESPERA_MOVIMIENTO': 0,
+    })
+    yield app_shards
+    app_shards.extensions['shards'].cerrar()
+
+def _productos_en_shards(app_shards):
+    from shards import productos_por_shard
+    return productos_por_shard(app_shards.extensions['shards'])
+
+def test_shards_importar_y_enrutar_por_usuario(app_shards, auth_header):
+    """importar-principal lleva los productos al shard del usuario y las rutas leen y escriben ahi."""
+    runner = app_shards.test_cli_runner()
+    resultado = runner.invoke(args=['shards', 'importar-principal'])
+    assert resultado.exit_code == 0, resultado.output
+    router = app_shards.extensions['shards']
+    indice = router.indice_hash(1)
+    assert _productos_en_shards(app_shards)[indice] == {1: 1}
+
+    client = app_shards.test_client()
+    assert [p['id'] for p in client.get('/productos/', headers=auth_header).get_json()] == [100]
+    nuevo = client.post('/productos/', headers=auth_header,
+                        json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0}).get_json()['id']
+    #los ids nuevos salen de la secuencia global, por encima de los de la base principal
+    assert nuevo > 100
+    lote = client.post('/productos/bulk', headers=auth_header, json={'operaciones': [
+        {'op': 'upsert', 'nombre': 'Teclado', 'cantidad': 1, 'precio': 50.0},
+        {'op': 'upsert', 'id': nuevo, 'cantidad': 7},
+    ]}).get_json()
+    assert lote['aplicadas'] == 2 and lote['resultados'][0]['id'] == nuevo + 1
+    assert _productos_en_shards(app_shards)[indice] == {1: 3}
+    assert client.get('/productos/search?q=tecl', headers=auth_header).get_json()[0]['nombre'] == 'Teclado'
+    assert client.get('/productos/resumen', headers=auth_header).get_json()['productos'] == 3
+    assert runner.invoke(args=['resumen', 'verificar']).exit_code == 0
+
+    #un upsert con un id por encima de la secuencia global lo crea y la secuencia lo salta
+    lote = client.post('/productos/bulk', headers=auth_header, json={'operaciones': [
+        {'op': 'upsert', 'id': nuevo + 5000, 'nombre': 'Cable', 'cantidad': 1, 'precio': 1.0},
+        {'op': 'upsert', 'id': 100, 'cantidad': 9},
+    ]}).get_json()
+    assert [r['status'] for r in lote['resultados']] == [201, 200]
+    with app_shards.app_context():
+        assert get_db_connection().execute(
+            "SELECT valor FROM secuencia_productos WHERE id = 1").fetchone()[0] == nuevo + 5000
+
+def test_shards_mover_usuario_conserva_ids_y_feed(app_shards, auth_header):
+    """Mover un usuario de shard conserva los ids; el ETag y el feed de cambios siguen avanzando."""
+    runner = app_shards.test_cli_runner()
+    runner.invoke(args=['shards', 'importar-principal'])
+    client = app_shards.test_client()
+    client.delete('/productos/100', headers=auth_header)
+    client.post('/productos/', headers=auth_header, json={'nombre': 'Mouse', 'cantidad': 3, 'precio': 20.0})
+    antes = client.get('/productos/', headers=auth_header)
+    feed = client.get('/productos/changes', headers=auth_header).get_json()
+
+    router = app_shards.extensions['shards']
+    destino = 1 - router.indice_hash(1)
+    resultado = runner.invoke(args=['shards', 'mover', '--usuario', '1', '--shard', str(destino)])
+    assert resultado.exit_code == 0, resultado.output
+    assert _productos_en_shards(app_shards)[destino] == {1: 1}
+    assert _productos_en_shards(app_shards)[1 - destino] == {}
+
+    despues = client.get('/productos/', headers={**auth_header, 'If-None-Match': antes.headers['ETag']})
+    assert despues.status_code == 200 and despues.get_json() == antes.get_json()
+    nuevos = client.get(f"/productos/changes?since={feed['version']}", headers=auth_header).get_json()
+    #el cliente recibe de nuevo el producto vivo y el tombstone del 100
+    assert {(c['id'], c['operacion']) for c in nuevos['cambios']} >= {(100, 'delete')}
+    assert all(c['version'] > feed['version'] for c in nuevos['cambios'])
+
+def test_shards_escritura_tardia_en_el_origen_se_rechaza(app_shards, auth_header):
+    """Tras mover al usuario, una escritura que aun apunta al shard de origen no se aplica y responde 503."""
+    import sqlite3
+    runner = app_shards.test_cli_runner()
+    runner.invoke(args=['shards', 'importar-principal'])
+    router = app_shards.extensions['shards']
+    origen = router.indice_hash(1)
+    assert runner.invoke(args=['shards', 'mover', '--usuario', '1', '--shard', str(1 - origen)]).exit_code == 0
+
+    conn = sqlite3.connect(router.rutas[origen])
+    with pytest.raises(sqlite3.IntegrityError, match='usuario movido'):
+        conn.execute("INSERT INTO productos (id, nombre, cantidad, precio, usuario_id) VALUES (900, 'x', 1, 1.0, 1)")
+    conn.close()
+
+    #una peticion que resolvio el shard antes del movimiento (se simula con el directorio viejo)
+    with app_shards.app_context():
+        db = get_db_connection()
+        db.execute("UPDATE usuarios_shard SET shard = ? WHERE usuario_id = 1", (origen,))
+        db.commit()
+    client = app_shards.test_client()
+    response = client.post('/productos/', headers=auth_header, json={'nombre': 'Tarde', 'cantidad': 1, 'precio': 1.0})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '2'
+    response = client.post('/productos/import?format=csv', headers=auth_header,
+                           data='nombre,cantidad,precio\nTarde,1,1.0\n', content_type='text/csv')
+    assert response.status_code == 503 and response.get_json()['importadas'] == 0
+    #UPDATE y DELETE no encuentran filas en el origen: 503 en lugar de 404
+    for metodo, ruta, cuerpo in (('put', '/productos/100', {'cantidad': 9}), ('delete', '/productos/100', None),
+                                 ('patch', '/productos/100/stock', {'delta': 1})):
+        response = getattr(client, metodo)(ruta, headers=auth_header, json=cuerpo)
+        assert response.status_code == 503 and response.headers['Retry-After'] == '2', metodo
+    assert _productos_en_shards(app_shards)[origen] == {}
+
+    #volver al shard de origen lo habilita de nuevo
+    with app_shards.app_context():
+        db = get_db_connection()
+        db.execute("UPDATE usuarios_shard SET shard = ? WHERE usuario_id = 1", (1 - origen,))
+        db.commit()
+    assert runner.invoke(args=['shards', 'mover', '--usuario', '1', '--shard', str(origen)]).exit_code == 0
+    assert client.post('/productos/', headers=auth_header,
+                       json={'nombre': 'Vuelta', 'cantidad': 1, 'precio': 1.0}).status_code == 201
+
+def test_shards_usuario_en_movimiento_responde_503(app_shards, auth_header):
+    """Mientras el usuario se migra de shard sus peticiones reciben 503 con Retry-After."""
+    with app_shards.app_context():
+        db = get_db_connection()
+        db.execute("INSERT INTO usuarios_shard (usuario_id, shard, moviendo) VALUES (1, 0, 1)")
+        db.commit()
+    response = app_shards.test_client().get('/productos/', headers=auth_header)
+    assert response.status_code == 503 and response.headers['Retry-After'] == '2'
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE LA SEMILLA Y LA PRUEBA DE CARGA
+# ----------------------------------------------------------------------
+
+@pytest.mark.parametrize('rapido', [False, True])
+def test_seed_genera_usuarios_y_productos(app, rapido):
+    """flask seed crea usuarios que pueden iniciar sesion y productos con feed, FTS y resumen al dia."""
+    argumentos = ['seed', '--usuarios', '3', '--productos', '250', '--lote', '100']
+    resultado = app.test_cli_runner().invoke(args=argumentos + (['--rapido'] if rapido else []))
+    assert resultado.exit_code == 0, resultado.output
+    with app.app_context():
+        db = get_db_connection()
+        ids = [fila[0] for fila in db.execute("SELECT id FROM usuarios WHERE username LIKE 'carga%'")]
+        assert len(ids) == 3
+        marcadores = ', '.join('?' * len(ids))
+        assert db.execute(f"SELECT COUNT(*) FROM productos WHERE usuario_id IN ({marcadores})", ids).fetchone()[0] == 250
+        assert db.execute(f"SELECT COUNT(*) FROM productos_cambios WHERE usuario_id IN ({marcadores})", ids).fetchone()[0] == 250
+        assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'productos'").fetchone()[0] == 14
+    assert app.test_cli_runner().invoke(args=['resumen', 'verificar']).exit_code == 0
+
+    client = app.test_client()
+    login = client.post('/auth/login', json={'username': 'carga000001', 'password': 'carga123'})
+    assert login.status_code == 201
+    headers = {'Authorization': f"Bearer {login.get_json()['access_token']}"}
+    total = client.get('/productos/resumen', headers=headers).get_json()['productos']
+    assert total == len(client.get('/productos/?limit=1000', headers=headers).get_json())
+    #repetirla reutiliza los usuarios existentes
+    assert app.test_cli_runner().invoke(args=['seed', '--usuarios', '3', '--productos', '0']).exit_code == 0
+
+def _modulo_carga():
+    import importlib.util
+    ruta = os.path.join(os.path.dirname(__file__), 'benchmarks', 'carga.py')
+    spec = importlib.util.spec_from_file_location('carga', ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+def test_carga_en_proceso_reporta_percentiles_por_endpoint(app):
+    """El driver de carga recorre la mezcla y el reporte trae throughput y p50/p95/p99 por operacion."""
+    carga = _modulo_carga()
+    app.test_cli_runner().invoke(args=['seed', '--usuarios', '2', '--productos', '40'])
+    segundos, muestras = carga.ejecutar_carga(lambda i: carga.TransporteProceso(app, i), usuarios=2,
+                                              clientes=2, duracion=1.0)
+    informe = carga.reporte(segundos, muestras, {"modo": "proceso"})
+    assert {'login', 'listar', 'obtener'} <= set(informe["endpoints"])
+    for datos in informe["endpoints"].values():
+        assert datos["p50_ms"] <= datos["p95_ms"] <= datos["p99_ms"] <= datos["max_ms"]
+        assert datos["errores"] == 0
+    assert json.loads(json.dumps(informe))["total"]["peticiones"] == len(muestras)
+
+def test_carga_compara_reportes():
+    """comparar() marca como regresion un p99 que sube o un throughput que baja mas que la tolerancia."""
+    carga = _modulo_carga()
+    base = {"endpoints": {"listar": {"p99_ms": 10.0, "por_segundo": 100.0, "errores": 0}}}
+    igual = {"endpoints": {"listar": {"p99_ms": 10.5, "por_segundo": 95.0, "errores": 0}}}
+    peor = {"endpoints": {"listar": {"p99_ms": 20.0, "por_segundo": 50.0, "errores": 0}}}
+    assert carga.comparar(base, igual, tolerancia=0.1) == []
+    assert len(carga.comparar(base, peor, tolerancia=0.1)) == 2
+
+def test_carga_percentiles_solo_de_respuestas_2xx():
+    """Los 429/503 rapidos se cuentan en no_2xx y no bajan los percentiles de latencia."""
+    carga = _modulo_carga()
+    muestras = [('login', 0.100, 201)] * 10 + [('login', 0.0001, 429)] * 90 + [('login', 0.0002, 0)]
+    datos = carga.reporte(1.0, muestras, {})["endpoints"]["login"]
+    assert (datos["peticiones"], datos["exitosas"], datos["no_2xx"], datos["errores"]) == (101, 10, 91, 1)
+    assert datos["p50_ms"] == datos["p99_ms"] == 100.0
+    assert datos["por_segundo"] == 10.0
+
+# ----------------------------------------------------------------------
+# PRUEBAS DE LOS SNAPSHOTS EN CALIENTE
+# ----------------------------------------------------------------------
+
+def test_snapshot_con_escrituras_concurrentes_y_retencion(app, tmp_path):
+    """El snapshot se crea por pasos mientras otro hilo escribe, pasa integrity_check y la retencion conserva N."""
+    import threading
+    from respaldos import listar_snapshots, verificar_integridad
+    gestor = app.extensions['respaldos']
+    gestor.directorio, gestor.conservar, gestor.paginas = str(tmp_path), 2, 1
+    with app.app_context():
+        db = get_db_connection()
+        db.executemany("INSERT INTO productos (nombre, cantidad, precio, descripcion, usuario_id) VALUES (?, 1, 1.0, ?, 1)",
+                       [(f'Producto {i}', 'x' * 500) for i in range(300)])
+        db.commit()
+    fin = threading.Event()
+
+    def escritor():
+        conn = sqlite3.connect(app.config['DATABASE'], timeout=5)
+        while not fin.is_set():
+            conn.execute("INSERT INTO productos (nombre, cantidad, precio, usuario_id) VALUES ('Concurrente', 1, 1.0, 1)")
+            conn.commit()
+        conn.close()
+
+    hilo = threading.Thread(target=escritor)
+    hilo.start()
+    try:
+        resultados = [gestor.ejecutar()[0] for _ in range(3)]
+    finally:
+        fin.set()
+        hilo.join()
+    assert all(r["integridad"] == "ok" and r["archivo"].endswith('.db.gz') for r in resultados)
+    assert resultados[0]["pasos"] > 1
+    snapshots = listar_snapshots(str(tmp_path))
+    assert [s["archivo"] for s in snapshots] == [r["archivo"] for r in reversed(resultados[1:])]
+    assert verificar_integridad(snapshots[0]["archivo"])[0]
+    assert not [nombre for nombre in os.listdir(tmp_path) if nombre.endswith('.parcial')]
+
+def test_admin_respaldos_crea_y_lista(app, client, auth_header, tmp_path):
+    """POST /admin/respaldos?esperar=1 devuelve 201 con el snapshot y GET lo lista; un segundo snapshot en curso da 409."""
+    app.config['ADMIN_USUARIOS'] = ['1']
+    app.extensions['respaldos'].directorio = str(tmp_path)
+    response = client.post('/admin/respaldos?esperar=1', headers=auth_header)
+    assert response.status_code == 201
+    archivo = response.get_json()["resultados"][0]["archivo"]
+    estado = client.get('/admin/respaldos', headers=auth_header).get_json()
+    assert estado["en_curso"] is False and [s["archivo"] for s in estado["snapshots"]] == [archivo]
+    with app.extensions['respaldos']._bloqueo():
+        assert client.post('/admin/respaldos', headers=auth_header).status_code == 409
+
+def test_admin_respaldo_en_segundo_plano_409_si_otro_proceso_lo_tiene(app, client, auth_header, tmp_path):
+    """El 202 solo sale con el bloqueo tomado: si otro proceso tiene el flock responde 409 de inmediato."""
+    fcntl = pytest.importorskip('fcntl')
+    app.config['ADMIN_USUARIOS'] = ['1']
+    gestor = app.extensions['respaldos']
+    gestor.directorio = str(tmp_path)
+    fd = os.open(os.path.join(str(tmp_path), '.respaldo.lock'), os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        assert client.post('/admin/respaldos', headers=auth_header).status_code == 409
+    finally:
+        os.close(fd)
+    assert client.post('/admin/respaldos', headers=auth_header).status_code == 202
+    #el hilo suelta el bloqueo al terminar
+    with gestor._lock:
+        pass
+    assert gestor.ultimo is not None and "error" not in gestor.ultimo["resultados"][0]
+
+def test_respaldo_retencion_separa_bases_homonimas(tmp_path):
+    """Dos bases con el mismo nombre en distintos directorios no comparten la retencion."""
+    from respaldos import aplicar_retencion, crear_snapshot, listar_snapshots, prefijo_snapshot
+    bases = []
+    for carpeta in ('a', 'b'):
+        os.makedirs(tmp_path / carpeta)
+        ruta = str(tmp_path / carpeta / 's0.db')
+        conn = sqlite3.connect(ruta)
+        conn.execute("CREATE TABLE t (x)")
+        conn.close()
+        bases.append(ruta)
+    assert prefijo_snapshot(bases[0]) != prefijo_snapshot(bases[1])
+    directorio = str(tmp_path / 'respaldos')
+    for ruta in bases:
+        crear_snapshot(ruta, directorio, comprimir=False)
+    assert aplicar_retencion(directorio, bases[0], 0) and len(listar_snapshots(directorio)) == 1
+    assert listar_snapshots(directorio, bases[1])
+
+def test_respaldo_en_curso_sondea_el_flock(app, tmp_path):
+    """en_curso refleja el flock de otro proceso y se libera solo si ese proceso muere (sin archivo marca)."""
+    fcntl = pytest.importorskip('fcntl')
+    gestor = app.extensions['respaldos']
+    gestor.directorio = str(tmp_path)
+    assert gestor.en_curso() is False
+    #otra descripcion de archivo del mismo lock se comporta como otro proceso para flock
+    fd = os.open(os.path.join(str(tmp_path), '.respaldo.lock'), os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    gestor._visto = (0.0, False)
+    assert gestor.en_curso() is True
+    os.close(fd)
+    gestor._visto = (0.0, True)
+    assert gestor.en_curso() is False
+
+def test_cli_respaldo_y_metricas(app, client, tmp_path):
+    """flask respaldo crear/verificar funcionan y /metrics expone duracion, ultimo snapshot y latencia por estado."""
+    app.extensions['respaldos'].directorio = str(tmp_path)
+    runner = app.test_cli_runner()
+    resultado = runner.invoke(args=['respaldo', 'crear', '--sin-comprimir'])
+    assert resultado.exit_code == 0, resultado.output
+    archivo = resultado.output.split(' ')[0]
+    assert archivo.endswith('.db')
+    assert runner.invoke(args=['respaldo', 'verificar', archivo]).output.strip() == 'ok'
+    with open(archivo, 'r+b') as roto:
+        roto.seek(0)
+        roto.write(b'basura' * 10)
+    assert runner.invoke(args=['respaldo', 'verificar', archivo]).exit_code == 1
+    client.get('/')
+    texto = client.get('/metrics').get_data(as_text=True)
+    assert 'inventario_backup_duration_seconds_count{base=' in texto
+    assert 'inventario_backups_total{base=' in texto
+    assert 'inventario_backup_last_success_timestamp_seconds{base=' in texto
+    assert 'inventario_backup_in_progress 0' in texto
+    assert 'inventario_http_request_duration_by_backup_seconds_count{respaldo="inactivo"}' in texto
@@ -0,0 +1,5 @@
+#wsgi.py
+#punto de entrada WSGI de produccion: gunicorn -c gunicorn.conf.py wsgi:app
+from app import create_app
+
+app = create_app()